@@ -0,0 +1,296 @@
+"""
+Incrementally maintained analytics for /analytics
+
+The write path records deltas in memory: users created, sessions started
+and messages written, plus a Space-Saving sketch of preprocessed user
+queries. A background thread adds the deltas to the analytics_rollup table
+and merges the sketch into the stored one, so any number of workers can
+contribute. /analytics then reads a handful of rows by primary key instead
+of scanning User, Message and ChatSession.
+"""
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from collections import Counter
+from datetime import datetime
+
+import db_pool
+from heavy_hitters import SpaceSaving
+
+# Seconds between flushes of the in-memory deltas to the rollup table
+ANALYTICS_FLUSH_INTERVAL = float(os.environ.get('ANALYTICS_FLUSH_INTERVAL', '5'))
+
+# Counters in the common queries sketch, and how many /analytics returns
+ANALYTICS_SKETCH_CAPACITY = int(os.environ.get('ANALYTICS_SKETCH_CAPACITY', '1000'))
+ANALYTICS_TOP_QUERIES = int(os.environ.get('ANALYTICS_TOP_QUERIES', '5'))
+
+# Queries are cut to this length in the sketch, which bounds the stored JSON
+ANALYTICS_QUERY_MAX_CHARS = int(os.environ.get('ANALYTICS_QUERY_MAX_CHARS', '200'))
+
+# Seconds a read of the rollup table is reused by /analytics
+ANALYTICS_CACHE_TTL = float(os.environ.get('ANALYTICS_CACHE_TTL', '2'))
+
+COUNTERS = ('user_count', 'session_count', 'message_count', 'user_message_count')
+SKETCH_ROW = 'common_queries'
+
+_lock = threading.Lock()
+_deltas = Counter()
+_sketch = SpaceSaving(ANALYTICS_SKETCH_CAPACITY)
+_flusher = None
+_cache = {'at': 0.0, 'value': None}
+
+
+def _ensure_flusher():
+    global _flusher
+
+    if _flusher is None:
+        with _lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_loop, name='analytics-flusher', daemon=True)
+                _flusher.start()
+
+
+def sketch_key(query):
+    """
+    Normalize a user query for the common queries sketch
+    """
+    import nlp
+    return (nlp.preprocess_text(query) or query.lower())[:ANALYTICS_QUERY_MAX_CHARS]
+
+
+def record_user_created():
+    """
+    Count a newly registered user
+    """
+    with _lock:
+        _deltas['user_count'] += 1
+    _ensure_flusher()
+
+
+def record_session_started():
+    """
+    Count a new chat session
+    """
+    with _lock:
+        _deltas['session_count'] += 1
+    _ensure_flusher()
+
+
+def record_messages(records):
+    """
+    Count persisted messages and feed user queries into the sketch
+
+    Used as the message writer's flush hook, so only committed messages count.
+
+    Args:
+        records (list): Objects with sender_type and content
+    """
+    user_queries = [record.content for record in records if record.sender_type == 'user']
+    with _lock:
+        _deltas['message_count'] += len(records)
+        _deltas['user_message_count'] += len(user_queries)
+    for query in user_queries:
+        _sketch.add(sketch_key(query))
+    _ensure_flusher()
+
+
+def flush():
+    """
+    Add the pending deltas to the rollup table and merge the local sketch
+
+    The counters and the sketch are written in separate transactions, so
+    a failing sketch update cannot hold back the counters. Whatever fails
+    is put back and retried on the next flush.
+    """
+    global _sketch
+
+    with _lock:
+        deltas = {name: count for name, count in _deltas.items() if count}
+        _deltas.clear()
+        sketch, _sketch = _sketch, SpaceSaving(ANALYTICS_SKETCH_CAPACITY)
+
+    if deltas:
+        try:
+            with db_pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    now = datetime.utcnow()
+                    for name, delta in deltas.items():
+                        _increment(cursor, name, delta, now)
+                finally:
+                    cursor.close()
+            _cache['at'] = 0.0
+        except Exception as e:
+            logging.error(f"Error flushing analytics counters: {e}")
+            with _lock:
+                _deltas.update(deltas)
+
+    if len(sketch):
+        try:
+            with db_pool.connection() as conn:
+                cursor = conn.cursor()
+                try:
+                    _merge_sketch(cursor, sketch, datetime.utcnow())
+                finally:
+                    cursor.close()
+            _cache['at'] = 0.0
+        except Exception as e:
+            logging.error(f"Error flushing common queries sketch: {e}")
+            with _lock:
+                _sketch.merge(sketch.to_dict())
+
+
+def _increment(cursor, name, delta, now):
+    # Relative update, so concurrent workers never overwrite each other
+    cursor.execute(
+        "UPDATE analytics_rollup SET value = value + %s, updated_at = %s WHERE name = %s",
+        (delta, now, name)
+    )
+    if cursor.rowcount == 0:
+        cursor.execute(
+            "INSERT INTO analytics_rollup (name, value, updated_at) VALUES (%s, %s, %s)",
+            (name, delta, now)
+        )
+
+
+def _merge_sketch(cursor, sketch, now):
+    # Row lock so two workers merging at once do not lose each other's
+    # counts; SQLite has no row locks (only used for local runs)
+    lock = '' if db_pool.USE_SQLITE else ' FOR UPDATE'
+    cursor.execute(f"SELECT data FROM analytics_rollup WHERE name = %s{lock}", (SKETCH_ROW,))
+    row = cursor.fetchone()
+    if row is None:
+        cursor.execute(
+            "INSERT INTO analytics_rollup (name, value, data, updated_at) VALUES (%s, 0, %s, %s)",
+            (SKETCH_ROW, json.dumps(sketch.to_dict()), now)
+        )
+        return
+    stored = SpaceSaving.from_dict(json.loads(row[0]) if row[0] else {}, ANALYTICS_SKETCH_CAPACITY)
+    stored.merge(sketch.to_dict())
+    cursor.execute(
+        "UPDATE analytics_rollup SET data = %s, updated_at = %s WHERE name = %s",
+        (json.dumps(stored.to_dict()), now, SKETCH_ROW)
+    )
+
+
+# Registered at import, before get_writer() registers the message writer's
+# drain; atexit runs in reverse order, so messages drained at exit still count
+atexit.register(flush)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(ANALYTICS_FLUSH_INTERVAL)
+        flush()
+
+
+def read_rollups():
+    """
+    Read the rollup rows
+
+    Returns:
+        tuple: ({counter name: value}, stored sketch dict)
+    """
+    names = COUNTERS + (SKETCH_ROW,)
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT name, value, data FROM analytics_rollup WHERE name IN (%s, %s, %s, %s, %s)",
+                names
+            )
+            rows = cursor.fetchall()
+        finally:
+            cursor.close()
+
+    counters = {name: 0 for name in COUNTERS}
+    sketch = {}
+    for name, value, data in rows:
+        if name == SKETCH_ROW:
+            sketch = json.loads(data) if data else {}
+        else:
+            counters[name] = int(value)
+    return counters, sketch
+
+
+def get_analytics(top_n=ANALYTICS_TOP_QUERIES):
+    """
+    Get the /analytics payload from the rollups, independent of table sizes
+
+    Deltas not flushed yet by this worker are included.
+
+    Returns:
+        dict: user_count, message_count, avg_messages (per session) and
+            common_queries as [query, count] pairs
+    """
+    now = time.monotonic()
+    if _cache['value'] is None or now - _cache['at'] > ANALYTICS_CACHE_TTL:
+        _cache['value'] = read_rollups()
+        _cache['at'] = now
+    counters, stored_sketch = _cache['value']
+
+    with _lock:
+        counters = {name: counters[name] + _deltas.get(name, 0) for name in COUNTERS}
+        local_sketch = _sketch.to_dict()
+    sketch = SpaceSaving.from_dict(stored_sketch, ANALYTICS_SKETCH_CAPACITY)
+    sketch.merge(local_sketch)
+
+    sessions = counters['session_count']
+    return {
+        'user_count': counters['user_count'],
+        'message_count': counters['message_count'],
+        'avg_messages': round(counters['message_count'] / sessions, 1) if sessions else 0,
+        'common_queries': [[query, count] for query, count, _ in sketch.top(top_n)]
+    }
+
+
+def rebuild_rollups():
+    """
+    Recompute every rollup with full scans, e.g. once after deploying or
+    to correct drift from deltas lost in a crash
+
+    The sketch is seeded with exact counts of the most frequent user
+    messages, preprocessed like the ones recorded later.
+    """
+    # "user" is a reserved word in PostgreSQL
+    user_table = 'user' if db_pool.USE_MYSQL else '"user"'
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            counts = {}
+            for name, query in (
+                ('user_count', f'SELECT COUNT(*) FROM {user_table}'),
+                ('session_count', 'SELECT COUNT(*) FROM chat_session'),
+                ('message_count', 'SELECT COUNT(*) FROM message'),
+                ('user_message_count', "SELECT COUNT(*) FROM message WHERE sender_type = 'user'")
+            ):
+                cursor.execute(query)
+                counts[name] = cursor.fetchone()[0]
+
+            cursor.execute(
+                "SELECT content, COUNT(*) AS n FROM message WHERE sender_type = 'user' "
+                "GROUP BY content ORDER BY n DESC LIMIT %s",
+                (ANALYTICS_SKETCH_CAPACITY,)
+            )
+            sketch = SpaceSaving(ANALYTICS_SKETCH_CAPACITY)
+            for content, count in cursor.fetchall():
+                sketch.add(sketch_key(content), count)
+
+            now = datetime.utcnow()
+            cursor.execute("DELETE FROM analytics_rollup")
+            for name, value in counts.items():
+                cursor.execute(
+                    "INSERT INTO analytics_rollup (name, value, updated_at) VALUES (%s, %s, %s)",
+                    (name, value, now)
+                )
+            cursor.execute(
+                "INSERT INTO analytics_rollup (name, value, data, updated_at) VALUES (%s, 0, %s, %s)",
+                (SKETCH_ROW, json.dumps(sketch.to_dict()), now)
+            )
+        finally:
+            cursor.close()
+    _cache['at'] = 0.0
+    logging.info(f"Analytics rollups rebuilt: {counts}")
@@ -0,0 +1,374 @@
+"""
+ASGI serving mode for the chat pipeline
+
+A small framework-free ASGI application around the async cascade. Run it
+with any ASGI server, e.g.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 4
+
+or set SERVER_MODE=asgi and run main.py. Worker processes come from
+ASGI_WORKERS, the per-process pools from ASYNC_CPU_WORKERS and
+ASYNC_IO_WORKERS (see cascade.py).
+
+Routes:
+    POST /chat          {"message": str} -> JSON
+    POST /chat/stream   same body -> text/event-stream
+    GET  /health        liveness and pool settings
+    GET  /metrics       Prometheus text metrics
+
+Conversation context is kept per logged-in user, identified by the Flask
+login session cookie (signed with SECRET_KEY); anonymous requests are
+answered without context. A session_id in the body is not trusted: sending
+one without a login session is rejected with 400.
+
+Admin routes need the X-Admin-Token header to match PROFILING_ADMIN_TOKEN
+and do not exist when it is unset:
+    GET  /admin/profiling          capture status, top functions, allocation sites
+    POST /admin/profiling          {"enabled": bool, "sample_rate": float,
+                                    "duration_seconds": float, "trace_allocations": bool}
+    GET  /admin/profiling/pstats   aggregated profile as a pstats file
+    GET  /admin/profiling/folded   collapsed stacks for flame graphs
+"""
+import os
+import hmac
+import json
+import logging
+from datetime import timedelta
+from http.cookies import SimpleCookie, CookieError
+
+import cascade
+import metrics
+import profiler
+from session_context import session_store
+
+metrics.configure_logging()
+
+ASGI_WORKERS = int(os.environ.get('ASGI_WORKERS', os.environ.get('WEB_CONCURRENCY', '1')))
+
+# Requests with larger bodies are rejected
+MAX_BODY_BYTES = int(os.environ.get('ASGI_MAX_BODY_BYTES', '65536'))
+
+PROFILING_ADMIN_TOKEN = os.environ.get('PROFILING_ADMIN_TOKEN')
+
+# Must match the Flask app, whose login session cookie identifies users
+SECRET_KEY = os.environ.get('SECRET_KEY') or os.environ.get('SESSION_SECRET')
+SESSION_COOKIE_NAME = os.environ.get('SESSION_COOKIE_NAME', 'session')
+SESSION_LIFETIME = timedelta(days=float(os.environ.get('SESSION_LIFETIME_DAYS', '31')))
+
+_session_serializer = None
+
+
+async def read_body(receive):
+    """
+    Read the full request body
+
+    Returns:
+        bytes: Body, or None if it exceeds MAX_BODY_BYTES
+    """
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        if len(body) > MAX_BODY_BYTES:
+            return None
+        more_body = message.get('more_body', False)
+    return body
+
+
+async def send_body(send, status, body, content_type, headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', content_type.encode('ascii')),
+            (b'content-length', str(len(body)).encode('ascii')),
+            *headers
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, status, payload):
+    await send_body(send, status, json.dumps(payload).encode('utf-8'), 'application/json')
+
+
+def get_session_serializer():
+    """
+    Build the serializer Flask uses for its session cookie, on first use
+
+    Returns:
+        URLSafeTimedSerializer: Or None if SECRET_KEY is not set
+    """
+    global _session_serializer
+
+    if _session_serializer is None and SECRET_KEY:
+        import hashlib
+        from itsdangerous import URLSafeTimedSerializer
+        from flask.sessions import session_json_serializer
+
+        # Same settings as flask.sessions.SecureCookieSessionInterface
+        _session_serializer = URLSafeTimedSerializer(
+            SECRET_KEY,
+            salt='cookie-session',
+            serializer=session_json_serializer,
+            signer_kwargs={'key_derivation': 'hmac', 'digest_method': hashlib.sha1}
+        )
+    return _session_serializer
+
+
+def get_user_id(scope):
+    """
+    Get the logged-in user from the Flask session cookie
+
+    Returns:
+        str: flask_login user id, or None for anonymous or invalid sessions
+    """
+    serializer = get_session_serializer()
+    if serializer is None:
+        return None
+
+    cookie_header = dict(scope.get('headers') or []).get(b'cookie', b'').decode('latin-1')
+    cookies = SimpleCookie()
+    try:
+        cookies.load(cookie_header)
+    except CookieError:
+        return None
+    morsel = cookies.get(SESSION_COOKIE_NAME)
+    if morsel is None:
+        return None
+
+    try:
+        data = serializer.loads(morsel.value, max_age=int(SESSION_LIFETIME.total_seconds()))
+    except Exception:
+        # Bad signature, expired or malformed
+        return None
+    user_id = data.get('_user_id') if isinstance(data, dict) else None
+    return str(user_id) if user_id is not None else None
+
+
+def context_key(scope, session_id):
+    """
+    Get the session store key for a chat request
+
+    Args:
+        scope (dict): ASGI scope
+        session_id: session_id from the request body, if any
+
+    Returns:
+        tuple: (key, error) -- key is None for requests answered without
+            context, error is set when the request must be rejected
+    """
+    user_id = get_user_id(scope)
+    if user_id is None:
+        if session_id is not None:
+            return None, 'Conversation context requires a login session'
+        return None, None
+    # Namespaced so it cannot collide with ChatSession ids used elsewhere
+    return f'user:{user_id}', None
+
+
+async def parse_chat_request(receive, send):
+    """
+    Parse and validate a chat request body, answering 400/413 on bad input
+
+    Returns:
+        tuple: (message, session_id), or None if an error response was sent
+    """
+    body = await read_body(receive)
+    if body is None:
+        await send_json(send, 413, {'error': 'Request body too large'})
+        return None
+    try:
+        data = json.loads(body or b'{}')
+    except ValueError:
+        await send_json(send, 400, {'error': 'Invalid JSON'})
+        return None
+
+    message = str(data.get('message', '')).strip() if isinstance(data, dict) else ''
+    if not message:
+        await send_json(send, 400, {'error': 'Message is required'})
+        return None
+    return message, data.get('session_id')
+
+
+async def handle_chat(scope, receive, send):
+    parsed = await parse_chat_request(receive, send)
+    if parsed is None:
+        return
+    message, session_id = parsed
+    key, error = context_key(scope, session_id)
+    if error:
+        await send_json(send, 400, {'error': error})
+        return
+
+    chat_history = session_store.get_history(key) if key is not None else None
+    response, trace = await cascade.get_cascade_response_async(message, chat_history)
+    if key is not None:
+        session_store.record_turn(key, 'user', message)
+        session_store.record_turn(key, 'bot', response)
+
+    await send_json(send, 200, {'response': response, 'source': trace['selected']})
+
+
+async def handle_chat_stream(scope, receive, send):
+    parsed = await parse_chat_request(receive, send)
+    if parsed is None:
+        return
+    message, session_id = parsed
+    key, error = context_key(scope, session_id)
+    if error:
+        await send_json(send, 400, {'error': error})
+        return
+
+    chat_history = session_store.get_history(key) if key is not None else None
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no')
+        ]
+    })
+
+    # The status line is sent, so failures end the stream with an error event
+    response = None
+    try:
+        async for event in cascade.stream_cascade_events_async(message, chat_history):
+            await send({'type': 'http.response.body', 'body': event.encode('utf-8'), 'more_body': True})
+            data = json.loads(event[len('data: '):])
+            if data.get('done'):
+                response = data.get('response')
+    except Exception as e:
+        logging.error(f"Error streaming chat response: {e}")
+        response = None
+        error = json.dumps({'error': 'stream_failed', 'done': True})
+        try:
+            await send({'type': 'http.response.body', 'body': f"data: {error}\n\n".encode('utf-8'), 'more_body': True})
+        except Exception:
+            # The client is gone; there is nobody left to tell
+            return
+    await send({'type': 'http.response.body', 'body': b''})
+
+    # Keep the session context current with the full streamed answer
+    if key is not None and response is not None:
+        session_store.record_turn(key, 'user', message)
+        session_store.record_turn(key, 'bot', response)
+
+
+def is_admin(scope):
+    """
+    Check the X-Admin-Token header against PROFILING_ADMIN_TOKEN
+    """
+    if not PROFILING_ADMIN_TOKEN:
+        return False
+    token = dict(scope.get('headers') or []).get(b'x-admin-token', b'')
+    return hmac.compare_digest(token, PROFILING_ADMIN_TOKEN.encode('utf-8'))
+
+
+async def handle_profiling(scope, receive, send):
+    path, method = scope['path'], scope['method']
+
+    if path == '/admin/profiling' and method == 'GET':
+        await send_json(send, 200, {
+            'status': profiler.status(),
+            'top_functions': profiler.top_functions(),
+            'allocation_sites': profiler.allocation_sites()
+        })
+    elif path == '/admin/profiling' and method == 'POST':
+        body = await read_body(receive)
+        if body is None:
+            await send_json(send, 413, {'error': 'Request body too large'})
+            return
+        try:
+            data = json.loads(body or b'{}')
+            if not isinstance(data, dict):
+                raise ValueError("Expected a JSON object")
+            if data.get('enabled'):
+                status = profiler.enable(
+                    sample_rate=float(data.get('sample_rate', 0.01)),
+                    duration_seconds=float(data.get('duration_seconds', 300)),
+                    trace_allocations=bool(data.get('trace_allocations', False))
+                )
+            else:
+                status = profiler.disable()
+        except (TypeError, ValueError) as e:
+            await send_json(send, 400, {'error': f'Invalid profiling settings: {e}'})
+            return
+        await send_json(send, 200, status)
+    elif path == '/admin/profiling/pstats' and method == 'GET':
+        data = profiler.pstats_bytes()
+        if data is None:
+            await send_json(send, 404, {'error': 'No requests profiled yet'})
+            return
+        await send_body(send, 200, data, 'application/octet-stream', [
+            (b'content-disposition', b'attachment; filename="chat.pstats"')
+        ])
+    elif path == '/admin/profiling/folded' and method == 'GET':
+        await send_body(send, 200, profiler.folded_stacks().encode('utf-8'), 'text/plain; charset=utf-8')
+    else:
+        await send_json(send, 404, {'error': 'Not found'})
+
+
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            logging.info(
+                f"ASGI worker started: {cascade.ASYNC_CPU_WORKERS} CPU workers, "
+                f"{cascade.ASYNC_IO_WORKERS} I/O workers"
+            )
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            cascade.shutdown_pools(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """
+    ASGI entry point
+    """
+    if scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    method, path = scope['method'], scope['path']
+    started = False
+
+    async def tracked_send(message):
+        nonlocal started
+        if message['type'] == 'http.response.start':
+            started = True
+        await send(message)
+
+    try:
+        if path == '/chat' and method == 'POST':
+            await handle_chat(scope, receive, tracked_send)
+        elif path == '/chat/stream' and method == 'POST':
+            await handle_chat_stream(scope, receive, tracked_send)
+        elif path == '/metrics' and method == 'GET':
+            await send_body(tracked_send, 200, metrics.render().encode('utf-8'), metrics.CONTENT_TYPE)
+        elif path.startswith('/admin/profiling') and is_admin(scope):
+            await handle_profiling(scope, receive, tracked_send)
+        elif path == '/health' and method == 'GET':
+            await send_json(tracked_send, 200, {
+                'status': 'ok',
+                'cpu_workers': cascade.ASYNC_CPU_WORKERS,
+                'io_workers': cascade.ASYNC_IO_WORKERS
+            })
+        else:
+            await send_json(tracked_send, 404, {'error': 'Not found'})
+    except Exception as e:
+        logging.error(f"Error handling {method} {path}: {e}")
+        if started:
+            # A second http.response.start would break the protocol; end the body
+            try:
+                await send({'type': 'http.response.body', 'body': b''})
+            except Exception:
+                pass
+            return
+        await send_json(send, 500, {'error': 'Internal server error'})
@@ -0,0 +1,330 @@
+"""
+Benchmarks for the chat hot path
+
+Measures throughput, p50/p99 latency and peak RSS of preprocessing, rule
+responses, model/fallback responses and training on synthetic corpora
+generated from the default training data. Every case runs in a fresh
+interpreter so peak RSS and model state belong to that case alone.
+
+    python benchmark.py                                 # all cases, 1k to 1M rows
+    python benchmark.py --sizes 1000,10000 --bench get_response_model
+    python benchmark.py --save-baseline                 # record bench_baseline.json
+    python benchmark.py --threshold 0.1                 # exit 1 on >10% regressions
+
+Baselines are machine specific: record them on the machine that compares.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+DEFAULT_BASELINE = os.environ.get('BENCH_BASELINE', os.path.join(PROJECT_DIR, 'bench_baseline.json'))
+DEFAULT_THRESHOLD = float(os.environ.get('BENCH_THRESHOLD', '0.2'))
+
+# Latency changes smaller than this are treated as noise
+NOISE_MS = float(os.environ.get('BENCH_NOISE_MS', '0.01'))
+
+# Benchmark name -> whether its cost depends on the corpus size
+BENCHMARKS = {
+    'preprocess_text': False,
+    'get_response_based_on_type': False,
+    'get_response_model': True,
+    'get_response_fallback': True,
+    'train_model': True,
+}
+
+# Words mixed into synthetic questions so the vocabulary grows with the corpus
+FILLER_WORDS = [
+    'please', 'quickly', 'today', 'again', 'exactly', 'really', 'now', 'soon',
+    'briefly', 'simply', 'honestly', 'actually', 'maybe', 'later', 'first',
+]
+
+
+def generate_corpus(size, answer_variants=10, seed=0):
+    """
+    Generate a synthetic Q/A corpus from the default training data
+
+    Questions are default questions with a few filler and numbered topic
+    words appended; answers are default answers spread over a fixed number
+    of variants, so the class count stays realistic as the corpus grows.
+
+    Args:
+        size (int): Number of rows
+        answer_variants (int): Variants per default answer
+        seed (int): Random seed, the same seed gives the same corpus
+
+    Returns:
+        tuple: (questions, answers) lists
+    """
+    import ml_model
+
+    base_questions, base_answers = ml_model.load_default_training_data()
+    rng = random.Random(seed)
+    topics = max(size // 20, 1)
+
+    questions = []
+    answers = []
+    for i in range(size):
+        j = rng.randrange(len(base_questions))
+        extra = rng.sample(FILLER_WORDS, 2)
+        questions.append(f"{base_questions[j]} {extra[0]} topic{rng.randrange(topics)} {extra[1]}")
+        answers.append(f"{base_answers[j]} [{i % answer_variants}]")
+    return questions, answers
+
+
+def summarize(latencies_ns, wall_seconds):
+    """
+    Summarize per-operation latencies
+
+    Args:
+        latencies_ns (list): Nanoseconds per operation
+        wall_seconds (float): Wall time of the timed loop
+
+    Returns:
+        dict: ops, throughput (ops/s), p50_ms and p99_ms
+    """
+    ordered = sorted(latencies_ns)
+    count = len(ordered)
+
+    def percentile(p):
+        return ordered[min(count - 1, int(p * count))] / 1e6
+
+    return {
+        'ops': count,
+        'throughput': round(count / wall_seconds, 2) if wall_seconds else 0.0,
+        'p50_ms': round(percentile(0.50), 4),
+        'p99_ms': round(percentile(0.99), 4),
+    }
+
+
+def time_calls(fn, inputs, iterations, before_each=None):
+    """
+    Call fn once per iteration, cycling through inputs
+
+    Args:
+        fn (callable): Function under test, called with one input
+        inputs (list): Inputs to cycle through
+        iterations (int): Number of timed calls
+        before_each (callable, optional): Untimed reset run before every call
+
+    Returns:
+        dict: See summarize()
+    """
+    latencies = []
+    timed = 0.0
+    for i in range(iterations):
+        if before_each is not None:
+            before_each()
+        value = inputs[i % len(inputs)]
+        start = time.perf_counter_ns()
+        fn(value)
+        elapsed = time.perf_counter_ns() - start
+        latencies.append(elapsed)
+        timed += elapsed
+    return summarize(latencies, timed / 1e9)
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in MB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def use_corpus(ml_model, questions, answers):
+    """
+    Make train_model() read the synthetic corpus instead of the database
+    """
+    ids = list(range(1, len(questions) + 1))
+    ml_model.fetch_training_columns = lambda since_id=None: (ids, questions, answers)
+
+
+def run_case(name, size, iterations, train_repeats, answer_variants, seed):
+    """
+    Run one benchmark in this process
+
+    Returns:
+        dict: Summary plus peak_rss_mb
+    """
+    import nlp
+    import responses
+    import ml_model
+
+    questions, answers = generate_corpus(size, answer_variants, seed)
+    rng = random.Random(seed + 1)
+    sample = rng.sample(questions, min(len(questions), 1000))
+
+    if name == 'preprocess_text':
+        nlp.preprocess_text(sample[0])
+        result = time_calls(nlp.preprocess_text, sample, iterations)
+
+    elif name == 'get_response_based_on_type':
+        inputs = sample + ['hello there', 'goodbye for now', 'thanks a lot'] * 10
+        rng.shuffle(inputs)
+        result = time_calls(responses.get_response_based_on_type, inputs, iterations)
+
+    elif name in ('get_response_model', 'get_response_fallback'):
+        use_corpus(ml_model, questions, answers)
+        ml_model.train_model()
+        inputs = [nlp.preprocess_text(text) for text in sample]
+
+        if name == 'get_response_fallback':
+            # The state of a worker whose first model is still training:
+            # answers come from the fallback index and retrain requests are
+            # only coalesced
+            ml_model.model_trained = False
+            ml_model.model_training_data = (questions, answers)
+            ml_model.training_status['state'] = 'running'
+
+        # Build the fallback index and warm the caches outside the timed loop
+        ml_model.get_response(inputs[0])
+        # Every call is a cache miss, as for a new question
+        result = time_calls(ml_model.get_response, inputs, iterations,
+                            before_each=ml_model.response_cache.clear)
+
+    elif name == 'train_model':
+        use_corpus(ml_model, questions, answers)
+        result = time_calls(lambda _: ml_model.train_model(), [None], train_repeats)
+
+    else:
+        raise ValueError(f"Unknown benchmark: {name}")
+
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def run_case_subprocess(name, size, args):
+    """
+    Run one benchmark in a fresh interpreter with its own artifact directory
+
+    Returns:
+        dict: Result of run_case()
+    """
+    with tempfile.TemporaryDirectory(prefix='bench-artifacts-') as artifact_dir:
+        env = dict(os.environ, MODEL_ARTIFACT_DIR=artifact_dir)
+        command = [
+            sys.executable, os.path.abspath(__file__), '--run-case', name,
+            '--sizes', str(size),
+            '--iterations', str(args.iterations),
+            '--train-repeats', str(args.train_repeats),
+            '--answer-variants', str(args.answer_variants),
+            '--seed', str(args.seed),
+        ]
+        result = subprocess.run(command, cwd=PROJECT_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Benchmark {name}@{size} failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, threshold, noise_ms=NOISE_MS):
+    """
+    Find results that regressed against the baseline
+
+    Args:
+        results (dict): Case key -> summary
+        baseline (dict): Case key -> summary from an earlier run
+        threshold (float): Allowed relative regression, e.g. 0.2 for 20%
+        noise_ms (float): Latency changes below this are ignored
+
+    Returns:
+        list: Human-readable regression descriptions
+    """
+    regressions = []
+    for key, result in results.items():
+        previous = baseline.get(key)
+        if not previous:
+            continue
+        for metric in ('p50_ms', 'p99_ms'):
+            old, new = previous[metric], result[metric]
+            if new - old > noise_ms and new > old * (1 + threshold):
+                regressions.append(f"{key} {metric}: {old:.4f} -> {new:.4f} ms")
+        if result['throughput'] < previous['throughput'] * (1 - threshold):
+            regressions.append(f"{key} throughput: {previous['throughput']:.1f} -> {result['throughput']:.1f} ops/s")
+        if result['peak_rss_mb'] > previous['peak_rss_mb'] * (1 + threshold):
+            regressions.append(f"{key} peak_rss_mb: {previous['peak_rss_mb']:.1f} -> {result['peak_rss_mb']:.1f}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bench', action='append', choices=sorted(BENCHMARKS),
+                        help='Benchmark to run, may be repeated (default: all)')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help='Comma-separated corpus sizes in rows')
+    parser.add_argument('--iterations', type=int, default=2000, help='Timed calls per per-request benchmark')
+    parser.add_argument('--train-repeats', type=int, default=3, help='Timed train_model() runs per size')
+    parser.add_argument('--answer-variants', type=int, default=10, help='Variants per default answer')
+    parser.add_argument('--seed', type=int, default=0, help='Corpus seed')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='Write the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Fail if a metric regresses by more than this fraction')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+
+    # Child process: run a single case and print its result as JSON
+    if args.run_case:
+        import logging
+        logging.getLogger().setLevel(logging.WARNING)
+        result = run_case(args.run_case, sizes[0], args.iterations, args.train_repeats,
+                          args.answer_variants, args.seed)
+        print(json.dumps(result))
+        return 0
+
+    results = {}
+    print(f"{'case':<40} {'ops/s':>12} {'p50 ms':>10} {'p99 ms':>10} {'peak MB':>9}")
+    for name in args.bench or list(BENCHMARKS):
+        # Size-independent benchmarks run once, on the smallest corpus
+        for size in (sizes if BENCHMARKS[name] else sizes[:1]):
+            key = f"{name}@{size}" if BENCHMARKS[name] else name
+            result = run_case_subprocess(name, size, args)
+            results[key] = result
+            print(f"{key:<40} {result['throughput']:>12.1f} {result['p50_ms']:>10.4f} "
+                  f"{result['p99_ms']:>10.4f} {result['peak_rss_mb']:>9.1f}", flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}, run with --save-baseline to record one")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\nRegressions beyond {args.threshold:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print(f"\nNo regressions beyond {args.threshold:.0%} against {args.baseline}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,554 @@
+"""
+Confidence-gated cascade between rule responses, the local model and Gemini
+"""
+import os
+import time
+import json
+import asyncio
+import uuid
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import nlp
+import metrics
+import profiler
+import responses
+import ml_model
+from gemini_client import get_gemini_response, stream_gemini_response, gemini_available, get_gemini_stats
+
+logger = logging.getLogger(__name__)
+
+# A local model answer is served only if its confidence is above this
+# threshold, otherwise the request escalates to Gemini. The score is the
+# top class probability for the NB backend and the cosine similarity for
+# the retrieval backend, so tune it per deployment.
+MODEL_CONFIDENCE_THRESHOLD = float(os.environ.get('CASCADE_MODEL_THRESHOLD', '0.0'))
+
+# Fallback-matcher answers use the word overlap score (direct matches are 1.0)
+FALLBACK_CONFIDENCE_THRESHOLD = float(os.environ.get('CASCADE_FALLBACK_THRESHOLD', '0.5'))
+
+# Latency budgets in milliseconds: the whole request, and the Gemini stage
+TOTAL_BUDGET_MS = float(os.environ.get('CASCADE_TOTAL_BUDGET_MS', '8000'))
+GEMINI_BUDGET_MS = float(os.environ.get('CASCADE_GEMINI_BUDGET_MS', '6000'))
+
+# Gemini is skipped when less than this much of the total budget is left
+GEMINI_MIN_REMAINING_MS = float(os.environ.get('CASCADE_GEMINI_MIN_REMAINING_MS', '500'))
+
+GEMINI_ENABLED = os.environ.get('CASCADE_GEMINI_ENABLED', 'true').lower() == 'true'
+
+# Number of recent decision traces kept in memory for tuning
+TRACE_BUFFER_SIZE = int(os.environ.get('CASCADE_TRACE_BUFFER', '500'))
+
+_gemini_pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('CASCADE_GEMINI_WORKERS', '8')),
+    thread_name_prefix='cascade-gemini'
+)
+
+# Pools used by the async entry points: CPU-bound stages (preprocessing,
+# prediction) and blocking I/O (Gemini SDK, database) run off the event loop
+ASYNC_CPU_WORKERS = int(os.environ.get('ASYNC_CPU_WORKERS', str(os.cpu_count() or 1)))
+ASYNC_IO_WORKERS = int(os.environ.get('ASYNC_IO_WORKERS', '32'))
+
+_cpu_pool = ThreadPoolExecutor(max_workers=ASYNC_CPU_WORKERS, thread_name_prefix='cascade-cpu')
+_io_pool = ThreadPoolExecutor(max_workers=ASYNC_IO_WORKERS, thread_name_prefix='cascade-io')
+
+_traces = deque(maxlen=TRACE_BUFFER_SIZE)
+_stats_lock = threading.Lock()
+_stats = {
+    'requests': 0,
+    'selected': {},
+    'gemini_calls': 0,
+    'gemini_timeouts': 0,
+    'gemini_errors': 0,
+    'gemini_short_circuits': 0
+}
+
+
+REQUEST_SECONDS = metrics.histogram(
+    'chatbot_cascade_duration_seconds', 'Total cascade time per request by selected stage', ('selected',)
+)
+
+
+def _collect_metrics():
+    with _stats_lock:
+        stats = dict(_stats)
+        selected = dict(_stats['selected'])
+    return [
+        ('chatbot_cascade_requests_total', 'counter', 'Cascade requests by the stage that answered',
+         [({'selected': name}, count) for name, count in selected.items()]),
+        ('chatbot_cascade_gemini_total', 'counter', 'Gemini stage outcomes in the cascade',
+         [({'outcome': 'call'}, stats['gemini_calls']),
+          ({'outcome': 'timeout'}, stats['gemini_timeouts']),
+          ({'outcome': 'error'}, stats['gemini_errors']),
+          ({'outcome': 'short_circuit'}, stats['gemini_short_circuits'])]),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
+
+
+def _elapsed_ms(start):
+    return (time.perf_counter() - start) * 1000
+
+
+def _record(stat, amount=1):
+    with _stats_lock:
+        _stats[stat] += amount
+
+
+def _call_gemini(prompt, chat_history, budget_ms, trace):
+    """
+    Call Gemini within a latency budget
+
+    Returns:
+        str: Gemini response, or None on error, empty answer or timeout
+    """
+    start = time.perf_counter()
+    _record('gemini_calls')
+    # The client enforces the budget as its call deadline; the future
+    # timeout is a backstop in case the SDK overruns it
+    future = _gemini_pool.submit(get_gemini_response, prompt, chat_history, budget_ms)
+    try:
+        result = future.result(timeout=budget_ms / 1000.0)
+        outcome = 'answered' if result else 'error'
+        if not result:
+            _record('gemini_errors')
+    except FutureTimeoutError:
+        # The call keeps running on the pool, its result is dropped
+        result = None
+        outcome = 'timeout'
+        _record('gemini_timeouts')
+    except Exception as e:
+        logger.error(f"Error calling Gemini from cascade: {e}")
+        result = None
+        outcome = 'error'
+        _record('gemini_errors')
+
+    trace['stages'].append({
+        'stage': 'gemini',
+        'outcome': outcome,
+        'budget_ms': budget_ms,
+        'latency_ms': _elapsed_ms(start)
+    })
+    return result
+
+
+def _new_trace():
+    return {
+        'id': uuid.uuid4().hex,
+        'started_at': time.time(),
+        'stages': [],
+        'selected': None
+    }
+
+
+def _run_rule_stage(message, trace):
+    """
+    Run the rule stage, then preprocess the message for the model stage
+
+    Returns:
+        tuple: (rule response, None) if a rule answered, else (None, preprocessed text)
+    """
+    # Stage 1: rule-based responses (greetings, farewells, thanks)
+    stage_start = time.perf_counter()
+    rule_response = responses.get_response_based_on_type(message)
+    trace['stages'].append({
+        'stage': 'rules',
+        'outcome': 'answered' if rule_response else 'pass',
+        'latency_ms': _elapsed_ms(stage_start)
+    })
+    if rule_response:
+        trace['selected'] = 'rules'
+        return rule_response, None
+
+    stage_start = time.perf_counter()
+    processed = nlp.preprocess_text(message)
+    trace['stages'].append({'stage': 'preprocess', 'latency_ms': _elapsed_ms(stage_start)})
+    return None, processed
+
+
+def _apply_model_score(scored, stage_start, trace):
+    """
+    Record the model stage and decide whether its answer is confident enough
+
+    Args:
+        scored (tuple): (answer, confidence, source), or None if prediction failed
+        stage_start (float): perf_counter() when the model stage started
+
+    Returns:
+        tuple: (response or None, low-confidence (answer, source) candidate or None)
+    """
+    stage = {'stage': 'model', 'latency_ms': _elapsed_ms(stage_start)}
+    response = None
+    candidate = None
+
+    if scored is None:
+        stage['outcome'] = 'error'
+    else:
+        answer, confidence, source = scored
+        threshold = FALLBACK_CONFIDENCE_THRESHOLD if source == 'fallback' else MODEL_CONFIDENCE_THRESHOLD
+        stage.update(source=source, confidence=confidence, threshold=threshold)
+        if source != 'unknown' and confidence > threshold:
+            stage['outcome'] = 'answered'
+            response = answer
+            trace['selected'] = source
+        else:
+            stage['outcome'] = 'escalate'
+            if source != 'unknown':
+                candidate = (answer, source)
+    trace['stages'].append(stage)
+    return response, candidate
+
+
+def _run_local_stages(message, trace):
+    """
+    Run the rule and local model stages
+
+    Returns:
+        tuple: (response or None, low-confidence (answer, source) candidate or None)
+    """
+    rule_response, processed = _run_rule_stage(message, trace)
+    if rule_response:
+        return rule_response, None
+
+    # Stage 2: local model (or fallback matcher) with its confidence.
+    # Concurrent requests share one vectorized predict through the micro-batcher
+    stage_start = time.perf_counter()
+    scored = ml_model.get_scored_response_batched(processed)
+    return _apply_model_score(scored, stage_start, trace)
+
+
+async def _run_local_stages_async(message, trace):
+    """
+    Async version of _run_local_stages
+
+    The rule stage and preprocessing run on the CPU pool. The model stage
+    awaits its micro-batch without holding a pool thread, so requests batch
+    together however few CPU workers there are.
+    """
+    rule_response, processed = await run_cpu(profiler.call, _run_rule_stage, message, trace)
+    if rule_response:
+        return rule_response, None
+
+    stage_start = time.perf_counter()
+    try:
+        scored = await asyncio.wrap_future(ml_model.submit_scored_response(processed))
+    except Exception as e:
+        logger.error(f"Error getting batched model response: {e}")
+        scored = None
+    return _apply_model_score(scored, stage_start, trace)
+
+
+def _gemini_budget_ms(start, trace):
+    """
+    Get the latency budget for the Gemini stage
+
+    Returns:
+        float: Budget in ms, or None if Gemini is disabled, out of budget or
+            its circuit breaker is open
+    """
+    remaining_ms = TOTAL_BUDGET_MS - _elapsed_ms(start)
+    if not GEMINI_ENABLED:
+        trace['stages'].append({'stage': 'gemini', 'outcome': 'disabled'})
+        return None
+    if remaining_ms < GEMINI_MIN_REMAINING_MS:
+        trace['stages'].append({'stage': 'gemini', 'outcome': 'skipped_budget', 'remaining_ms': remaining_ms})
+        return None
+    # Gemini is degraded: go straight to the local answer or generic fallback
+    if not gemini_available():
+        trace['stages'].append({'stage': 'gemini', 'outcome': 'circuit_open'})
+        _record('gemini_short_circuits')
+        return None
+    return min(GEMINI_BUDGET_MS, remaining_ms)
+
+
+def _finish(response, candidate, trace, start):
+    """
+    Apply the low-confidence and generic fallbacks and record the trace
+
+    Returns:
+        str: Final response
+    """
+    # Stage 4: low-confidence local answer, then generic fallback
+    if response is None and candidate is not None:
+        response, source = candidate
+        trace['selected'] = f'{source}_low_confidence'
+    if response is None:
+        response = responses.get_fallback_response()
+        trace['selected'] = 'fallback_response'
+
+    trace['total_ms'] = _elapsed_ms(start)
+    _traces.append(trace)
+    with _stats_lock:
+        _stats['requests'] += 1
+        _stats['selected'][trace['selected']] = _stats['selected'].get(trace['selected'], 0) + 1
+
+    # One sampling decision per request, so a sampled request is complete
+    if metrics.sampled():
+        for stage in trace['stages']:
+            if 'latency_ms' in stage:
+                metrics.observe_stage(stage['stage'], stage['latency_ms'] / 1000.0)
+        REQUEST_SECONDS.observe(trace['total_ms'] / 1000.0, trace['selected'])
+
+    if metrics.log_sampled():
+        logger.info(f"Cascade decision {trace['id']}: {trace['selected']} in {trace['total_ms']:.1f}ms")
+        logger.debug(f"Cascade trace: {trace}")
+    return response
+
+
+def get_cascade_response(message, chat_history=None):
+    """
+    Get a response by escalating through rules, local model and Gemini
+
+    Each stage either answers with enough confidence or passes the request
+    on. The best local candidate is kept so a low-confidence model answer
+    is preferred over generic filler if Gemini is skipped or fails.
+
+    Args:
+        message (str): Raw user message
+        chat_history (list, optional): Chat history for Gemini context
+
+    Returns:
+        tuple: (response, trace) where trace is the decision trace dict
+    """
+    # Sampled requests run under the profiler while an admin has it enabled
+    return profiler.call(_get_cascade_response, message, chat_history)
+
+
+def _get_cascade_response(message, chat_history):
+    start = time.perf_counter()
+    trace = _new_trace()
+    response, candidate = _run_local_stages(message, trace)
+
+    # Stage 3: Gemini, if enabled and there is budget left for it
+    if response is None:
+        budget_ms = _gemini_budget_ms(start, trace)
+        if budget_ms is not None:
+            gemini_response = _call_gemini(message, chat_history, budget_ms, trace)
+            if gemini_response:
+                response = gemini_response
+                trace['selected'] = 'gemini'
+
+    response = _finish(response, candidate, trace, start)
+    return response, trace
+
+
+def stream_cascade_response(message, chat_history=None):
+    """
+    Stream a cascade response as events
+
+    Rule and model answers arrive as a single chunk; Gemini answers are
+    forwarded chunk by chunk as they are generated. The Gemini budget is
+    the deadline for the streaming call itself. If the Gemini stream fails
+    or is cut short after some chunks, a {'reset': True} event tells the
+    client to discard them and the fallback answer follows.
+
+    Args:
+        message (str): Raw user message
+        chat_history (list, optional): Chat history for Gemini context
+
+    Yields:
+        dict: {'chunk': text} events, possibly one {'reset': True}, then one
+        {'done': True, 'response': full text, 'source': stage, 'trace_id': id}
+    """
+    start = time.perf_counter()
+    trace = _new_trace()
+    response, candidate = _run_local_stages(message, trace)
+    streamed = False
+
+    if response is None:
+        budget_ms = _gemini_budget_ms(start, trace)
+        if budget_ms is not None:
+            _record('gemini_calls')
+            stage_start = time.perf_counter()
+            stage = {'stage': 'gemini', 'streamed': True, 'budget_ms': budget_ms}
+            chunks = []
+            stream = stream_gemini_response(message, chat_history, budget_ms)
+            while True:
+                try:
+                    chunk = next(stream)
+                except StopIteration as stop:
+                    completed = stop.value
+                    break
+                if not chunks:
+                    # Time to first chunk, from the start of the request
+                    stage['first_chunk_ms'] = _elapsed_ms(start)
+                chunks.append(chunk)
+                yield {'chunk': chunk}
+            stage['latency_ms'] = _elapsed_ms(stage_start)
+            if completed and chunks:
+                stage['outcome'] = 'answered'
+                response = ''.join(chunks)
+                trace['selected'] = 'gemini'
+                streamed = True
+            else:
+                # A partial answer is never kept, shown or recorded as a turn
+                stage['outcome'] = 'error'
+                stage['partial_chunks'] = len(chunks)
+                _record('gemini_errors')
+                if chunks:
+                    yield {'reset': True}
+            trace['stages'].append(stage)
+
+    response = _finish(response, candidate, trace, start)
+    if not streamed:
+        yield {'chunk': response}
+    yield {'done': True, 'response': response, 'source': trace['selected'], 'trace_id': trace['id']}
+
+
+def stream_cascade_events(message, chat_history=None):
+    """
+    Stream a cascade response as Server-Sent Events
+
+    Serve it with e.g. Response(stream_cascade_events(message),
+    mimetype='text/event-stream'); each event's data is one JSON object
+    from stream_cascade_response.
+
+    Yields:
+        str: Encoded SSE events
+    """
+    try:
+        for event in stream_cascade_response(message, chat_history):
+            yield f"data: {json.dumps(event)}\n\n"
+    except Exception as e:
+        logger.error(f"Error streaming cascade response: {e}")
+        yield f"data: {json.dumps({'error': 'stream_failed', 'done': True})}\n\n"
+
+
+async def run_cpu(fn, *args):
+    """
+    Run a CPU-bound function on the bounded CPU pool and await its result
+    """
+    return await asyncio.get_running_loop().run_in_executor(_cpu_pool, fn, *args)
+
+
+async def run_io(fn, *args):
+    """
+    Run a blocking I/O function (database, Gemini SDK) on the I/O pool and await it
+    """
+    return await asyncio.get_running_loop().run_in_executor(_io_pool, fn, *args)
+
+
+async def get_cascade_response_async(message, chat_history=None):
+    """
+    Async version of get_cascade_response for the ASGI server
+
+    The rule stage runs on the CPU pool, the model stage on the
+    micro-batcher and the Gemini call on the I/O pool, so the event loop
+    only coordinates. Only the rule and preprocessing stages can be
+    profiled, since the profiler follows one thread and the model runs on
+    the micro-batcher's.
+
+    Args:
+        message (str): Raw user message
+        chat_history (list, optional): Chat history for Gemini context
+
+    Returns:
+        tuple: (response, trace) where trace is the decision trace dict
+    """
+    start = time.perf_counter()
+    trace = _new_trace()
+    response, candidate = await _run_local_stages_async(message, trace)
+
+    if response is None:
+        budget_ms = _gemini_budget_ms(start, trace)
+        if budget_ms is not None:
+            stage_start = time.perf_counter()
+            _record('gemini_calls')
+            try:
+                response = await asyncio.wait_for(
+                    run_io(get_gemini_response, message, chat_history, budget_ms),
+                    timeout=budget_ms / 1000.0
+                )
+                outcome = 'answered' if response else 'error'
+                if not response:
+                    response = None
+                    _record('gemini_errors')
+            except asyncio.TimeoutError:
+                # The call keeps running on the pool, its result is dropped
+                outcome = 'timeout'
+                _record('gemini_timeouts')
+            except Exception as e:
+                logger.error(f"Error calling Gemini from cascade: {e}")
+                outcome = 'error'
+                _record('gemini_errors')
+            trace['stages'].append({
+                'stage': 'gemini',
+                'outcome': outcome,
+                'budget_ms': budget_ms,
+                'latency_ms': _elapsed_ms(stage_start)
+            })
+            if response is not None:
+                trace['selected'] = 'gemini'
+
+    response = _finish(response, candidate, trace, start)
+    return response, trace
+
+
+async def stream_cascade_events_async(message, chat_history=None):
+    """
+    Async version of stream_cascade_events for the ASGI server
+
+    The synchronous event generator is advanced on the I/O pool, one event
+    at a time, so Gemini chunks are forwarded as soon as they arrive.
+
+    Yields:
+        str: Encoded SSE events
+    """
+    loop = asyncio.get_running_loop()
+    events = stream_cascade_events(message, chat_history)
+    done = object()
+    try:
+        while True:
+            event = await loop.run_in_executor(_io_pool, next, events, done)
+            if event is done:
+                break
+            yield event
+    finally:
+        # Client went away: close the generator so the Gemini slot is freed
+        await loop.run_in_executor(_io_pool, events.close)
+
+
+def shutdown_pools(wait=True):
+    """
+    Stop the async and Gemini worker pools, e.g. on server shutdown
+    """
+    for pool in (_cpu_pool, _io_pool, _gemini_pool):
+        pool.shutdown(wait=wait)
+
+
+def get_recent_traces(limit=50):
+    """
+    Get the most recent decision traces, newest first
+
+    Args:
+        limit (int): Maximum number of traces
+
+    Returns:
+        list: Trace dicts
+    """
+    return list(_traces)[-limit:][::-1]
+
+
+def get_cascade_stats():
+    """
+    Get cascade counters and the configured thresholds
+
+    Returns:
+        dict: Request counts per selected stage, Gemini outcomes and settings
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+        stats['selected'] = dict(_stats['selected'])
+    stats['thresholds'] = {
+        'model': MODEL_CONFIDENCE_THRESHOLD,
+        'fallback': FALLBACK_CONFIDENCE_THRESHOLD,
+        'total_budget_ms': TOTAL_BUDGET_MS,
+        'gemini_budget_ms': GEMINI_BUDGET_MS,
+        'async_cpu_workers': ASYNC_CPU_WORKERS,
+        'async_io_workers': ASYNC_IO_WORKERS
+    }
+    stats['gemini'] = get_gemini_stats()
+    return stats
@@ -25,10 +25,101 @@ chatForm.addEventListener('submit', (e) => {
     // Show typing indicator
     typingIndicator.style.display = 'block';
     
-    // Send message to server
-    sendMessage(message);
+    // Send message to server, streaming the reply when supported
+    streamMessage(message);
 });
 
+/**
+ * Send message to the streaming endpoint and append chunks as they arrive.
+ * Falls back to sendMessage if streaming is unavailable.
+ * @param {string} message - The message to send
+ */
+function streamMessage(message) {
+    if (!window.ReadableStream || !window.TextDecoder) {
+        sendMessage(message);
+        return;
+    }
+    
+    let bubble = null;
+    let received = false;
+    
+    fetch('/chat/stream', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream',
+        },
+        body: JSON.stringify({ message }),
+    })
+    .then(response => {
+        if (!response.ok || !response.body) {
+            throw new Error('Streaming not available');
+        }
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        // Each SSE event is "data: <json>" followed by a blank line
+        const handleEvent = (rawEvent) => {
+            const data = rawEvent
+                .split('\n')
+                .filter(line => line.startsWith('data:'))
+                .map(line => line.slice(5).trim())
+                .join('');
+            if (!data) return;
+            
+            const event = JSON.parse(data);
+            if (event.error) {
+                throw new Error(event.error);
+            }
+            if (event.reset && bubble) {
+                // The streamed answer broke off; the fallback answer follows
+                bubble.textContent = '';
+            }
+            if (event.chunk) {
+                if (!bubble) {
+                    // First chunk: swap the typing indicator for the bot bubble
+                    typingIndicator.style.display = 'none';
+                    bubble = appendMessage('bot', '');
+                }
+                bubble.textContent += event.chunk;
+                received = true;
+                chatMessages.scrollTop = chatMessages.scrollHeight;
+            }
+        };
+        
+        const read = () => reader.read().then(({ done, value }) => {
+            if (done) {
+                if (buffer.trim()) handleEvent(buffer);
+                return;
+            }
+            buffer += decoder.decode(value, { stream: true });
+            const events = buffer.split('\n\n');
+            buffer = events.pop();
+            events.forEach(handleEvent);
+            return read();
+        });
+        return read();
+    })
+    .then(() => {
+        typingIndicator.style.display = 'none';
+        if (!received) {
+            appendMessage('bot', 'Sorry, I encountered an error. Please try again.');
+        }
+    })
+    .catch(error => {
+        if (!received) {
+            // Nothing shown yet, retry without streaming
+            console.warn('Streaming failed, falling back:', error);
+            sendMessage(message);
+            return;
+        }
+        console.error('Error:', error);
+        typingIndicator.style.display = 'none';
+    });
+}
+
 /**
  * Send message to the server
  * @param {string} message - The message to send
@@ -69,6 +160,7 @@ function sendMessage(message) {
  * Append a message to the chat display
  * @param {string} sender - The sender of the message ('user' or 'bot')
  * @param {string} content - The message content
+ * @returns {HTMLElement} The message bubble, so streamed text can be appended
  */
 function appendMessage(sender, content) {
     const messageElement = document.createElement('div');
@@ -94,46 +186,76 @@ function appendMessage(sender, content) {
     
     // Scroll to bottom of chat
     chatMessages.scrollTop = chatMessages.scrollHeight;
+    
+    return bubble;
 }
 
+// Keyset pagination state for /history
+const HISTORY_PAGE_SIZE = 50;
+let historyCursor = null;
+let historyLoading = false;
+
 /**
- * Load chat history from the server
+ * Create a message element from a history entry
+ * @param {Object} message - History entry with sender_type, content and timestamp
+ * @returns {HTMLElement} The message element
  */
-function loadChatHistory() {
-    fetch('/history')
+function createHistoryMessage(message) {
+    const messageElement = document.createElement('div');
+    messageElement.classList.add('message', `${message.sender_type}-message`);
+    
+    // Create message bubble
+    const bubble = document.createElement('div');
+    bubble.classList.add('message-bubble');
+    bubble.textContent = message.content;
+    
+    // Create timestamp
+    const timestamp = document.createElement('div');
+    timestamp.classList.add('message-timestamp');
+    timestamp.textContent = formatTimestamp(message.timestamp);
+    
+    // Append bubble and timestamp to message container
+    messageElement.appendChild(bubble);
+    messageElement.appendChild(timestamp);
+    return messageElement;
+}
+
+/**
+ * Fetch one page of history older than the cursor
+ * @param {string|null} cursor - next_cursor from the previous page
+ * @returns {Promise<Object>} Page with history, next_cursor and has_more
+ */
+function fetchHistoryPage(cursor) {
+    const params = new URLSearchParams({ limit: HISTORY_PAGE_SIZE });
+    if (cursor) {
+        params.set('before', cursor);
+    }
+    return fetch(`/history?${params}`)
     .then(response => {
         if (!response.ok) {
             throw new Error('Network response was not ok');
         }
         return response.json();
-    })
+    });
+}
+
+/**
+ * Load the newest page of chat history from the server
+ */
+function loadChatHistory() {
+    historyLoading = true;
+    fetchHistoryPage(null)
     .then(data => {
+        historyCursor = data.has_more ? data.next_cursor : null;
+        
         if (data.history && data.history.length > 0) {
             // Clear existing messages
             chatMessages.innerHTML = '';
             
             // Add each message to the chat
-            data.history.forEach(message => {
-                const messageElement = document.createElement('div');
-                messageElement.classList.add('message', `${message.sender_type}-message`);
-                
-                // Create message bubble
-                const bubble = document.createElement('div');
-                bubble.classList.add('message-bubble');
-                bubble.textContent = message.content;
-                
-                // Create timestamp
-                const timestamp = document.createElement('div');
-                timestamp.classList.add('message-timestamp');
-                timestamp.textContent = formatTimestamp(message.timestamp);
-                
-                // Append bubble and timestamp to message container
-                messageElement.appendChild(bubble);
-                messageElement.appendChild(timestamp);
-                
-                // Add to chat messages
-                chatMessages.appendChild(messageElement);
-            });
+            const fragment = document.createDocumentFragment();
+            data.history.forEach(message => fragment.appendChild(createHistoryMessage(message)));
+            chatMessages.appendChild(fragment);
             
             // Scroll to bottom of chat
             chatMessages.scrollTop = chatMessages.scrollHeight;
@@ -145,9 +267,47 @@ function loadChatHistory() {
     .catch(error => {
         console.error('Error loading chat history:', error);
         appendMessage('bot', 'Hello! I\'m your intelligent chatbot assistant. How can I help you today?');
+    })
+    .finally(() => {
+        historyLoading = false;
     });
 }
 
+/**
+ * Load the next older page and prepend it, keeping the visible messages in place
+ */
+function loadOlderHistory() {
+    if (historyLoading || !historyCursor) return;
+    historyLoading = true;
+    
+    fetchHistoryPage(historyCursor)
+    .then(data => {
+        historyCursor = data.has_more ? data.next_cursor : null;
+        if (!data.history || data.history.length === 0) return;
+        
+        const previousHeight = chatMessages.scrollHeight;
+        const fragment = document.createDocumentFragment();
+        data.history.forEach(message => fragment.appendChild(createHistoryMessage(message)));
+        chatMessages.insertBefore(fragment, chatMessages.firstChild);
+        
+        // Offset the scroll position by the height of the prepended page
+        chatMessages.scrollTop += chatMessages.scrollHeight - previousHeight;
+    })
+    .catch(error => {
+        console.error('Error loading older chat history:', error);
+    })
+    .finally(() => {
+        historyLoading = false;
+    });
+}
+
+// Load older messages when the user scrolls near the top
+chatMessages.addEventListener('scroll', () => {
+    if (chatMessages.scrollTop < 100) {
+        loadOlderHistory();
+    }
+});
+
 /**
  * Format timestamp for display
  * @param {string} timestamp - The timestamp to format
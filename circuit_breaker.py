@@ -0,0 +1,188 @@
+"""
+Circuit breaker for calls to a degraded upstream
+"""
+import time
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Numeric state for metrics: 0 closed, 1 half open, 2 open
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """
+    Trips open when too many recent calls fail or are slow, then lets a
+    few probe calls through once the open period has passed
+
+    Outcomes are kept in a rolling window of the last window_size calls.
+    Every consecutive re-open doubles the open period, up to max_open_seconds.
+    """
+
+    def __init__(self, name, window_size=50, min_calls=10, failure_rate=0.5,
+                 slow_call_ms=5000, slow_call_rate=0.8, open_seconds=10,
+                 max_open_seconds=120, half_open_calls=3):
+        """
+        Args:
+            name (str): Name used in logs and metrics
+            window_size (int): Number of recent calls considered
+            min_calls (int): Calls needed in the window before it can trip
+            failure_rate (float): Failure fraction that trips the breaker
+            slow_call_ms (float): Calls slower than this count as slow
+            slow_call_rate (float): Slow fraction that trips the breaker
+            open_seconds (float): First open period before probing
+            max_open_seconds (float): Upper bound for the open period
+            half_open_calls (int): Successful probes needed to close again
+        """
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_ms = slow_call_ms
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.half_open_calls = half_open_calls
+
+        self._lock = threading.Lock()
+        self._window = deque(maxlen=window_size)  # (failed, slow) per call
+        self._state = CLOSED
+        self._opened_at = None
+        self._open_period = open_seconds
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._counters = {'successes': 0, 'failures': 0, 'slow_calls': 0, 'rejected': 0, 'trips': 0}
+
+    def _transition(self, state):
+        # Called with the lock held
+        logger.warning(f"Circuit breaker '{self.name}' {self._state} -> {state}")
+        self._state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self._counters['trips'] += 1
+        elif state == HALF_OPEN:
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+        else:
+            self._window.clear()
+            self._open_period = self.open_seconds
+
+    def _open_remaining(self):
+        return self._opened_at + self._open_period - time.monotonic()
+
+    def allow_request(self):
+        """
+        Check whether a call may go to the upstream
+
+        Returns:
+            bool: False while open, or when half open and the probes are taken
+        """
+        with self._lock:
+            if self._state == OPEN and self._open_remaining() <= 0:
+                self._transition(HALF_OPEN)
+
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes_in_flight < self.half_open_calls:
+                self._probes_in_flight += 1
+                return True
+
+            self._counters['rejected'] += 1
+            return False
+
+    def record_success(self, latency_ms):
+        """
+        Record a completed call
+
+        Args:
+            latency_ms (float): Call latency; slow calls count against the upstream
+        """
+        slow = latency_ms > self.slow_call_ms
+        with self._lock:
+            self._counters['successes'] += 1
+            if slow:
+                self._counters['slow_calls'] += 1
+
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+                if slow:
+                    self._reopen()
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_calls:
+                        self._transition(CLOSED)
+                return
+
+            self._window.append((False, slow))
+            self._check_window()
+
+    def record_failure(self, latency_ms=0.0):
+        """
+        Record a failed or timed out call
+
+        Args:
+            latency_ms (float): Time spent before the call failed
+        """
+        with self._lock:
+            self._counters['failures'] += 1
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+                self._reopen()
+                return
+
+            self._window.append((True, latency_ms > self.slow_call_ms))
+            self._check_window()
+
+    def record_abandoned(self):
+        """
+        Record a call given up by the caller, which says nothing about the upstream
+        """
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+
+    def _reopen(self):
+        # A failed probe re-opens the breaker for longer
+        self._open_period = min(self._open_period * 2, self.max_open_seconds)
+        self._transition(OPEN)
+
+    def _check_window(self):
+        if self._state != CLOSED or len(self._window) < self.min_calls:
+            return
+        failures = sum(1 for failed, _ in self._window if failed)
+        slow = sum(1 for _, is_slow in self._window if is_slow)
+        if failures / len(self._window) >= self.failure_rate or slow / len(self._window) >= self.slow_call_rate:
+            self._transition(OPEN)
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and self._open_remaining() <= 0:
+                return HALF_OPEN
+            return self._state
+
+    def stats(self):
+        """
+        Get breaker state and counters for metrics
+
+        Returns:
+            dict: State, numeric state, window rates, seconds until the next
+                probe and call counters
+        """
+        with self._lock:
+            window = list(self._window)
+            stats = dict(self._counters)
+            stats['state'] = self._state
+            stats['open_for_seconds'] = max(self._open_remaining(), 0.0) if self._state == OPEN else 0.0
+            stats['open_period_seconds'] = self._open_period
+        stats['state_value'] = STATE_VALUES[stats['state']]
+        stats['window_calls'] = len(window)
+        stats['window_failure_rate'] = sum(1 for failed, _ in window if failed) / len(window) if window else 0.0
+        stats['window_slow_rate'] = sum(1 for _, slow in window if slow) / len(window) if window else 0.0
+        stats['name'] = self.name
+        return stats
@@ -0,0 +1,34 @@
+"""
+Shared pytest fixtures
+"""
+import pytest
+
+import db_pool
+
+SCHEMA = """
+CREATE TABLE chat_session (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL);
+CREATE TABLE message (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    content TEXT NOT NULL,
+    sender_type VARCHAR(10) NOT NULL,
+    timestamp DATETIME,
+    chat_session_id INTEGER NOT NULL REFERENCES chat_session (id),
+    client_id VARCHAR(32) UNIQUE
+);
+CREATE INDEX ix_message_timestamp_id ON message (timestamp, id);
+"""
+
+
+@pytest.fixture
+def sqlite_db(tmp_path, monkeypatch):
+    """
+    Point db_pool at a fresh SQLite file with the chat_session and message tables
+    """
+    monkeypatch.setattr(db_pool, 'USE_MYSQL', False)
+    monkeypatch.setattr(db_pool, 'USE_SQLITE', True)
+    pool = db_pool.SQLitePool(1, 2, f"sqlite:///{tmp_path / 'chatbot.db'}")
+    monkeypatch.setattr(db_pool, '_pool', pool)
+    with db_pool.connection() as conn:
+        conn.cursor().executescript(SCHEMA)
+    yield pool
+    pool.closeall()
@@ -0,0 +1,300 @@
+"""
+Shared database connection pool and streamed reads for PostgreSQL and MySQL
+
+A DATABASE_URL of the form sqlite:///path selects SQLite instead, for load
+tests and local runs without a database server.
+"""
+import os
+import uuid
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+
+# Determine database type
+USE_MYSQL = os.environ.get('USE_MYSQL', 'false').lower() == 'true'
+USE_SQLITE = not USE_MYSQL and os.environ.get('DATABASE_URL', '').startswith('sqlite:')
+BACKEND_NAME = 'MySQL' if USE_MYSQL else 'SQLite' if USE_SQLITE else 'PostgreSQL'
+
+# Pool size and the number of rows fetched per round trip when streaming
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '5'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+DB_FETCH_CHUNK_SIZE = int(os.environ.get('DB_FETCH_CHUNK_SIZE', '5000'))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# psycopg2's pool raises instead of waiting when it is exhausted, so
+# checkouts are gated to make callers wait for a free connection
+_checkouts = threading.BoundedSemaphore(DB_POOL_MAX)
+
+
+def load_db_driver():
+    """
+    Import the driver for the configured database only, on first use
+
+    Returns:
+        tuple: (driver module, driver error class)
+    """
+    if USE_MYSQL:
+        import mysql.connector
+        return mysql.connector, mysql.connector.Error
+    if USE_SQLITE:
+        import sqlite3
+        return sqlite3, sqlite3.Error
+    import psycopg2
+    return psycopg2, psycopg2.Error
+
+
+def mysql_config():
+    """
+    MySQL connection settings from environment variables
+    """
+    return {
+        'host': os.environ.get('DB_HOST', 'localhost'),
+        'database': os.environ.get('DB_NAME', 'chatbot'),
+        'user': os.environ.get('DB_USER', 'root'),
+        'password': os.environ.get('DB_PASSWORD', ''),
+        'port': os.environ.get('DB_PORT', '3306')
+    }
+
+
+class SQLiteCursor:
+    """
+    sqlite3 cursor that accepts the %s placeholders used by the other drivers
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, params=()):
+        self._cursor.execute(query.replace('%s', '?'), params)
+        return self
+
+    def executemany(self, query, rows):
+        self._cursor.executemany(query.replace('%s', '?'), rows)
+        return self
+
+    def __getattr__(self, name):
+        # fetchone, fetchmany, fetchall, rowcount, close
+        return getattr(self._cursor, name)
+
+
+class SQLiteConnection:
+    """
+    sqlite3 connection with a psycopg2-like cursor() and closed flag
+    """
+
+    def __init__(self, path, timeout):
+        import sqlite3
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        # WAL lets readers run while one writer commits
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self.closed = False
+
+    def cursor(self, name=None):
+        # SQLite cursors already step through results lazily
+        return SQLiteCursor(self._conn.cursor())
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+        self.closed = True
+
+
+class SQLitePool:
+    """
+    Keeps up to maxconn idle SQLite connections with the psycopg2 pool interface
+    """
+
+    def __init__(self, minconn, maxconn, database_url):
+        import sqlite3
+        from datetime import datetime
+        # Stored as text in SQLAlchemy's SQLite format, always with
+        # microseconds, so it sorts chronologically and compares equal to the
+        # values the ORM binds; sqlite3's default datetime adapter is deprecated
+        sqlite3.register_adapter(datetime, lambda value: value.strftime('%Y-%m-%d %H:%M:%S.%f'))
+        self.path = database_url[len('sqlite:///'):] if database_url.startswith('sqlite:///') else ':memory:'
+        self._idle = queue.LifoQueue(maxsize=maxconn)
+
+    def getconn(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return SQLiteConnection(self.path, DB_POOL_TIMEOUT)
+
+    def putconn(self, conn, close=False):
+        if close or conn.closed:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def closeall(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def get_pool():
+    """
+    Create the connection pool for the configured database on first use
+
+    Returns:
+        object: psycopg2 ThreadedConnectionPool, mysql.connector MySQLConnectionPool
+            or SQLitePool
+
+    Raises:
+        RuntimeError: If DATABASE_URL is missing for PostgreSQL
+    """
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if USE_MYSQL:
+                    from mysql.connector import pooling
+                    _pool = pooling.MySQLConnectionPool(
+                        pool_name='chatbot',
+                        pool_size=DB_POOL_MAX,
+                        **mysql_config()
+                    )
+                else:
+                    database_url = os.environ.get('DATABASE_URL')
+                    if not database_url:
+                        raise RuntimeError("DATABASE_URL not found in environment variables")
+                    if USE_SQLITE:
+                        _pool = SQLitePool(DB_POOL_MIN, DB_POOL_MAX, database_url)
+                    else:
+                        from psycopg2 import pool
+                        _pool = pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, database_url)
+                logging.info(f"Database connection pool created ({BACKEND_NAME}, max {DB_POOL_MAX})")
+    return _pool
+
+
+@contextmanager
+def connection():
+    """
+    Check a connection out of the pool for the duration of a with block
+
+    The transaction is committed when the block succeeds and rolled back
+    when it raises; the connection always goes back to the pool.
+
+    Yields:
+        connection: DB-API connection
+    """
+    if not _checkouts.acquire(timeout=DB_POOL_TIMEOUT):
+        raise RuntimeError(f"No database connection available after {DB_POOL_TIMEOUT}s")
+
+    try:
+        pool = get_pool()
+        conn = pool.get_connection() if USE_MYSQL else pool.getconn()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            # Also covers a streaming generator closed before it was exhausted
+            try:
+                conn.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            if USE_MYSQL:
+                # Closing a pooled MySQL connection returns it to the pool
+                conn.close()
+            else:
+                pool.putconn(conn, close=broken or bool(conn.closed))
+    finally:
+        _checkouts.release()
+
+
+def iter_query_chunks(query, params=(), chunk_size=DB_FETCH_CHUNK_SIZE):
+    """
+    Stream the rows of a query in chunks without loading the whole result
+
+    PostgreSQL uses a named (server-side) cursor and MySQL an unbuffered
+    cursor, so only one chunk is held in memory at a time.
+
+    Args:
+        query (str): SQL query with %s placeholders
+        params (tuple): Query parameters
+        chunk_size (int): Rows per chunk
+
+    Yields:
+        list: Row tuples
+    """
+    with connection() as conn:
+        if USE_MYSQL:
+            cursor = conn.cursor(buffered=False)
+        elif USE_SQLITE:
+            cursor = conn.cursor()
+        else:
+            cursor = conn.cursor(name=f'stream_{uuid.uuid4().hex}')
+            cursor.itersize = chunk_size
+        try:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+
+def iter_column_chunks(query, params=(), chunk_size=DB_FETCH_CHUNK_SIZE):
+    """
+    Stream a query as column chunks
+
+    Each chunk is transposed with zip(*rows) in C, so callers get one list
+    per column without unpacking row tuples in Python.
+
+    Yields:
+        tuple: One list per selected column
+    """
+    for rows in iter_query_chunks(query, params, chunk_size):
+        yield tuple(list(column) for column in zip(*rows))
+
+
+def fetch_columns(query, params=(), n_columns=1, chunk_size=DB_FETCH_CHUNK_SIZE):
+    """
+    Fetch a whole query result as one list per column
+
+    Args:
+        query (str): SQL query with %s placeholders
+        params (tuple): Query parameters
+        n_columns (int): Number of selected columns
+        chunk_size (int): Rows per round trip
+
+    Returns:
+        tuple: n_columns lists
+    """
+    columns = tuple([] for _ in range(n_columns))
+    for chunk in iter_column_chunks(query, params, chunk_size):
+        for column, values in zip(columns, chunk):
+            column.extend(values)
+    return columns
+
+
+def close_pool():
+    """
+    Close every pooled connection, e.g. on shutdown
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None and not USE_MYSQL:
+            _pool.closeall()
+        _pool = None
@@ -0,0 +1,171 @@
+"""
+Local stand-in for google.generativeai, for load tests
+
+Implements the part of the SDK the Gemini client uses -- configure(),
+list_models() and GenerativeModel.generate_content() with and without
+streaming -- with a log-normal latency distribution and a configurable
+error rate. Deadlines from request_options are honoured like the real API.
+
+    import fake_genai
+    fake_genai.install()    # the chat pipeline now calls the fake
+
+Settings come from the environment or from set_behavior():
+    FAKE_GEMINI_LATENCY_MS     median latency (default 800)
+    FAKE_GEMINI_LATENCY_SIGMA  log-normal sigma; 0 makes every call take the median (default 0.5)
+    FAKE_GEMINI_ERROR_RATE     share of calls that fail (default 0.02)
+    FAKE_GEMINI_CHUNKS         chunks per streamed answer (default 5)
+"""
+import os
+import math
+import time
+import random
+import threading
+
+LATENCY_MS = float(os.environ.get('FAKE_GEMINI_LATENCY_MS', '800'))
+LATENCY_SIGMA = float(os.environ.get('FAKE_GEMINI_LATENCY_SIGMA', '0.5'))
+ERROR_RATE = float(os.environ.get('FAKE_GEMINI_ERROR_RATE', '0.02'))
+STREAM_CHUNKS = int(os.environ.get('FAKE_GEMINI_CHUNKS', '5'))
+
+_stats_lock = threading.Lock()
+_stats = {'calls': 0, 'errors': 0, 'timeouts': 0}
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a call takes longer than its request_options timeout
+    """
+
+
+class ServiceUnavailable(Exception):
+    """
+    Raised for the injected share of failed calls
+    """
+
+
+def set_behavior(latency_ms=None, sigma=None, error_rate=None, chunks=None):
+    """
+    Change the simulated latency distribution and error rate at runtime
+    """
+    global LATENCY_MS, LATENCY_SIGMA, ERROR_RATE, STREAM_CHUNKS
+
+    if latency_ms is not None:
+        LATENCY_MS = float(latency_ms)
+    if sigma is not None:
+        LATENCY_SIGMA = float(sigma)
+    if error_rate is not None:
+        ERROR_RATE = float(error_rate)
+    if chunks is not None:
+        STREAM_CHUNKS = max(int(chunks), 1)
+
+
+def sample_latency_ms():
+    """
+    Draw one call latency from the log-normal distribution
+    """
+    if LATENCY_SIGMA <= 0:
+        return LATENCY_MS
+    return random.lognormvariate(math.log(max(LATENCY_MS, 1e-3)), LATENCY_SIGMA)
+
+
+def _record(stat):
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+def stats():
+    """
+    Get the number of calls, injected errors and deadline overruns
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def configure(**kwargs):
+    pass
+
+
+class _Model:
+    def __init__(self, name):
+        self.name = name
+
+
+def list_models():
+    return [_Model('models/gemini-1.5-flash'), _Model('models/gemini-1.5-pro')]
+
+
+class GenerateContentResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class _Stream:
+    def __init__(self, chunks, delays):
+        self._chunks = chunks
+        self._delays = delays
+
+    def __iter__(self):
+        for chunk, delay in zip(self._chunks, self._delays):
+            time.sleep(delay)
+            yield GenerateContentResponse(chunk)
+
+
+class GenerativeModel:
+    """
+    Answers every prompt with a canned reply after a sampled delay
+    """
+
+    def __init__(self, model_name='gemini-1.5-flash', generation_config=None, safety_settings=None):
+        self.model_name = model_name
+        self.generation_config = generation_config
+        self.safety_settings = safety_settings
+
+    def _answer(self, prompt):
+        question = prompt.strip().splitlines()[-1] if prompt.strip() else ''
+        return f"This is a simulated answer from {self.model_name} to: {question[:200]}"
+
+    def generate_content(self, prompt, stream=False, request_options=None):
+        _record('calls')
+        timeout = (request_options or {}).get('timeout')
+        latency = sample_latency_ms() / 1000.0
+
+        if random.random() < ERROR_RATE:
+            # Failures come back faster than answers, like a 503 would
+            time.sleep(min(latency / 4, timeout or latency))
+            _record('errors')
+            raise ServiceUnavailable("503 The model is overloaded (simulated)")
+
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            _record('timeouts')
+            raise DeadlineExceeded(f"504 Deadline of {timeout:.2f}s exceeded (simulated)")
+
+        text = self._answer(prompt)
+        if not stream:
+            time.sleep(latency)
+            return GenerateContentResponse(text)
+
+        # The first chunk takes most of the latency, the rest trickle in
+        words = text.split(' ')
+        size = max(len(words) // STREAM_CHUNKS, 1)
+        chunks = [' '.join(words[i:i + size]) + ' ' for i in range(0, len(words), size)]
+        rest = latency * 0.3 / max(len(chunks) - 1, 1)
+        delays = [latency * 0.7] + [rest] * (len(chunks) - 1)
+        return _Stream(chunks, delays)
+
+
+def install(**client_kwargs):
+    """
+    Make the process-wide Gemini client call this fake
+
+    Args:
+        **client_kwargs: Passed on to GeminiClient, e.g. max_concurrency
+
+    Returns:
+        GeminiClient: The installed client
+    """
+    import sys
+    import gemini_client
+
+    client = gemini_client.GeminiClient(genai_module=sys.modules[__name__], **client_kwargs)
+    gemini_client.set_client(client)
+    return client
@@ -0,0 +1,115 @@
+"""
+Inverted index over training questions for the fallback matcher
+"""
+import logging
+
+
+class FallbackIndex:
+    """
+    Token -> question postings with precomputed question token sets.
+
+    Only questions sharing at least one token with the input are scored, so
+    lookup cost depends on the posting lists touched rather than on the
+    number of training questions.
+    """
+
+    def __init__(self, questions, answers):
+        """
+        Args:
+            questions (list): Training questions
+            answers (list): Answer for each question
+        """
+        self.answers = answers
+        self.question_texts = []
+        self.question_lengths = []
+        self.postings = {}
+
+        for i, question in enumerate(questions):
+            tokens = question.lower().split()
+            unique_tokens = set(tokens)
+
+            # Padded so substring checks only match whole tokens
+            self.question_texts.append(f" {' '.join(tokens)} ")
+            self.question_lengths.append(len(unique_tokens))
+
+            for token in unique_tokens:
+                self.postings.setdefault(token, []).append(i)
+
+        logging.info(f"Built fallback index over {len(questions)} questions and {len(self.postings)} tokens")
+
+    def __len__(self):
+        return len(self.question_texts)
+
+    def search(self, text, threshold=0.3):
+        """
+        Find the best matching question for the text
+
+        A direct match is a question whose token sequence contains the text's
+        tokens (or is contained in them); otherwise the question with the
+        highest share of its tokens present in the text is used. Ties go to
+        the question added first.
+
+        Args:
+            text (str): Preprocessed user input
+            threshold (float): Minimum overlap score for a word match
+
+        Returns:
+            tuple: (answer, score, match_type) or None if nothing matched.
+                Direct matches score 1.0.
+        """
+        tokens = text.lower().split()
+        if not tokens:
+            return None
+
+        text_tokens = set(tokens)
+        padded_text = f" {' '.join(tokens)} "
+
+        # Count shared tokens for candidate questions only
+        counts = {}
+        for token in text_tokens:
+            for i in self.postings.get(token, ()):
+                counts[i] = counts.get(i, 0) + 1
+
+        if not counts:
+            return None
+
+        # First try direct matching
+        direct = None
+        for i, common in counts.items():
+            if direct is not None and i > direct:
+                continue
+            if common == len(text_tokens) and padded_text in self.question_texts[i]:
+                direct = i
+            elif common == self.question_lengths[i] and self.question_texts[i] in padded_text:
+                direct = i
+
+        if direct is not None:
+            return self.answers[direct], 1.0, 'direct'
+
+        # If no direct match, use the best word overlap score
+        best_match = None
+        best_score = 0
+        for i, common in counts.items():
+            score = common / self.question_lengths[i]
+            if score > best_score or (score == best_score and i < best_match):
+                best_score = score
+                best_match = i
+
+        if best_score > threshold:
+            return self.answers[best_match], best_score, 'word'
+
+        return None
+
+    def match(self, text, threshold=0.3):
+        """
+        Get the answer of the best matching question
+
+        Args:
+            text (str): Preprocessed user input
+            threshold (float): Minimum overlap score for a word match
+
+        Returns:
+            str: Matched answer or None
+        """
+        result = self.search(text, threshold)
+        return result[0] if result else None
@@ -0,0 +1,368 @@
+"""
+Persistent semantic cache for Gemini responses
+
+Entries live in a local SQLite database so they survive restarts and are
+shared by every worker on the node. Prompts are keyed on their
+nlp.preprocess_text output plus the generation config. A lookup that misses
+the exact key falls back to the nearest cached prompt in the chat model's
+TF-IDF space, if it is similar enough.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+
+import nlp
+
+logger = logging.getLogger(__name__)
+
+GEMINI_CACHE_ENABLED = os.environ.get('GEMINI_CACHE_ENABLED', 'true').lower() == 'true'
+GEMINI_CACHE_PATH = os.environ.get(
+    'GEMINI_CACHE_PATH',
+    os.path.join(os.path.dirname(__file__), 'gemini_cache.sqlite3')
+)
+GEMINI_CACHE_TTL = float(os.environ.get('GEMINI_CACHE_TTL', '86400'))
+GEMINI_CACHE_MAX_ENTRIES = int(os.environ.get('GEMINI_CACHE_MAX_ENTRIES', '10000'))
+
+# Seconds between eviction passes; the cache may overshoot max_entries by the
+# writes made in between
+GEMINI_CACHE_EVICT_INTERVAL = float(os.environ.get('GEMINI_CACHE_EVICT_INTERVAL', '60'))
+
+# Minimum cosine similarity for a near-duplicate hit (above 1 disables it)
+GEMINI_CACHE_SIMILARITY = float(os.environ.get('GEMINI_CACHE_SIMILARITY', '0.9'))
+
+# The model vocabulary ignores words it was not trained on, so two prompts
+# sharing a single known word can look identical; near-duplicates must also
+# share at least this fraction of their tokens (Jaccard)
+GEMINI_CACHE_MIN_OVERLAP = float(os.environ.get('GEMINI_CACHE_MIN_OVERLAP', '0.5'))
+
+# Near-duplicate candidates checked per lookup, most similar first; the
+# in-memory matrix can still hold rows since evicted, expired or replaced
+GEMINI_CACHE_CANDIDATES = int(os.environ.get('GEMINI_CACHE_CANDIDATES', '5'))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS gemini_cache (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cache_key TEXT NOT NULL UNIQUE,
+    config_key TEXT NOT NULL,
+    normalized TEXT NOT NULL,
+    response TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_gemini_cache_last_used ON gemini_cache (last_used);
+CREATE INDEX IF NOT EXISTS idx_gemini_cache_config ON gemini_cache (config_key, id);
+"""
+
+
+def config_key(config):
+    """
+    Stable key for a generation config dict
+    """
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def token_overlap(a, b):
+    """
+    Jaccard overlap of the token sets of two normalized prompts
+    """
+    a, b = set(a.split()), set(b.split())
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class SemanticCache:
+    """
+    SQLite-backed response cache with TTL, LRU eviction and near-duplicate lookup
+
+    Near-duplicate lookup keeps an in-memory matrix of the cached prompts
+    vectorized with the current chat model. New rows written by any worker
+    are appended incrementally; the matrix is rebuilt when the model changes.
+    """
+
+    def __init__(self, path=GEMINI_CACHE_PATH, ttl=GEMINI_CACHE_TTL,
+                 max_entries=GEMINI_CACHE_MAX_ENTRIES, similarity=GEMINI_CACHE_SIMILARITY,
+                 min_overlap=GEMINI_CACHE_MIN_OVERLAP, evict_interval=GEMINI_CACHE_EVICT_INTERVAL):
+        """
+        Args:
+            path (str): SQLite database file
+            ttl (float): Seconds an entry stays valid
+            max_entries (int): Entries kept before least recently used ones are evicted
+            similarity (float): Minimum cosine similarity for a near-duplicate hit
+            min_overlap (float): Minimum token Jaccard overlap for a near-duplicate hit
+            evict_interval (float): Seconds between eviction passes run by set()
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evict_interval = evict_interval
+        self._next_eviction = 0.0
+        self.similarity = similarity
+        self.min_overlap = min_overlap
+        self._local = threading.local()
+        self._index_lock = threading.Lock()
+        self._index = {}
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'near_hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0, 'errors': 0}
+        self._connect().executescript(SCHEMA)
+
+    def _connect(self):
+        # One connection per thread; WAL lets workers read while one writes
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _record(self, stat, amount=1):
+        with self._stats_lock:
+            self._stats[stat] += amount
+
+    def _touch(self, conn, row_id):
+        with conn:
+            conn.execute(
+                'UPDATE gemini_cache SET last_used = ?, hits = hits + 1 WHERE id = ?',
+                (time.time(), row_id)
+            )
+
+    def key(self, prompt, config):
+        """
+        Build the cache key of a prompt, to pass to get() and set()
+
+        Args:
+            prompt (str): Raw user prompt
+            config (dict): Generation config the response is produced with
+
+        Returns:
+            tuple: (config key, normalized prompt)
+        """
+        return config_key(config), nlp.preprocess_text(prompt)
+
+    def get(self, key):
+        """
+        Look up a cached response for a prompt
+
+        Args:
+            key (tuple): Cache key from key()
+
+        Returns:
+            str: Cached response, or None on a miss
+        """
+        try:
+            cfg, normalized = key
+            conn = self._connect()
+            oldest = time.time() - self.ttl
+
+            # Exact match on the normalized prompt
+            row = conn.execute(
+                'SELECT id, response FROM gemini_cache WHERE cache_key = ? AND created_at >= ?',
+                (f'{cfg}:{normalized}', oldest)
+            ).fetchone()
+            if row is not None:
+                self._touch(conn, row[0])
+                self._record('hits')
+                return row[1]
+
+            # Nearest cached prompt in the model's feature space
+            if self.similarity <= 1.0:
+                candidates = self._nearest(conn, normalized, cfg)
+                if candidates:
+                    placeholders = ', '.join('?' * len(candidates))
+                    live = {
+                        row[0]: row for row in conn.execute(
+                            f'SELECT id, response, normalized FROM gemini_cache '
+                            f'WHERE id IN ({placeholders}) AND created_at >= ?',
+                            [row_id for row_id, _ in candidates] + [oldest]
+                        )
+                    }
+                    # Rows gone from the table are skipped for the next best
+                    for row_id, score in candidates:
+                        row = live.get(row_id)
+                        if row is not None and token_overlap(normalized, row[2]) >= self.min_overlap:
+                            self._touch(conn, row_id)
+                            self._record('near_hits')
+                            logger.info(f"Gemini cache near-duplicate hit (similarity {score:.2f})")
+                            return row[1]
+
+            self._record('misses')
+            return None
+        except Exception as e:
+            self._record('errors')
+            logger.error(f"Error reading Gemini cache: {e}")
+            return None
+
+    def _nearest(self, conn, normalized, cfg):
+        """
+        Find the cached prompts most similar to a prompt for a config
+
+        Returns:
+            list: Up to GEMINI_CACHE_CANDIDATES (row id, cosine similarity)
+                pairs at or above the similarity threshold, best first
+        """
+        import numpy as np
+        import ml_model
+        from scipy.sparse import vstack
+
+        query = ml_model.vectorize_texts([normalized])
+        if query is None:
+            return []
+        query, version = query
+
+        with self._index_lock:
+            # Rebuild on a new model, or once evicted rows dominate the matrix
+            entry = self._index.get(cfg)
+            if entry is None or entry['version'] != version or len(entry['ids']) > 2 * self.max_entries:
+                entry = {'version': version, 'last_id': 0, 'ids': [], 'matrix': None}
+                self._index[cfg] = entry
+
+            # Vectorize rows added since the last lookup, by any worker
+            rows = conn.execute(
+                'SELECT id, normalized FROM gemini_cache WHERE config_key = ? AND id > ? ORDER BY id',
+                (cfg, entry['last_id'])
+            ).fetchall()
+            if rows:
+                vectors = ml_model.vectorize_texts([text for _, text in rows])
+                if vectors is None or vectors[1] != version:
+                    return []
+                matrix = vectors[0]
+                entry['matrix'] = matrix if entry['matrix'] is None else vstack([entry['matrix'], matrix]).tocsr()
+                entry['ids'].extend(row_id for row_id, _ in rows)
+                entry['last_id'] = rows[-1][0]
+
+            if entry['matrix'] is None:
+                return []
+            scores = (entry['matrix'] @ query.T).toarray().ravel()
+            ids = entry['ids']
+
+        # The most similar rows at or above the threshold, best first
+        above = np.flatnonzero(scores >= self.similarity)
+        best = above[np.argsort(-scores[above], kind='stable')[:GEMINI_CACHE_CANDIDATES]]
+        return [(ids[i], float(scores[i])) for i in best]
+
+    def set(self, key, response):
+        """
+        Store a response, running an eviction pass every evict_interval seconds
+
+        Args:
+            key (tuple): Cache key from key()
+            response (str): Response text
+        """
+        try:
+            cfg, normalized = key
+            now = time.time()
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO gemini_cache '
+                    '(cache_key, config_key, normalized, response, created_at, last_used) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (f'{cfg}:{normalized}', cfg, normalized, response, now, now)
+                )
+            self._record('writes')
+        except Exception as e:
+            self._record('errors')
+            logger.error(f"Error writing Gemini cache: {e}")
+            return
+
+        # Counting the table on every insert costs a full scan; evicting
+        # periodically keeps writes to a single insert
+        with self._stats_lock:
+            due = now >= self._next_eviction
+            if due:
+                self._next_eviction = now + self.evict_interval
+        if due:
+            self.evict()
+
+    def evict(self):
+        """
+        Delete expired entries and the least recently used ones beyond max_entries
+
+        Returns:
+            int: Entries evicted
+        """
+        try:
+            conn = self._connect()
+            with conn:
+                evicted = conn.execute(
+                    'DELETE FROM gemini_cache WHERE created_at < ?', (time.time() - self.ttl,)
+                ).rowcount
+                overflow = conn.execute('SELECT COUNT(*) FROM gemini_cache').fetchone()[0] - self.max_entries
+                if overflow > 0:
+                    evicted += conn.execute(
+                        'DELETE FROM gemini_cache WHERE id IN '
+                        '(SELECT id FROM gemini_cache ORDER BY last_used LIMIT ?)',
+                        (overflow,)
+                    ).rowcount
+            if evicted:
+                self._record('evictions', evicted)
+                # Drop the near-duplicate matrices; the next lookup rebuilds them from live rows
+                with self._index_lock:
+                    self._index.clear()
+            return evicted
+        except Exception as e:
+            self._record('errors')
+            logger.error(f"Error evicting Gemini cache entries: {e}")
+            return 0
+
+    def clear(self):
+        """
+        Remove every cached response
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM gemini_cache')
+        with self._index_lock:
+            self._index.clear()
+
+    def stats(self):
+        """
+        Get cache counters and size
+
+        Returns:
+            dict: Hits, near-duplicate hits, misses, writes, evictions, errors and entries
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        try:
+            stats['entries'] = self._connect().execute('SELECT COUNT(*) FROM gemini_cache').fetchone()[0]
+        except Exception as e:
+            logger.error(f"Error reading Gemini cache size: {e}")
+            stats['entries'] = None
+        stats['max_entries'] = self.max_entries
+        stats['ttl'] = self.ttl
+        stats['similarity'] = self.similarity
+        stats['min_overlap'] = self.min_overlap
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Get the process-wide Gemini cache, or None if caching is disabled
+
+    Returns:
+        SemanticCache: Shared cache
+    """
+    global _cache
+
+    if not GEMINI_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = SemanticCache()
+                except Exception as e:
+                    logger.error(f"Could not open Gemini cache at {GEMINI_CACHE_PATH}: {e}")
+                    return None
+    return _cache
@@ -2,30 +2,71 @@
 Gemini API Client for enhanced chatbot responses
 """
 import os
+import sys
 import logging
-import google.generativeai as genai
+import time
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
-# Configure logger
-logging.basicConfig(level=logging.DEBUG)
+from gemini_cache import get_cache
+from circuit_breaker import CircuitBreaker, STATE_VALUES
+from single_flight import SingleFlight
+from session_context import build_context
+import metrics
+
+# Log level comes from metrics.configure_logging() in the entry points
 logger = logging.getLogger(__name__)
 
 # Configure API key
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 
-try:
-    genai.configure(api_key=GEMINI_API_KEY)
+# Optional API endpoint, e.g. a local stub server; uses the REST transport
+GEMINI_API_ENDPOINT = os.environ.get('GEMINI_API_ENDPOINT')
+
+# google.generativeai is imported and configured on first use, so importing
+# this module costs no SDK import and no network calls
+_genai = None
+_genai_lock = threading.Lock()
+
+def get_genai():
+    """
+    Import and configure the Gemini SDK on first use
+    
+    Returns:
+        module: The configured google.generativeai module
+    """
+    global _genai
+    
+    if _genai is None:
+        with _genai_lock:
+            if _genai is None:
+                import google.generativeai as genai
+                if GEMINI_API_ENDPOINT:
+                    genai.configure(
+                        api_key=GEMINI_API_KEY,
+                        transport='rest',
+                        client_options={'api_endpoint': GEMINI_API_ENDPOINT}
+                    )
+                else:
+                    genai.configure(api_key=GEMINI_API_KEY)
+                logger.info("Gemini API configured successfully")
+                _genai = genai
+    return _genai
+
+def list_available_models():
+    """
+    List the Gemini models available to the API key, to help with debugging
     
-    # Try to list available models to help with debugging
+    Returns:
+        list: Model names, empty if they could not be listed
+    """
     try:
-        models = genai.list_models()
-        model_names = [model.name for model in models]
+        model_names = [model.name for model in get_genai().list_models()]
         logger.info(f"Available Gemini models: {model_names}")
+        return model_names
     except Exception as model_error:
         logger.error(f"Could not list models: {str(model_error)}")
-    
-    logger.info("Gemini API configured successfully")
-except Exception as e:
-    logger.error(f"Failed to configure Gemini API: {str(e)}")
+        return []
 
 # Set up the model
 generation_config = {
@@ -54,36 +95,490 @@ safety_settings = [
     },
 ]
 
-def get_gemini_response(prompt, chat_history=None):
+# Model tiers: flash is faster and cheaper, pro is used when the prompt is
+# long or there is enough latency budget to afford it
+MODEL_TIERS = {
+    'flash': os.environ.get('GEMINI_FLASH_MODEL', 'models/gemini-1.5-flash'),
+    'pro': os.environ.get('GEMINI_PRO_MODEL', 'models/gemini-1.5-pro')
+}
+DEFAULT_TIER = os.environ.get('GEMINI_DEFAULT_TIER', 'pro')
+
+# Prompts up to this many characters go to flash (0 disables)
+FLASH_MAX_PROMPT_CHARS = int(os.environ.get('GEMINI_FLASH_MAX_PROMPT_CHARS', '0'))
+
+# Requests with less latency budget than this go to flash
+PRO_MIN_BUDGET_MS = float(os.environ.get('GEMINI_PRO_MIN_BUDGET_MS', '3000'))
+
+# Concurrent calls allowed, and how long a call waits for a free slot
+GEMINI_MAX_CONCURRENCY = int(os.environ.get('GEMINI_MAX_CONCURRENCY', '8'))
+GEMINI_POOL_TIMEOUT = float(os.environ.get('GEMINI_POOL_TIMEOUT', '1.0'))
+
+# Per-call deadline in seconds. The SDK takes a single deadline per request,
+# so it covers connecting and reading the response.
+GEMINI_TIMEOUT = float(os.environ.get('GEMINI_TIMEOUT', '10'))
+
+# Circuit breaker: trips when the failure or slow-call rate over the last
+# GEMINI_BREAKER_WINDOW calls crosses its threshold, then probes again
+# after GEMINI_BREAKER_OPEN_SECONDS (doubling up to the max on failed probes)
+GEMINI_BREAKER_WINDOW = int(os.environ.get('GEMINI_BREAKER_WINDOW', '50'))
+GEMINI_BREAKER_MIN_CALLS = int(os.environ.get('GEMINI_BREAKER_MIN_CALLS', '10'))
+GEMINI_BREAKER_FAILURE_RATE = float(os.environ.get('GEMINI_BREAKER_FAILURE_RATE', '0.5'))
+GEMINI_BREAKER_SLOW_MS = float(os.environ.get('GEMINI_BREAKER_SLOW_MS', '5000'))
+GEMINI_BREAKER_SLOW_RATE = float(os.environ.get('GEMINI_BREAKER_SLOW_RATE', '0.8'))
+GEMINI_BREAKER_OPEN_SECONDS = float(os.environ.get('GEMINI_BREAKER_OPEN_SECONDS', '10'))
+GEMINI_BREAKER_MAX_OPEN_SECONDS = float(os.environ.get('GEMINI_BREAKER_MAX_OPEN_SECONDS', '120'))
+GEMINI_BREAKER_HALF_OPEN_CALLS = int(os.environ.get('GEMINI_BREAKER_HALF_OPEN_CALLS', '3'))
+
+def build_breaker():
+    """
+    Create the Gemini circuit breaker from the environment settings
+    """
+    return CircuitBreaker(
+        'gemini',
+        window_size=GEMINI_BREAKER_WINDOW,
+        min_calls=GEMINI_BREAKER_MIN_CALLS,
+        failure_rate=GEMINI_BREAKER_FAILURE_RATE,
+        slow_call_ms=GEMINI_BREAKER_SLOW_MS,
+        slow_call_rate=GEMINI_BREAKER_SLOW_RATE,
+        open_seconds=GEMINI_BREAKER_OPEN_SECONDS,
+        max_open_seconds=GEMINI_BREAKER_MAX_OPEN_SECONDS,
+        half_open_calls=GEMINI_BREAKER_HALF_OPEN_CALLS
+    )
+
+
+class GeminiClient:
+    """
+    Long-lived Gemini client with one model object per tier, a bounded
+    number of in-flight calls and a deadline on every call
+    
+    The SDK module can be injected, so the client can be exercised against
+    a local stub that provides configure() and GenerativeModel.
+    """
+    
+    def __init__(self, genai_module=None, max_concurrency=GEMINI_MAX_CONCURRENCY,
+                 timeout=GEMINI_TIMEOUT, pool_timeout=GEMINI_POOL_TIMEOUT, model_tiers=None,
+                 breaker=None):
+        """
+        Args:
+            genai_module (module, optional): SDK module, defaults to get_genai()
+            max_concurrency (int): Maximum concurrent calls
+            timeout (float): Default per-call deadline in seconds
+            pool_timeout (float): Seconds to wait for a free slot
+            model_tiers (dict, optional): Tier name -> model name
+            breaker (CircuitBreaker, optional): Defaults to build_breaker()
+        """
+        self._genai = genai_module
+        self.breaker = breaker or build_breaker()
+        self.timeout = timeout
+        self.pool_timeout = pool_timeout
+        self.model_tiers = dict(model_tiers or MODEL_TIERS)
+        self._models = {}
+        self._models_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.max_concurrency = max_concurrency
+        self._stats_lock = threading.Lock()
+        self._stats = {'calls': 0, 'errors': 0, 'rejected': 0, 'short_circuited': 0, 'in_flight': 0, 'tiers': {}}
+    
+    def get_model(self, tier):
+        """
+        Get the shared model object for a tier, creating it on first use
+        
+        Args:
+            tier (str): Key in model_tiers
+            
+        Returns:
+            GenerativeModel: Model object reused across calls
+        """
+        model = self._models.get(tier)
+        if model is None:
+            with self._models_lock:
+                model = self._models.get(tier)
+                if model is None:
+                    genai = self._genai or get_genai()
+                    model = genai.GenerativeModel(
+                        model_name=self.model_tiers[tier],
+                        generation_config=generation_config,
+                        safety_settings=safety_settings
+                    )
+                    self._models[tier] = model
+        return model
+    
+    def choose_tier(self, prompt, latency_budget_ms=None):
+        """
+        Pick a model tier from the prompt length and the latency budget
+        
+        Args:
+            prompt (str): The user's input message
+            latency_budget_ms (float, optional): Time left for this call
+            
+        Returns:
+            str: Tier name
+        """
+        if latency_budget_ms is not None and latency_budget_ms < PRO_MIN_BUDGET_MS:
+            return 'flash'
+        if FLASH_MAX_PROMPT_CHARS and len(prompt) <= FLASH_MAX_PROMPT_CHARS:
+            return 'flash'
+        return DEFAULT_TIER
+    
+    def _record(self, stat, amount=1):
+        with self._stats_lock:
+            self._stats[stat] += amount
+    
+    def available(self):
+        """
+        Check whether calls would currently be let through the breaker
+        
+        Returns:
+            bool: False while the breaker is open
+        """
+        return self.breaker.state != 'open'
+    
+    def _acquire(self, timeout, kind):
+        """
+        Take a concurrency slot, then ask the breaker; on refusal nothing is held
+        
+        Returns:
+            bool: True if the call may proceed
+        """
+        # Shed load instead of queueing behind a slow upstream
+        if not self._slots.acquire(timeout=min(self.pool_timeout, timeout)):
+            self._record('rejected')
+            logger.warning(f"Gemini {kind} rejected: all {self.max_concurrency} slots busy")
+            return False
+        
+        # Skip the upstream entirely while the breaker is open
+        if not self.breaker.allow_request():
+            self._slots.release()
+            self._record('short_circuited')
+            return False
+        
+        self._record('in_flight')
+        return True
+    
+    def generate(self, prompt, tier=None, latency_budget_ms=None):
+        """
+        Generate content within the concurrency limit and a deadline
+        
+        Args:
+            prompt (str): Full prompt sent to the model
+            tier (str, optional): Model tier, chosen automatically if omitted
+            latency_budget_ms (float, optional): Caps the call deadline
+            
+        Returns:
+            str: Generated text, or None if no slot was free or the call failed
+        """
+        tier = tier or self.choose_tier(prompt, latency_budget_ms)
+        timeout = self.timeout
+        if latency_budget_ms is not None:
+            timeout = min(timeout, latency_budget_ms / 1000.0)
+        
+        if not self._acquire(timeout, 'call'):
+            return None
+        
+        start = time.perf_counter()
+        try:
+            with self._stats_lock:
+                self._stats['calls'] += 1
+                self._stats['tiers'][tier] = self._stats['tiers'].get(tier, 0) + 1
+            response = self.get_model(tier).generate_content(
+                prompt,
+                request_options={'timeout': timeout}
+            )
+            text = response.text
+            self.breaker.record_success((time.perf_counter() - start) * 1000)
+            return text
+        except Exception as e:
+            self.breaker.record_failure((time.perf_counter() - start) * 1000)
+            self._record('errors')
+            logger.error(f"Error getting Gemini response from {self.model_tiers.get(tier, tier)}: {str(e)}")
+            return None
+        finally:
+            self._record('in_flight', -1)
+            self._slots.release()
+    
+    def generate_stream(self, prompt, tier=None, latency_budget_ms=None):
+        """
+        Generate content as a stream of text chunks
+        
+        The concurrency slot is held until the stream is exhausted or closed.
+        
+        Args:
+            prompt (str): Full prompt sent to the model
+            tier (str, optional): Model tier, chosen automatically if omitted
+            latency_budget_ms (float, optional): Caps the call deadline
+            
+        Yields:
+            str: Text chunks as the model produces them; nothing if no slot
+            was free or the call failed before the first chunk
+            
+        Returns:
+            bool: True if the stream completed, False if it was cut short
+        """
+        tier = tier or self.choose_tier(prompt, latency_budget_ms)
+        timeout = self.timeout
+        if latency_budget_ms is not None:
+            timeout = min(timeout, latency_budget_ms / 1000.0)
+        
+        if not self._acquire(timeout, 'stream'):
+            return False
+        
+        start = time.perf_counter()
+        completed = False
+        try:
+            with self._stats_lock:
+                self._stats['calls'] += 1
+                self._stats['tiers'][tier] = self._stats['tiers'].get(tier, 0) + 1
+            response = self.get_model(tier).generate_content(
+                prompt,
+                stream=True,
+                request_options={'timeout': timeout}
+            )
+            for chunk in response:
+                text = chunk.text
+                if text:
+                    yield text
+            completed = True
+            return True
+        except Exception as e:
+            self._record('errors')
+            logger.error(f"Error streaming Gemini response from {self.model_tiers.get(tier, tier)}: {str(e)}")
+            return False
+        finally:
+            # A stream closed early by the reader says nothing about the upstream
+            latency_ms = (time.perf_counter() - start) * 1000
+            if completed:
+                self.breaker.record_success(latency_ms)
+            elif sys.exc_info()[0] is GeneratorExit:
+                self.breaker.record_abandoned()
+            else:
+                self.breaker.record_failure(latency_ms)
+            self._record('in_flight', -1)
+            self._slots.release()
+    
+    def stats(self):
+        """
+        Get call counters for this client
+        
+        Returns:
+            dict: Calls, errors, rejected calls, in-flight calls and calls per tier
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats['tiers'] = dict(self._stats['tiers'])
+        stats['max_concurrency'] = self.max_concurrency
+        stats['breaker'] = self.breaker.stats()
+        return stats
+
+
+_client = None
+_client_lock = threading.Lock()
+
+# Identical prompts in flight at the same time share one upstream call or stream
+_flights = SingleFlight()
+
+def get_client():
+    """
+    Get the process-wide Gemini client
+    
+    Returns:
+        GeminiClient: Shared client
+    """
+    global _client
+    
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GeminiClient()
+    return _client
+
+def set_client(client):
+    """
+    Replace the process-wide Gemini client, e.g. with one backed by a stub
+    
+    Args:
+        client (GeminiClient): Client to use from now on
+    """
+    global _client
+    
+    with _client_lock:
+        _client = client
+
+def build_prompt(prompt, chat_history=None):
+    """
+    Format the prompt with some context about the chatbot
+    
+    Args:
+        prompt (str): The user's input message
+        chat_history (list, optional): Recent turns, oldest first; trimmed to
+            the GEMINI_CONTEXT_TOKENS budget
+        
+    Returns:
+        str: Prompt sent to the model
+    """
+    context = build_context(chat_history)
+    if not context:
+        return f"You are a helpful assistant answering a user's question. Please provide a concise response to: {prompt}"
+    return (
+        "You are a helpful assistant in an ongoing conversation.\n"
+        f"Conversation so far:\n{context}\n\n"
+        f"Please provide a concise response to the user's latest message: {prompt}"
+    )
+
+def get_gemini_response(prompt, chat_history=None, latency_budget_ms=None):
     """
     Get a response from the Gemini API
     
     Args:
         prompt (str): The user's input message
         chat_history (list, optional): Chat history for context
+        latency_budget_ms (float, optional): Time left for this call
         
     Returns:
         str: Generated response from Gemini or None if error occurs
     """
+    # Repeated and near-duplicate questions are answered from the cache;
+    # answers that depend on earlier turns are not cached
+    cache = get_cache() if not chat_history else None
+    if cache is not None:
+        # Preprocessed once, for both the lookup and the insert
+        cache_key = cache.key(prompt, generation_config)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+    
+    enhanced_prompt = build_prompt(prompt, chat_history)
+    
+    client = get_client()
+    tier = client.choose_tier(prompt, latency_budget_ms)
+    wait = latency_budget_ms / 1000.0 if latency_budget_ms is not None else None
     try:
-        # Format the prompt with some context about the chatbot
-        enhanced_prompt = f"You are a helpful assistant answering a user's question. Please provide a concise response to: {prompt}"
-        
-        # Initialize the model - use a model name that exists in the available models
-        # Based on the list we retrieved, we should use models/gemini-1.5-pro or models/gemini-1.5-flash
-        model = genai.GenerativeModel(
-            model_name="models/gemini-1.5-pro",
-            generation_config=generation_config,
-            safety_settings=safety_settings
+        response, shared = _flights.do(
+            (tier, enhanced_prompt), client.generate, enhanced_prompt,
+            tier=tier, latency_budget_ms=latency_budget_ms, timeout=wait
         )
+    except FutureTimeoutError:
+        logger.warning("Timed out waiting for a coalesced Gemini call")
+        return None
+    
+    # Only the caller that made the upstream call stores the result
+    if response is not None and not shared:
+        logger.debug(f"Gemini response generated ({len(response)} chars)")
+        if cache is not None:
+            cache.set(cache_key, response)
+    return response
+
+def stream_gemini_response(prompt, chat_history=None, latency_budget_ms=None):
+    """
+    Stream a response from the Gemini API chunk by chunk
+    
+    Args:
+        prompt (str): The user's input message
+        chat_history (list, optional): Chat history for context
+        latency_budget_ms (float, optional): Deadline for the call
         
-        # Generate content
-        response = model.generate_content(enhanced_prompt)
-        
-        # Log and return the response
-        logger.debug(f"Gemini response generated: {response.text}")
-        return response.text
+    Yields:
+        str: Text chunks; nothing if the call failed before the first chunk
         
-    except Exception as e:
-        logger.error(f"Error getting Gemini response: {str(e)}")
-        return None
+    Returns:
+        bool: True if the answer is complete, False if the stream failed or
+            was cut short and the chunks so far are only part of an answer
+    """
+    cache = get_cache() if not chat_history else None
+    if cache is not None:
+        cache_key = cache.key(prompt, generation_config)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return True
+    
+    enhanced_prompt = build_prompt(prompt, chat_history)
+    
+    client = get_client()
+    tier = client.choose_tier(prompt, latency_budget_ms)
+    wait = latency_budget_ms / 1000.0 if latency_budget_ms is not None else None
+    # Identical prompts streamed at the same time share one upstream stream
+    stream = _flights.stream(
+        (tier, enhanced_prompt), client.generate_stream, enhanced_prompt,
+        tier=tier, latency_budget_ms=latency_budget_ms, timeout=wait
+    )
+    
+    chunks = []
+    completed = shared = False
+    while True:
+        try:
+            chunk = next(stream)
+        except StopIteration as stop:
+            completed, shared = stop.value
+            break
+        except FutureTimeoutError:
+            logger.warning("Timed out waiting for a coalesced Gemini stream")
+            break
+        chunks.append(chunk)
+        yield chunk
+    
+    # Only the caller that made the upstream call stores a stream that ran to completion
+    if completed and not shared and chunks and cache is not None:
+        cache.set(cache_key, ''.join(chunks))
+    return bool(completed)
+
+def gemini_available():
+    """
+    Check whether Gemini calls are currently let through the circuit breaker
+    
+    Returns:
+        bool: False while the breaker is open
+    """
+    return get_client().available()
+
+# e.g. "0 closed, 1 half open, 2 open", from the values the breaker reports
+BREAKER_STATE_HELP = ', '.join(
+    f"{value} {state.replace('_', ' ')}" for state, value in sorted(STATE_VALUES.items(), key=lambda item: item[1])
+)
+
+def _collect_metrics():
+    # Reads the existing client only; scraping never creates one
+    client = _client
+    if client is None:
+        return []
+    stats = client.stats()
+    breaker = stats['breaker']
+    flights = _flights.stats()
+    families = [
+        ('chatbot_gemini_calls_total', 'counter', 'Gemini API calls by tier',
+         [({'tier': tier}, count) for tier, count in stats['tiers'].items()]),
+        ('chatbot_gemini_failures_total', 'counter', 'Gemini calls that failed or were not made',
+         [({'reason': 'error'}, stats['errors']),
+          ({'reason': 'rejected'}, stats['rejected']),
+          ({'reason': 'short_circuited'}, stats['short_circuited'])]),
+        ('chatbot_gemini_in_flight', 'gauge', 'Gemini calls in progress',
+         [({}, stats['in_flight'])]),
+        ('chatbot_gemini_breaker_state', 'gauge', f'Circuit breaker state ({BREAKER_STATE_HELP})',
+         [({}, breaker['state_value'])]),
+        ('chatbot_gemini_coalesced_total', 'counter', 'Gemini calls by single-flight role',
+         [({'role': 'leader'}, flights['leaders']), ({'role': 'follower'}, flights['followers'])]),
+    ]
+    cache = get_cache()
+    if cache is not None:
+        cache_stats = cache.stats()
+        families.append(
+            ('chatbot_gemini_cache_total', 'counter', 'Gemini answer cache lookups',
+             [({'result': 'hit'}, cache_stats['hits']),
+              ({'result': 'near_hit'}, cache_stats['near_hits']),
+              ({'result': 'miss'}, cache_stats['misses'])])
+        )
+    return families
+
+metrics.register_collector(_collect_metrics)
+
+def get_gemini_stats():
+    """
+    Get Gemini client, circuit breaker, coalescing and cache metrics
+    
+    Returns:
+        dict: Client counters with breaker state, single-flight counts and cache stats
+    """
+    stats = get_client().stats()
+    stats['single_flight'] = _flights.stats()
+    cache = get_cache()
+    stats['cache'] = cache.stats() if cache is not None else None
+    return stats
@@ -0,0 +1,114 @@
+"""
+Space-Saving sketch for the most frequent items of a stream
+"""
+import heapq
+import threading
+
+
+class SpaceSaving:
+    """
+    Tracks approximate top-k items in a fixed number of counters
+
+    When a new item arrives and every counter is taken, the item with the
+    smallest count is replaced and the new item inherits that count as its
+    error bound. Any item with a true frequency above N / capacity is
+    guaranteed to be tracked.
+    """
+
+    def __init__(self, capacity=1000):
+        """
+        Args:
+            capacity (int): Number of counters kept
+        """
+        self.capacity = capacity
+        self._counts = {}   # item -> count
+        self._errors = {}   # item -> overestimation bound
+        self._heap = []     # (count, item), lazily updated
+        self._lock = threading.Lock()
+
+    def add(self, item, count=1):
+        """
+        Count an occurrence of an item
+
+        Args:
+            item (str): Item, e.g. a preprocessed query
+            count (int): Occurrences to add
+        """
+        with self._lock:
+            if item in self._counts:
+                self._counts[item] += count
+            elif len(self._counts) < self.capacity:
+                self._counts[item] = count
+                self._errors[item] = 0
+            else:
+                # Evict the current minimum; stale heap entries are skipped
+                while True:
+                    min_count, min_item = heapq.heappop(self._heap)
+                    if self._counts.get(min_item) == min_count:
+                        break
+                del self._counts[min_item]
+                del self._errors[min_item]
+                self._counts[item] = min_count + count
+                self._errors[item] = min_count
+            heapq.heappush(self._heap, (self._counts[item], item))
+
+            # Drop stale entries before the heap outgrows the counters
+            if len(self._heap) > 4 * self.capacity:
+                self._heap = [(c, i) for i, c in self._counts.items()]
+                heapq.heapify(self._heap)
+
+    def top(self, n=10):
+        """
+        Get the most frequent items
+
+        Args:
+            n (int): Number of items
+
+        Returns:
+            list: (item, count, error) tuples, most frequent first; the true
+                count lies between count - error and count
+        """
+        with self._lock:
+            items = heapq.nlargest(n, self._counts.items(), key=lambda entry: entry[1])
+            return [(item, count, self._errors[item]) for item, count in items]
+
+    def merge(self, other):
+        """
+        Merge another sketch's counters into this one (e.g. from another worker)
+
+        Args:
+            other (dict): Output of to_dict()
+        """
+        with self._lock:
+            for item, (count, error) in other.get('items', {}).items():
+                self._counts[item] = self._counts.get(item, 0) + count
+                self._errors[item] = self._errors.get(item, 0) + error
+            if len(self._counts) > self.capacity:
+                keep = heapq.nlargest(self.capacity, self._counts.items(), key=lambda entry: entry[1])
+                self._counts = dict(keep)
+                self._errors = {item: self._errors[item] for item in self._counts}
+            self._heap = [(count, item) for item, count in self._counts.items()]
+            heapq.heapify(self._heap)
+
+    def to_dict(self):
+        """
+        Serializable form of the counters
+
+        Returns:
+            dict: {'capacity': int, 'items': {item: [count, error]}}
+        """
+        with self._lock:
+            return {
+                'capacity': self.capacity,
+                'items': {item: [count, self._errors[item]] for item, count in self._counts.items()}
+            }
+
+    @classmethod
+    def from_dict(cls, data, capacity=None):
+        sketch = cls(capacity or data.get('capacity', 1000))
+        sketch.merge(data)
+        return sketch
+
+    def __len__(self):
+        with self._lock:
+            return len(self._counts)
@@ -0,0 +1,210 @@
+"""
+Keyset pagination for /history
+
+Pages are read newest first by (timestamp, id) across the user's sessions,
+with a cursor on the last message shown. The ix_message_timestamp_id index
+yields messages in that order, and the user's sessions are joined on the
+indexed chat_session.user_id, so a page never depends on how many sessions
+the user has.
+
+Reads go through the shared db_pool like the message writer's inserts, so
+pages can be served with or without the Flask app (e.g. by loadtest.py).
+"""
+import os
+import json
+import base64
+import logging
+from datetime import datetime
+
+import db_pool
+from message_writer import merge_pending_history
+
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', '50'))
+HISTORY_MAX_PAGE_SIZE = int(os.environ.get('HISTORY_MAX_PAGE_SIZE', '200'))
+
+HISTORY_COLUMNS = 'm.id, m.client_id, m.content, m.sender_type, m.timestamp'
+
+
+def encode_cursor(message):
+    """
+    Encode the position of a message dict as an opaque cursor string
+    """
+    position = [message['timestamp'], message['id']]
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor from encode_cursor
+
+    Returns:
+        tuple: (timestamp, id), or None if the cursor is invalid
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        # Cursors handed out before paging by timestamp also carried the session id
+        timestamp, message_id = position[-2:]
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except Exception as e:
+        logging.warning(f"Invalid history cursor {cursor!r}: {e}")
+        return None
+
+
+def row_to_dict(row):
+    """
+    Convert a HISTORY_COLUMNS row to a /history message
+    """
+    message_id, client_id, content, sender_type, timestamp = row
+    # SQLite hands timestamps back as the stored text
+    if not isinstance(timestamp, datetime):
+        timestamp = datetime.fromisoformat(timestamp)
+    return {
+        'id': message_id,
+        'client_id': client_id,
+        'content': content,
+        'sender_type': sender_type,
+        'timestamp': timestamp.isoformat()
+    }
+
+
+def history_page_query(position, limit, session_ids=None, user_id=None):
+    """
+    Build the query for the newest messages older than a position
+
+    Messages are read newest first by (timestamp, id), from the given
+    sessions or from every session of a user joined on chat_session.user_id.
+
+    Args:
+        position (tuple): (timestamp, id) to read before, or None for the newest
+        limit (int): Rows to return
+        session_ids (list, optional): ChatSession ids to read
+        user_id (int, optional): Read all of this user's sessions instead
+
+    Returns:
+        tuple: (SQL with %s placeholders, params) selecting HISTORY_COLUMNS newest first
+    """
+    if user_id is not None:
+        query = (
+            f"SELECT {HISTORY_COLUMNS} FROM message m "
+            "JOIN chat_session s ON s.id = m.chat_session_id WHERE s.user_id = %s"
+        )
+        params = [user_id]
+    else:
+        placeholders = ', '.join(['%s'] * len(session_ids))
+        query = f"SELECT {HISTORY_COLUMNS} FROM message m WHERE m.chat_session_id IN ({placeholders})"
+        params = list(session_ids)
+    if position is not None:
+        query += " AND (m.timestamp, m.id) < (%s, %s)"
+        params += list(position)
+    query += " ORDER BY m.timestamp DESC, m.id DESC LIMIT %s"
+    params.append(limit)
+    return query, tuple(params)
+
+
+def fetch_rows(query, params=()):
+    """
+    Run a query on a pooled connection and fetch all rows
+    """
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+
+def get_user_session_ids(user_id):
+    """
+    Get the ids of a user's chat sessions
+    """
+    return [session_id for (session_id,) in fetch_rows('SELECT id FROM chat_session WHERE user_id = %s', (user_id,))]
+
+
+def _get_page(cursor, limit, session_ids=None, user_id=None):
+    limit = max(1, min(int(limit), HISTORY_MAX_PAGE_SIZE))
+    position = None
+    if cursor:
+        position = decode_cursor(cursor)
+        if position is None:
+            raise ValueError("Invalid history cursor")
+
+    paging = {}
+
+    def load_history():
+        # One row more than the page tells whether there is an older page
+        rows = fetch_rows(*history_page_query(position, limit + 1, session_ids=session_ids, user_id=user_id))
+        paging['has_more'] = len(rows) > limit
+        messages = [row_to_dict(row) for row in rows[:limit]]
+        paging['next_cursor'] = encode_cursor(messages[-1]) if paging['has_more'] else None
+        return messages[::-1]
+
+    # The newest page also shows messages still queued for insertion
+    if position is None:
+        if session_ids is None:
+            session_ids = get_user_session_ids(user_id)
+        history = merge_pending_history(session_ids, load_history)
+    else:
+        history = load_history()
+
+    return {
+        'history': history,
+        'next_cursor': paging['next_cursor'],
+        'has_more': paging['has_more']
+    }
+
+
+def get_history_page(session_ids, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Get one page of messages older than the cursor
+
+    Args:
+        session_ids (list): ChatSession ids the user may read
+        cursor (str, optional): next_cursor of the previous page; None for the newest page
+        limit (int): Messages per page, capped at HISTORY_MAX_PAGE_SIZE
+
+    Returns:
+        dict: {'history': messages oldest first, 'next_cursor': str or None,
+            'has_more': bool}
+
+    Raises:
+        ValueError: If the cursor cannot be decoded
+    """
+    if not session_ids:
+        return {'history': [], 'next_cursor': None, 'has_more': False}
+    return _get_page(cursor, limit, session_ids=session_ids)
+
+
+def get_user_history_page(user_id, cursor=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Get a page of history across all of a user's chat sessions
+
+    Args:
+        user_id (int): User id
+        cursor (str, optional): next_cursor of the previous page
+        limit (int): Messages per page
+
+    Returns:
+        dict: Same as get_history_page
+
+    Raises:
+        ValueError: If the cursor cannot be decoded
+    """
+    return _get_page(cursor, limit, user_id=user_id)
+
+
+def create_history_indexes(engine):
+    """
+    Create the pagination indexes on an existing database
+
+    db.create_all() does not add indexes to tables that already exist.
+
+    Args:
+        engine: SQLAlchemy engine, e.g. db.engine
+    """
+    from models import Message, ChatSession
+
+    for table in (Message.__table__, ChatSession.__table__):
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+            logging.info(f"Ensured index {index.name}")
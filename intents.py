@@ -0,0 +1,83 @@
+"""
+Single-pass intent matching shared by responses.py and nlp.extract_entities
+"""
+import re
+import logging
+
+# Shared pattern table: intent -> phrases that signal it
+INTENT_PATTERNS = {
+    'greeting': ['hello', 'hi', 'hey', 'greetings', 'good morning', 'good afternoon', 'good evening'],
+    'farewell': ['bye', 'goodbye', 'see you', 'talk later', 'have a good day'],
+    'thankful': ['thank you', 'thanks', 'appreciate it', 'grateful'],
+    'question': ['what', 'who', 'where', 'when', 'why', 'how', '?'],
+}
+
+
+def _build_matcher(patterns):
+    """
+    Compile every phrase into one case-insensitive alternation
+
+    Phrases are tried longest first and word-like ends only match at token
+    boundaries, so "this" does not match "hi" but "goodbye" still wins over
+    "bye".
+
+    Returns:
+        tuple: (compiled regex, lowercase phrase -> intents mapping)
+    """
+    phrase_intents = {}
+    for intent, phrases in patterns.items():
+        for phrase in phrases:
+            phrase_intents.setdefault(phrase.lower(), set()).add(intent)
+
+    alternatives = []
+    for phrase in sorted(phrase_intents, key=len, reverse=True):
+        alternative = r'\s+'.join(re.escape(word) for word in phrase.split())
+        if re.match(r'\w', phrase):
+            alternative = r'(?<!\w)' + alternative
+        if re.search(r'\w$', phrase):
+            alternative += r'(?!\w)'
+        alternatives.append(alternative)
+
+    matcher = re.compile('|'.join(alternatives), re.IGNORECASE)
+    return matcher, {phrase: frozenset(intents) for phrase, intents in phrase_intents.items()}
+
+
+INTENT_MATCHER, PHRASE_INTENTS = _build_matcher(INTENT_PATTERNS)
+
+
+def match_intents(text):
+    """
+    Find every intent phrase in the text in a single scan
+
+    Args:
+        text (str): The input text
+
+    Returns:
+        list: (intent, matched phrase, start offset) tuples in text order
+    """
+    matches = []
+    if not text:
+        return matches
+
+    for match in INTENT_MATCHER.finditer(text):
+        phrase = ' '.join(match.group(0).lower().split())
+        for intent in PHRASE_INTENTS.get(phrase, ()):
+            matches.append((intent, phrase, match.start()))
+    return matches
+
+
+def classify_text(text):
+    """
+    Classify all intents present in the text
+
+    Args:
+        text (str): The input text
+
+    Returns:
+        frozenset: Intent names found, e.g. {'greeting', 'question'}
+    """
+    try:
+        return frozenset(intent for intent, _, _ in match_intents(text))
+    except Exception as e:
+        logging.error(f"Error classifying text intents: {e}")
+        return frozenset()
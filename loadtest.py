@@ -0,0 +1,596 @@
+"""
+Load test for the chat endpoints against a local Gemini stand-in
+
+Simulates concurrent users following the chat.js flow: load the newest
+page of /history (sometimes scrolling back a page), then send messages to
+/chat with exponentially distributed think times in between. Messages are
+a mix of greetings, known questions, paraphrases and novel questions that
+escalate to Gemini. Each concurrency level is reported with throughput,
+p50/p95/p99 latency per endpoint and the error rate.
+
+By default a harness server is started on SQLite with the fake_genai
+stand-in, so no database server or API key is needed:
+
+    python loadtest.py                                      # 1, 10 and 50 users, 60s each
+    python loadtest.py --levels 5,20 --duration 30 --gemini-latency-ms 1500
+    python loadtest.py --gemini-error-rate 0.1 --output loadtest.json
+    python loadtest.py --url http://localhost:5000          # drive a running server
+    python loadtest.py --serve --port 5055                  # only run the harness server
+
+The harness server (asgi.app plus /history and a persisting /chat) needs
+uvicorn. It creates the tables of models.py on SQLite through db_pool and
+serves /history with history.get_history_page, like the Flask route. Users
+log in with a Flask session cookie signed with SECRET_KEY, which is
+generated for the harness server and must be the server's own key with
+--url.
+"""
+import os
+import sys
+import json
+import time
+import random
+import secrets
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlsplit, urlencode, parse_qs
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_LEVELS = [1, 10, 50]
+
+# History page size, as sent by chat.js
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', '50'))
+
+# Share of each kind of message sent to /chat
+DEFAULT_MIX = 'greeting=0.15,known=0.4,paraphrase=0.25,novel=0.2'
+
+# Share of users who scroll back one page after the first /history page
+SCROLL_BACK_SHARE = 0.2
+
+GREETINGS = ['hi', 'hello', 'hey there', 'good morning', 'thanks', 'thank you', 'bye']
+
+PARAPHRASE_WORDS = ['please', 'quickly', 'again', 'exactly', 'actually', 'so', 'um', 'tell me']
+
+NOVEL_TOPICS = [
+    'quantum computing', 'sourdough bread', 'the french revolution', 'black holes',
+    'tax returns', 'marathon training', 'jazz harmony', 'kubernetes', 'photosynthesis',
+    'the stock market', 'medieval castles', 'electric cars', 'coral reefs', 'chess openings',
+]
+NOVEL_TEMPLATES = [
+    'can you explain {topic} in simple terms',
+    'what are the most common mistakes people make with {topic}',
+    'how would you compare {topic} and {other}',
+    'give me three interesting facts about {topic}',
+    'what should a beginner read first about {topic}',
+]
+
+
+# --- Harness server ---------------------------------------------------------
+
+# The tables and pagination indexes of models.py. models.py binds to the
+# Flask app's db, so the harness creates them through db_pool instead,
+# which is also what history.py and the message writer use
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS "user" (id INTEGER PRIMARY KEY, username VARCHAR(64) UNIQUE NOT NULL, '
+    'email VARCHAR(120) UNIQUE NOT NULL, password_hash VARCHAR(256) NOT NULL, created_at TIMESTAMP, '
+    'is_admin BOOLEAN DEFAULT FALSE)',
+    'CREATE TABLE IF NOT EXISTS chat_session (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES "user" (id), '
+    'started_at TIMESTAMP, is_active BOOLEAN DEFAULT TRUE)',
+    'CREATE INDEX IF NOT EXISTS ix_chat_session_user_id ON chat_session (user_id)',
+    'CREATE TABLE IF NOT EXISTS message (id INTEGER PRIMARY KEY, content TEXT NOT NULL, '
+    'sender_type VARCHAR(20) NOT NULL, timestamp TIMESTAMP, '
+    'chat_session_id INTEGER NOT NULL REFERENCES chat_session (id), client_id VARCHAR(32) UNIQUE)',
+    'CREATE INDEX IF NOT EXISTS ix_message_timestamp_id ON message (timestamp, id)',
+    'CREATE INDEX IF NOT EXISTS ix_message_session_timestamp_id ON message (chat_session_id, timestamp, id)',
+    'CREATE TABLE IF NOT EXISTS training_data (id INTEGER PRIMARY KEY, question TEXT NOT NULL, answer TEXT NOT NULL, '
+    'added_by INTEGER NOT NULL REFERENCES "user" (id), added_at TIMESTAMP, is_active BOOLEAN DEFAULT TRUE)',
+    'CREATE TABLE IF NOT EXISTS analytics_rollup (name VARCHAR(64) PRIMARY KEY, value BIGINT NOT NULL DEFAULT 0, '
+    'data TEXT, updated_at TIMESTAMP)',
+]
+
+
+def prepare_database(users, seed_messages):
+    """
+    Create the schema on the SQLite database and seed it
+
+    Every user gets one chat session whose id equals the user id, with
+    seed_messages earlier turns, and the default Q/A pairs become
+    training_data rows so training reads them from the database.
+
+    Args:
+        users (int): Users (and sessions) to create
+        seed_messages (int): Messages of existing history per session
+    """
+    from datetime import datetime, timedelta
+
+    import db_pool
+    import ml_model
+
+    questions, answers = ml_model.load_default_training_data()
+    now = datetime.utcnow()
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            for statement in SCHEMA:
+                cursor.execute(statement)
+            cursor.execute('SELECT COUNT(*) FROM "user"')
+            existing = cursor.fetchone()[0]
+            cursor.executemany(
+                'INSERT INTO "user" (id, username, email, password_hash, created_at) VALUES (%s, %s, %s, %s, %s)',
+                [(i, f'load{i}', f'load{i}@example.com', '-', now) for i in range(existing + 1, users + 1)]
+            )
+            cursor.executemany(
+                'INSERT INTO chat_session (id, user_id, started_at) VALUES (%s, %s, %s)',
+                [(i, i, now) for i in range(existing + 1, users + 1)]
+            )
+            rows = []
+            for session_id in range(existing + 1, users + 1):
+                for n in range(seed_messages):
+                    index = n // 2 % len(questions)
+                    sender_type, content = ('user', questions[index]) if n % 2 == 0 else ('bot', answers[index])
+                    rows.append((content, sender_type, now - timedelta(seconds=seed_messages - n), session_id))
+            cursor.executemany(
+                'INSERT INTO message (content, sender_type, timestamp, chat_session_id) VALUES (%s, %s, %s, %s)',
+                rows
+            )
+            cursor.execute('SELECT COUNT(*) FROM training_data')
+            if cursor.fetchone()[0] == 0:
+                cursor.executemany(
+                    'INSERT INTO training_data (question, answer, added_by, added_at) VALUES (%s, %s, 1, %s)',
+                    [(question, answer, now) for question, answer in zip(questions, answers)]
+                )
+        finally:
+            cursor.close()
+
+
+def login_session_id(scope):
+    """
+    Get the chat session of the logged-in user
+
+    Every seeded user owns one ChatSession with the same id.
+
+    Returns:
+        int: ChatSession id, or None without a valid login session
+    """
+    import asgi
+
+    user_id = asgi.get_user_id(scope)
+    try:
+        return int(user_id) if user_id is not None else None
+    except ValueError:
+        return None
+
+
+async def handle_history(scope, send):
+    import asgi
+    import cascade
+    from history import get_history_page
+
+    session_id = login_session_id(scope)
+    if session_id is None:
+        await asgi.send_json(send, 401, {'error': 'Login required'})
+        return
+
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    try:
+        page = await cascade.run_io(
+            get_history_page, [session_id],
+            query.get('before', [None])[0], query.get('limit', [HISTORY_PAGE_SIZE])[0]
+        )
+    except ValueError:
+        await asgi.send_json(send, 400, {'error': 'Invalid limit or cursor'})
+        return
+    await asgi.send_json(send, 200, page)
+
+
+def _persist_turn(session_id, message, response):
+    from message_writer import get_writer
+
+    writer = get_writer()
+    writer.enqueue(session_id, 'user', message)
+    writer.enqueue(session_id, 'bot', response)
+
+
+async def handle_chat(scope, receive, send):
+    import asgi
+    import cascade
+    from history import get_history_page
+    from session_context import session_store
+
+    session_id = login_session_id(scope)
+    if session_id is None:
+        await asgi.send_json(send, 401, {'error': 'Login required'})
+        return
+    parsed = await asgi.parse_chat_request(receive, send)
+    if parsed is None:
+        return
+    message, _ = parsed
+
+    def load_turns():
+        return get_history_page([session_id], limit=session_store.max_turns)['history']
+
+    chat_history = await cascade.run_io(session_store.get_history, session_id, load_turns)
+    response, trace = await cascade.get_cascade_response_async(message, chat_history)
+    # enqueue() can block briefly on a full queue, keep it off the event loop
+    await cascade.run_io(_persist_turn, session_id, message, response)
+    session_store.record_turn(session_id, 'user', message)
+    session_store.record_turn(session_id, 'bot', response)
+
+    await asgi.send_json(send, 200, {'response': response, 'source': trace['selected']})
+
+
+async def harness_app(scope, receive, send):
+    """
+    asgi.app with /history and a persisting /chat, standing in for the Flask routes
+    """
+    import asgi
+
+    if scope['type'] == 'http':
+        method, path = scope['method'], scope['path']
+        try:
+            if path == '/history' and method == 'GET':
+                await handle_history(scope, send)
+                return
+            if path == '/chat' and method == 'POST':
+                await handle_chat(scope, receive, send)
+                return
+        except Exception as e:
+            import logging
+            logging.error(f"Error handling {method} {path}: {e}")
+            await asgi.send_json(send, 500, {'error': 'Internal server error'})
+            return
+    await asgi.app(scope, receive, send)
+
+
+def serve(args):
+    """
+    Run the harness server on SQLite with the fake Gemini SDK
+    """
+    import logging
+
+    # Before db_pool is imported: it reads the backend once
+    os.environ['USE_MYSQL'] = 'false'
+    os.environ['DATABASE_URL'] = f'sqlite:///{args.db}'
+
+    import uvicorn
+    import metrics
+    import ml_model
+    import fake_genai
+
+    metrics.configure_logging()
+    fake_genai.install()
+    prepare_database(args.users, args.seed_messages)
+    if not ml_model.train_model():
+        logging.error("Training failed, the model stage will answer nothing")
+
+    logging.warning(
+        f"Load test server on port {args.port}: {args.users} users, fake Gemini "
+        f"{fake_genai.LATENCY_MS:.0f}ms median, {fake_genai.ERROR_RATE:.1%} errors"
+    )
+    uvicorn.run(harness_app, host='127.0.0.1', port=args.port, log_level='warning', access_log=False)
+    return 0
+
+
+# --- Load generator ---------------------------------------------------------
+
+def parse_mix(mix):
+    """
+    Parse 'greeting=0.15,known=0.4,...' into normalized weights
+
+    Returns:
+        tuple: (kinds, cumulative weights) for random.choices
+    """
+    weights = {}
+    for part in mix.split(','):
+        if part:
+            kind, weight = part.split('=')
+            if kind not in ('greeting', 'known', 'paraphrase', 'novel'):
+                raise ValueError(f"Unknown message kind: {kind}")
+            weights[kind] = float(weight)
+    return list(weights), list(weights.values())
+
+
+def make_message(kind, questions, rng):
+    """
+    Generate a chat message of the given kind
+
+    Args:
+        kind (str): 'greeting', 'known', 'paraphrase' or 'novel'
+        questions (list): Questions the model was trained on
+        rng (random.Random): Per-user random generator
+
+    Returns:
+        str: Message text
+    """
+    if kind == 'greeting':
+        return rng.choice(GREETINGS)
+    if kind == 'known':
+        return rng.choice(questions)
+    if kind == 'paraphrase':
+        words = rng.choice(questions).split()
+        words.insert(rng.randrange(len(words) + 1), rng.choice(PARAPHRASE_WORDS))
+        return ' '.join(words) + rng.choice(['', '?', ' please'])
+    topic, other = rng.sample(NOVEL_TOPICS, 2)
+    return rng.choice(NOVEL_TEMPLATES).format(topic=topic, other=other)
+
+
+class Recorder:
+    """
+    Collects (endpoint, latency, ok) samples from all user threads
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = []
+        self.sources = {}
+
+    def add(self, endpoint, seconds, ok, source=None):
+        with self._lock:
+            self.samples.append((endpoint, seconds, ok))
+            if source is not None:
+                self.sources[source] = self.sources.get(source, 0) + 1
+
+
+def session_cookie(user_id):
+    """
+    Get a Cookie header value logging in as the given user
+
+    Args:
+        user_id (int): User id
+
+    Returns:
+        str: Flask session cookie signed with SECRET_KEY
+    """
+    import asgi
+
+    value = asgi.get_session_serializer().dumps({'_user_id': str(user_id), '_fresh': True})
+    return f"{asgi.SESSION_COOKIE_NAME}={value}"
+
+
+def request(conn, method, path, body=None, cookie=None):
+    """
+    Send one request on a keep-alive connection
+
+    Returns:
+        tuple: (status, parsed JSON or None)
+    """
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    if cookie:
+        headers['Cookie'] = cookie
+    conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = conn.getresponse()
+    data = response.read()
+    try:
+        return response.status, json.loads(data) if data else None
+    except ValueError:
+        return response.status, None
+
+
+def timed(recorder, conn, endpoint, method, path, body=None, cookie=None):
+    # Connection errors count as failed requests; the caller reconnects
+    start = time.perf_counter()
+    try:
+        status, data = request(conn, method, path, body, cookie)
+    except (OSError, http.client.HTTPException):
+        recorder.add(endpoint, time.perf_counter() - start, False)
+        conn.close()
+        return None
+    ok = 200 <= status < 300
+    source = data.get('source') if ok and endpoint == 'chat' and isinstance(data, dict) else None
+    recorder.add(endpoint, time.perf_counter() - start, ok, source)
+    return data if ok else None
+
+
+def run_user(user_id, url, deadline, args, kinds, weights, questions, recorder):
+    """
+    One simulated user: load history, then chat with think times until the deadline
+    """
+    rng = random.Random(args.seed * 100003 + user_id)
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=args.timeout)
+    cookie = session_cookie(user_id % args.users + 1)
+
+    # Arrivals are spread over one think time instead of all at once
+    time.sleep(rng.uniform(0, args.think_ms / 1000.0))
+
+    params = {'limit': HISTORY_PAGE_SIZE}
+    page = timed(recorder, conn, 'history', 'GET', f"/history?{urlencode(params)}", cookie=cookie)
+    if page and page.get('has_more') and rng.random() < SCROLL_BACK_SHARE:
+        params['before'] = page['next_cursor']
+        timed(recorder, conn, 'history', 'GET', f"/history?{urlencode(params)}", cookie=cookie)
+
+    while True:
+        think = min(rng.expovariate(1000.0 / args.think_ms), args.think_ms * 10 / 1000.0)
+        if time.monotonic() + think >= deadline:
+            break
+        time.sleep(think)
+        message = make_message(rng.choices(kinds, weights)[0], questions, rng)
+        timed(recorder, conn, 'chat', 'POST', '/chat', {'message': message}, cookie)
+    conn.close()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def summarize_level(users, recorder, wall_seconds):
+    """
+    Summarize the samples of one concurrency level
+
+    Returns:
+        dict: Requests, requests/s, error rate, per-endpoint latency
+            percentiles in ms and the answer sources of /chat
+    """
+    samples = recorder.samples
+    errors = sum(1 for _, _, ok in samples if not ok)
+    endpoints = {}
+    for endpoint in sorted({endpoint for endpoint, _, _ in samples}):
+        latencies = sorted(seconds * 1000.0 for name, seconds, _ in samples if name == endpoint)
+        failed = sum(1 for name, _, ok in samples if name == endpoint and not ok)
+        endpoints[endpoint] = {
+            'requests': len(latencies),
+            'error_rate': failed / len(latencies),
+            'p50_ms': percentile(latencies, 0.50),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'max_ms': latencies[-1]
+        }
+    return {
+        'users': users,
+        'requests': len(samples),
+        'throughput': len(samples) / wall_seconds if wall_seconds > 0 else 0.0,
+        'error_rate': errors / len(samples) if samples else 0.0,
+        'endpoints': endpoints,
+        'sources': dict(sorted(recorder.sources.items()))
+    }
+
+
+def run_level(users, url, args, kinds, weights, questions):
+    recorder = Recorder()
+    start = time.monotonic()
+    deadline = start + args.duration
+    threads = [
+        threading.Thread(
+            target=run_user, name=f'load-user-{i}', daemon=True,
+            args=(i, url, deadline, args, kinds, weights, questions, recorder)
+        )
+        for i in range(users)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize_level(users, recorder, time.monotonic() - start)
+
+
+def wait_for_health(url, timeout, server=None):
+    """
+    Wait until GET /health answers 200
+
+    Raises:
+        RuntimeError: If the server exits or does not come up in time
+    """
+    parts = urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"Load test server exited with code {server.returncode}")
+        try:
+            conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=2)
+            status, _ = request(conn, 'GET', '/health')
+            conn.close()
+            if status == 200:
+                return
+        except (OSError, http.client.HTTPException):
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"No healthy server at {url} after {timeout:.0f}s")
+
+
+def start_server(args, workdir):
+    """
+    Start the harness server in a subprocess with its own database and artifacts
+
+    Returns:
+        subprocess.Popen: Server process
+    """
+    env = dict(
+        os.environ,
+        MODEL_ARTIFACT_DIR=os.path.join(workdir, 'artifacts'),
+        GEMINI_CACHE_PATH=os.path.join(workdir, 'gemini_cache.sqlite3'),
+        FAKE_GEMINI_LATENCY_MS=str(args.gemini_latency_ms),
+        FAKE_GEMINI_LATENCY_SIGMA=str(args.gemini_latency_sigma),
+        FAKE_GEMINI_ERROR_RATE=str(args.gemini_error_rate),
+        CASCADE_MODEL_THRESHOLD=str(args.model_threshold),
+        LOG_LEVEL=os.environ.get('LOG_LEVEL', 'WARNING'),
+    )
+    command = [
+        sys.executable, os.path.abspath(__file__), '--serve',
+        '--port', str(args.port),
+        '--db', os.path.join(workdir, 'loadtest.sqlite3'),
+        '--users', str(args.users),
+        '--seed-messages', str(args.seed_messages),
+    ]
+    return subprocess.Popen(command, cwd=PROJECT_DIR, env=env)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--levels', default=','.join(str(level) for level in DEFAULT_LEVELS),
+                        help='Comma-separated numbers of concurrent users')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds per concurrency level')
+    parser.add_argument('--think-ms', type=float, default=3000, help='Mean think time between messages')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Message kinds and their shares')
+    parser.add_argument('--timeout', type=float, default=30, help='Seconds before a request counts as failed')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for users and messages')
+    parser.add_argument('--url', help='Drive this server instead of starting the harness server')
+    parser.add_argument('--port', type=int, default=5055, help='Harness server port')
+    parser.add_argument('--users', type=int, help='Seeded users and sessions (default: the largest level)')
+    parser.add_argument('--seed-messages', type=int, default=120, help='Existing history per session')
+    parser.add_argument('--gemini-latency-ms', type=float, default=800, help='Median fake Gemini latency')
+    parser.add_argument('--gemini-latency-sigma', type=float, default=0.5, help='Log-normal sigma of that latency')
+    parser.add_argument('--gemini-error-rate', type=float, default=0.02, help='Share of failed fake Gemini calls')
+    parser.add_argument('--model-threshold', type=float, default=0.2,
+                        help='Model confidence below which the harness server escalates to Gemini')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    parser.add_argument('--serve', action='store_true', help='Only run the harness server')
+    parser.add_argument('--db', help='SQLite file for --serve (default: a temporary file)')
+    args = parser.parse_args(argv)
+
+    levels = [int(level) for level in args.levels.split(',') if level]
+    args.users = args.users or max(levels)
+
+    if args.serve:
+        args.db = args.db or os.path.join(tempfile.mkdtemp(prefix='loadtest-'), 'loadtest.sqlite3')
+        return serve(args)
+
+    if args.url and not os.environ.get('SECRET_KEY'):
+        parser.error("--url needs the server's SECRET_KEY in the environment to log users in")
+    # Shared with the harness server through the environment
+    os.environ.setdefault('SECRET_KEY', secrets.token_hex(32))
+
+    import ml_model
+    kinds, weights = parse_mix(args.mix)
+    questions, _ = ml_model.load_default_training_data()
+
+    with tempfile.TemporaryDirectory(prefix='loadtest-') as workdir:
+        server = None
+        url = args.url or f'http://127.0.0.1:{args.port}'
+        try:
+            if not args.url:
+                server = start_server(args, workdir)
+            wait_for_health(url, timeout=180, server=server)
+
+            results = []
+            print(f"{'users':>6} {'req/s':>8} {'errors':>7} {'endpoint':<8} {'p50 ms':>9} "
+                  f"{'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+            for users in levels:
+                result = run_level(users, url, args, kinds, weights, questions)
+                results.append(result)
+                for i, (endpoint, stats) in enumerate(result['endpoints'].items()):
+                    prefix = (f"{users:>6} {result['throughput']:>8.1f} {result['error_rate']:>7.2%}"
+                              if i == 0 else ' ' * 23)
+                    print(f"{prefix} {endpoint:<8} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} "
+                          f"{stats['p99_ms']:>9.1f} {stats['max_ms']:>9.1f}")
+                print(f"{'':>23} sources: {result['sources']}", flush=True)
+        finally:
+            if server is not None:
+                server.terminate()
+                try:
+                    server.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'settings': vars(args), 'levels': results}, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
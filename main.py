@@ -1,4 +1,19 @@
-from app import app
+import os
+
+import metrics
+
+metrics.configure_logging()
+
+# 'wsgi' runs the Flask app, 'asgi' the async chat server in asgi.py
+SERVER_MODE = os.environ.get('SERVER_MODE', 'wsgi').lower()
+
+if SERVER_MODE != 'asgi':
+    from app import app
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    if SERVER_MODE == 'asgi':
+        import uvicorn
+        from asgi import ASGI_WORKERS
+        uvicorn.run("asgi:app", host="0.0.0.0", port=5000, workers=ASGI_WORKERS)
+    else:
+        app.run(host="0.0.0.0", port=5000, debug=True)
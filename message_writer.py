@@ -0,0 +1,407 @@
+"""
+Write-behind batching for Message inserts
+
+Chat turns are queued and a background thread inserts them in bulk, one
+multi-row insert and one commit per batch, instead of a commit per message.
+Messages stay visible to their session through pending_messages() until
+they are committed, so /history keeps read-your-writes. Every message
+carries a client-generated id, which makes a retried insert idempotent and
+lets /history drop pending copies of rows it already read.
+"""
+import os
+import time
+import uuid
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime
+
+import db_pool
+import metrics
+
+# Queue capacity, rows per insert and the longest a message waits for a flush
+MESSAGE_QUEUE_SIZE = int(os.environ.get('MESSAGE_QUEUE_SIZE', '10000'))
+MESSAGE_BATCH_SIZE = int(os.environ.get('MESSAGE_BATCH_SIZE', '200'))
+MESSAGE_FLUSH_INTERVAL = float(os.environ.get('MESSAGE_FLUSH_INTERVAL', '0.05'))
+
+# How long enqueue() blocks on a full queue before writing the message itself
+MESSAGE_PUT_TIMEOUT = float(os.environ.get('MESSAGE_PUT_TIMEOUT', '0.5'))
+
+# Retries of a failed batch insert, with doubling delays from MESSAGE_RETRY_BACKOFF
+MESSAGE_WRITE_RETRIES = int(os.environ.get('MESSAGE_WRITE_RETRIES', '4'))
+MESSAGE_RETRY_BACKOFF = float(os.environ.get('MESSAGE_RETRY_BACKOFF', '0.2'))
+
+MESSAGE_COLUMNS = "message (content, sender_type, timestamp, chat_session_id, client_id)"
+
+
+def insert_messages(records):
+    """
+    Insert message records with a single multi-row statement and commit
+
+    Rows whose client_id is already stored are skipped, so a batch can be
+    retried after a commit whose outcome was lost.
+
+    Args:
+        records (list): PendingMessage objects
+    """
+    rows = [(r.content, r.sender_type, r.timestamp, r.chat_session_id, r.client_id) for r in records]
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        try:
+            if db_pool.USE_MYSQL:
+                # mysql.connector rewrites executemany INSERTs into one statement
+                cursor.executemany(f"INSERT IGNORE INTO {MESSAGE_COLUMNS} VALUES (%s, %s, %s, %s, %s)", rows)
+            elif db_pool.USE_SQLITE:
+                # sqlite3 runs them in one transaction in-process
+                cursor.executemany(f"INSERT OR IGNORE INTO {MESSAGE_COLUMNS} VALUES (%s, %s, %s, %s, %s)", rows)
+            else:
+                from psycopg2.extras import execute_values
+                execute_values(
+                    cursor, f"INSERT INTO {MESSAGE_COLUMNS} VALUES %s ON CONFLICT (client_id) DO NOTHING",
+                    rows, page_size=len(rows)
+                )
+        finally:
+            cursor.close()
+
+
+class PendingMessage:
+    """
+    A message accepted but not yet committed
+    """
+    __slots__ = ('chat_session_id', 'sender_type', 'content', 'timestamp', 'client_id')
+
+    def __init__(self, chat_session_id, sender_type, content, timestamp=None):
+        self.chat_session_id = chat_session_id
+        self.sender_type = sender_type
+        self.content = content
+        self.timestamp = timestamp or datetime.utcnow()
+        self.client_id = uuid.uuid4().hex
+
+    def to_dict(self):
+        # Same shape as the /history JSON entries
+        return {
+            'id': None,
+            'client_id': self.client_id,
+            'content': self.content,
+            'sender_type': self.sender_type,
+            'timestamp': self.timestamp.isoformat()
+        }
+
+
+class MessageWriter:
+    """
+    Bounded write-behind queue flushed on size or time thresholds
+    """
+
+    def __init__(self, flush_fn=insert_messages, max_queue=MESSAGE_QUEUE_SIZE,
+                 batch_size=MESSAGE_BATCH_SIZE, flush_interval=MESSAGE_FLUSH_INTERVAL,
+                 put_timeout=MESSAGE_PUT_TIMEOUT, on_written=None,
+                 retries=MESSAGE_WRITE_RETRIES, retry_backoff=MESSAGE_RETRY_BACKOFF):
+        """
+        Args:
+            flush_fn (callable): Persists a list of PendingMessage in one transaction
+            max_queue (int): Messages buffered before callers are pushed back
+            batch_size (int): Messages per flush
+            flush_interval (float): Seconds a message may wait for a fuller batch
+            put_timeout (float): Seconds enqueue() waits on a full queue
+            on_written (callable, optional): Called with each committed batch
+            retries (int): Extra attempts for a failed batch before it is dropped
+            retry_backoff (float): Seconds before the first retry, doubled for each next one
+        """
+        self.flush_fn = flush_fn
+        self.on_written = on_written
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = {}  # chat_session_id -> list of uncommitted PendingMessage
+        self._pending_lock = threading.Lock()
+        self._stop = threading.Event()
+        # Counts enqueue() calls past the stop check, so close() can wait for
+        # their put() before the final drain
+        self._enqueue_cond = threading.Condition()
+        self._enqueuing = 0
+        self._last_full_warning = float('-inf')
+        self._stats_lock = threading.Lock()
+        self._stats = {'enqueued': 0, 'written': 0, 'batches': 0, 'inline_writes': 0, 'retried': 0, 'failed': 0}
+        self._worker = threading.Thread(target=self._run, name='message-writer', daemon=True)
+        self._worker.start()
+
+    def _record(self, stat, amount=1):
+        with self._stats_lock:
+            self._stats[stat] += amount
+
+    def enqueue(self, chat_session_id, sender_type, content, timestamp=None):
+        """
+        Queue a message for insertion
+
+        When the queue stays full for put_timeout the message is written by
+        the caller instead, so producers slow down to the database's pace
+        rather than dropping messages.
+
+        Args:
+            chat_session_id (int): ChatSession id
+            sender_type (str): 'user' or 'bot'
+            content (str): Message text
+            timestamp (datetime, optional): Defaults to now (UTC)
+
+        Returns:
+            PendingMessage: The queued record
+        """
+        record = PendingMessage(chat_session_id, sender_type, content, timestamp)
+        with self._enqueue_cond:
+            stopped = self._stop.is_set()
+            if not stopped:
+                self._enqueuing += 1
+        if stopped:
+            self._write([record])
+            self._record('inline_writes')
+            return record
+
+        try:
+            with self._pending_lock:
+                self._pending.setdefault(chat_session_id, []).append(record)
+            try:
+                self._queue.put(record, timeout=self.put_timeout)
+                self._record('enqueued')
+                return record
+            except queue.Full:
+                pass
+        finally:
+            with self._enqueue_cond:
+                self._enqueuing -= 1
+                self._enqueue_cond.notify_all()
+
+        now = time.monotonic()
+        if now - self._last_full_warning > 10:
+            self._last_full_warning = now
+            logging.warning("Message queue full, writing messages inline")
+        self._write([record])
+        self._record('inline_writes')
+        return record
+
+    def pending_messages(self, chat_session_id):
+        """
+        Get a session's messages that are not committed yet, oldest first
+
+        Returns:
+            list: PendingMessage objects
+        """
+        with self._pending_lock:
+            return list(self._pending.get(chat_session_id, ()))
+
+    def merge_history(self, chat_session_id, load_history):
+        """
+        Read a session's history with its uncommitted messages included
+
+        Pending messages are read before the database is queried: a message
+        committed in between then shows up in both and is dropped here, while
+        reading them afterwards could miss it entirely.
+
+        Args:
+            chat_session_id (int): ChatSession id
+            load_history (callable): Returns the /history message dicts from the database
+
+        Returns:
+            list: History with pending messages merged in timestamp order
+        """
+        pending = self.pending_messages(chat_session_id)
+        return merge_pending(pending, load_history())
+
+    def _write(self, records):
+        # Messages stay pending (and visible in /history) while retrying;
+        # inserts skip client_ids already stored, so a retry never duplicates
+        written = False
+        for attempt in range(self.retries + 1):
+            try:
+                with metrics.stage_timer('db_write'):
+                    self.flush_fn(records)
+                written = True
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    logging.error(f"Dropping {len(records)} messages after {attempt + 1} failed writes: {e}")
+                    break
+                delay = self.retry_backoff * 2 ** attempt
+                logging.warning(f"Error writing {len(records)} messages, retrying in {delay:.1f}s: {e}")
+                self._record('retried', len(records))
+                time.sleep(delay)
+
+        if written:
+            self._record('written', len(records))
+            self._record('batches')
+        else:
+            self._record('failed', len(records))
+
+        # Committed (or given up on): stop serving them from memory
+        with self._pending_lock:
+            for record in records:
+                session_pending = self._pending.get(record.chat_session_id)
+                if session_pending is not None:
+                    try:
+                        session_pending.remove(record)
+                    except ValueError:
+                        pass
+                    if not session_pending:
+                        del self._pending[record.chat_session_id]
+
+        if written and self.on_written is not None:
+            try:
+                self.on_written(records)
+            except Exception as e:
+                logging.error(f"Error in message write hook: {e}")
+
+    def _next_batch(self):
+        # Wait for a first message, then fill the batch until it is full or
+        # the flush interval has passed
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+        self._drain()
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+    def close(self, timeout=10):
+        """
+        Stop accepting queued writes and flush everything still buffered
+
+        Args:
+            timeout (float): Seconds to wait for the drain
+        """
+        deadline = time.monotonic() + timeout
+        with self._enqueue_cond:
+            if self._stop.is_set():
+                return
+            self._stop.set()
+            # Later enqueue() calls write inline; wait for the ones already queueing
+            self._enqueue_cond.wait_for(lambda: self._enqueuing == 0, timeout)
+        self._worker.join(max(deadline - time.monotonic(), 0))
+        if self._worker.is_alive():
+            logging.error("Message writer did not drain before the timeout")
+            return
+        # Anything that still reached the queue after the worker's drain
+        self._drain()
+
+    def stats(self):
+        """
+        Get queue depth and write counters
+
+        Returns:
+            dict: Queued, written, batches, inline writes, retried, failures and queue depth
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self._queue.qsize()
+        return stats
+
+
+def merge_pending(pending, history):
+    """
+    Merge uncommitted messages into history, skipping ones already in it
+
+    Rows are matched on client_id: a message committed between reading the
+    pending messages and querying the database shows up only once.
+    """
+    if not pending:
+        return history
+
+    seen = {m.get('client_id') for m in history}
+    extra = [record.to_dict() for record in pending if record.client_id not in seen]
+
+    def order(message):
+        timestamp = message.get('timestamp')
+        return timestamp.isoformat() if isinstance(timestamp, datetime) else (timestamp or '')
+
+    return sorted(history + extra, key=order)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def merge_pending_history(chat_session_ids, load_history):
+    """
+    Load history with the uncommitted messages of the given sessions merged in
+
+    Does not start the writer; without one there is nothing pending.
+
+    Args:
+        chat_session_ids (list): ChatSession ids
+        load_history (callable): Returns /history message dicts from the database
+
+    Returns:
+        list: Merged history in timestamp order
+    """
+    writer = _writer
+    if writer is None:
+        return load_history()
+    pending = [record for session_id in chat_session_ids for record in writer.pending_messages(session_id)]
+    return merge_pending(pending, load_history())
+
+
+def _collect_metrics():
+    writer = _writer
+    if writer is None:
+        return []
+    stats = writer.stats()
+    return [
+        ('chatbot_message_writer_total', 'counter', 'Messages by write-behind outcome',
+         [({'event': name}, stats[name]) for name in ('enqueued', 'written', 'inline_writes', 'retried', 'failed')]),
+        ('chatbot_message_writer_batches_total', 'counter', 'Batched message inserts',
+         [({}, stats['batches'])]),
+        ('chatbot_message_queue_depth', 'gauge', 'Messages waiting for insertion',
+         [({}, stats['queue_depth'])]),
+    ]
+
+
+metrics.register_collector(_collect_metrics)
+
+
+def get_writer():
+    """
+    Get the process-wide message writer, started on first use and drained at exit
+
+    Returns:
+        MessageWriter: Shared writer
+    """
+    global _writer
+
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                # Committed messages also update the analytics rollups
+                from analytics import record_messages
+                _writer = MessageWriter(on_written=record_messages)
+                atexit.register(_writer.close)
+    return _writer
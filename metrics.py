@@ -0,0 +1,252 @@
+"""
+In-process metrics with Prometheus text exposition
+
+Stage timers feed fixed-bucket histograms. Counters that modules already
+keep (cache hits, Gemini calls, queue depths) are read at scrape time by
+collectors, so the request path only pays for the timers, and only for
+the sampled share of requests.
+
+Logging is configured here too, so the level is set in one place for
+every entry point.
+"""
+import os
+import time
+import random
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+
+# Share of requests whose stage latencies go into the histograms
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', '1.0'))
+
+# Root log level, and the share of per-request log lines that are written
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '1.0'))
+LOG_FORMAT = os.environ.get('LOG_FORMAT', '%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; covers sub-millisecond rule matching up to slow Gemini calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def configure_logging(level=None):
+    """
+    Configure the root logger from LOG_LEVEL / LOG_FORMAT
+
+    Args:
+        level (str, optional): Overrides LOG_LEVEL
+    """
+    level = (level or LOG_LEVEL).upper()
+    logging.basicConfig(level=level, format=LOG_FORMAT)
+    # basicConfig does nothing if a server already installed handlers
+    logging.getLogger().setLevel(level)
+
+
+def sampled():
+    """
+    Decide whether to record timings for the current request
+    """
+    return METRICS_ENABLED and (METRICS_SAMPLE_RATE >= 1.0 or random.random() < METRICS_SAMPLE_RATE)
+
+
+def log_sampled():
+    """
+    Decide whether to write a per-request log line
+    """
+    return LOG_SAMPLE_RATE >= 1.0 or random.random() < LOG_SAMPLE_RATE
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic counter with optional labels
+    """
+    kind = 'counter'
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        """
+        Args:
+            *label_values: One value per label name, in order
+            amount (float): Increment
+        """
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}"
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram with optional labels
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """
+        Args:
+            value (float): Observed value, e.g. seconds
+            *label_values: One value per label name, in order
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        with self._lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for label_values, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, label_values, ('le', _format_value(bound)))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.label_names, label_values)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+_registry_lock = threading.Lock()
+_metrics = {}
+_collectors = []
+
+
+def _register(metric):
+    with _registry_lock:
+        return _metrics.setdefault(metric.name, metric)
+
+
+def counter(name, documentation, label_names=()):
+    """
+    Get or create a registered counter
+    """
+    return _register(Counter(name, documentation, label_names))
+
+
+def histogram(name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+    """
+    Get or create a registered histogram
+    """
+    return _register(Histogram(name, documentation, label_names, buckets))
+
+
+def register_collector(collect):
+    """
+    Register a function read at scrape time
+
+    Args:
+        collect (callable): Returns a list of (name, type, help, samples),
+            where samples is a list of ({label: value}, value) and type is
+            'counter' or 'gauge'
+    """
+    with _registry_lock:
+        _collectors.append(collect)
+
+
+# Latency of each pipeline stage: rules, preprocess, model, predict,
+# fallback, gemini, db_write
+STAGE_SECONDS = histogram(
+    'chatbot_stage_duration_seconds', 'Time spent in each chat pipeline stage', ('stage',)
+)
+
+
+def observe_stage(stage, seconds):
+    """
+    Record a stage latency measured by the caller, unconditionally
+    """
+    if METRICS_ENABLED:
+        STAGE_SECONDS.observe(seconds, stage)
+
+
+@contextmanager
+def stage_timer(stage):
+    """
+    Time a block as a pipeline stage, for the sampled share of calls
+    """
+    if not sampled():
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage)
+
+
+def render():
+    """
+    Render every metric in the Prometheus text exposition format
+
+    Returns:
+        str: Exposition text
+    """
+    with _registry_lock:
+        metrics = list(_metrics.values())
+        collectors = list(_collectors)
+
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.collect())
+
+    for collect in collectors:
+        try:
+            families = collect()
+        except Exception as e:
+            logging.error(f"Error collecting metrics from {getattr(collect, '__module__', collect)}: {e}")
+            continue
+        for name, kind, documentation, samples in families:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                if value is None:
+                    continue
+                label_text = _format_labels(list(labels), list(labels.values()))
+                lines.append(f"{name}{label_text} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,96 @@
+"""
+Micro-batching of concurrent requests into a single batch call
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Gather items submitted from many threads and process them together.
+
+    A single daemon worker takes the first queued item, waits up to
+    ``max_wait`` seconds for more (or until ``max_batch_size`` is reached),
+    then calls ``batch_fn`` once with the list of items. ``batch_fn`` must
+    return one result per item, in order.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=64, max_wait=0.005):
+        """
+        Args:
+            batch_fn (callable): Function taking a list and returning a list
+            max_batch_size (int): Largest batch handed to batch_fn
+            max_wait (float): Seconds to wait for a batch to fill up
+        """
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, item, timeout=None):
+        """
+        Queue an item and block until its result is ready
+
+        Args:
+            item: Input passed to batch_fn as part of a batch
+            timeout (float, optional): Seconds to wait for the result
+
+        Returns:
+            The result batch_fn produced for this item
+        """
+        return self.submit_future(item).result(timeout=timeout)
+
+    def submit_future(self, item):
+        """
+        Queue an item without waiting for it
+
+        Args:
+            item: Input passed to batch_fn as part of a batch
+
+        Returns:
+            Future: Resolves to the result batch_fn produced for this item;
+                asyncio callers can await it with asyncio.wrap_future
+        """
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _collect(self):
+        """
+        Block for one item, then gather more until the batch is full or the wait expires
+        """
+        batch = [self._queue.get()]
+        end = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            items = [item for item, _ in batch]
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise ValueError(f"Batch function returned {len(results)} results for {len(items)} items")
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                logging.error(f"Error processing micro-batch of {len(items)} items: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
@@ -1,115 +1,325 @@
 import os
+import random
 import logging
-import pickle
+import copy
+import time
+import threading
+from concurrent.futures import Future
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.pipeline import Pipeline
-import psycopg2
-from psycopg2 import Error
-import mysql.connector
-from mysql.connector import Error as MySQLError
+from sklearn.preprocessing import normalize
+import metrics
+from response_cache import ResponseCache
+from micro_batcher import MicroBatcher
+from fallback_index import FallbackIndex
+from retrieval import RetrievalModel
+from model_artifact import (
+    ArtifactModel, export_artifact, load_artifact, current_version_path,
+    read_manifest, pipeline_kind
+)
 
-# Determine database type
-USE_MYSQL = os.environ.get('USE_MYSQL', 'false').lower() == 'true'
+# Database type and driver access live in db_pool
+from db_pool import BACKEND_NAME, load_db_driver, iter_column_chunks
+
+# Response cache keyed on (model_version, preprocessed text)
+response_cache = ResponseCache(
+    max_size=int(os.environ.get('RESPONSE_CACHE_SIZE', '1024')),
+    ttl=float(os.environ.get('RESPONSE_CACHE_TTL', '300'))
+)
+
+# Answers by source ('model', 'fallback', 'unknown'), i.e. the fallback rate
+MODEL_ANSWERS = metrics.counter(
+    'chatbot_model_answers_total', 'Local answers by source, cached ones included', ('source',)
+)
+
+def _collect_metrics():
+    stats = response_cache.stats()
+    return [
+        ('chatbot_response_cache_total', 'counter', 'Response cache lookups and evictions',
+         [({'result': 'hit'}, stats['hits']),
+          ({'result': 'miss'}, stats['misses']),
+          ({'result': 'eviction'}, stats['evictions'])]),
+        ('chatbot_response_cache_entries', 'gauge', 'Entries in the response cache',
+         [({}, stats['size'])]),
+        ('chatbot_model_version', 'gauge', 'Model swaps in this process',
+         [({}, model_version)]),
+    ]
+
+metrics.register_collector(_collect_metrics)
+
+# Micro-batching of concurrent get_scored_response_batched() calls, which
+# is how the cascade's model stage scores every request
+MICRO_BATCH_WAIT_MS = float(os.environ.get('MICRO_BATCH_WAIT_MS', '5'))
+MICRO_BATCH_MAX_SIZE = int(os.environ.get('MICRO_BATCH_MAX_SIZE', '64'))
+response_batcher = None
+_batcher_lock = threading.Lock()
+
+# Training mode: 'full' refits TF-IDF + NB from scratch on every update,
+# 'incremental' uses a stateless hashing vectorizer so update_model() only
+# has to partial_fit the rows added since the stored watermark
+TRAINING_MODE = os.environ.get('TRAINING_MODE', 'full').lower()
+
+# Seconds between scheduled full rebuilds in incremental mode
+FULL_REBUILD_INTERVAL = float(os.environ.get('FULL_REBUILD_INTERVAL', '86400'))
+
+# Hashed feature space of incremental mode. MultinomialNB keeps dense
+# n_classes x n_features float64 arrays (feature counts and log probs),
+# so every class costs 2 * 8 * n_features bytes: 256 KB at 2**14
+HASHING_N_FEATURES = int(os.environ.get('HASHING_N_FEATURES', str(2 ** 14)))
+
+# Model backend: 'nb' classifies with TF-IDF (or hashing) + MultinomialNB,
+# 'retrieval' answers with the nearest training question by cosine
+# similarity. Retrieval always uses full rebuilds.
+MODEL_BACKEND = os.environ.get('MODEL_BACKEND', 'nb').lower()
+
+# Retrieval tuning: questions per scoring block (0 = one block), threads
+# scoring blocks and the similarity a prediction must exceed
+RETRIEVAL_BLOCK_SIZE = int(os.environ.get('RETRIEVAL_BLOCK_SIZE', '0'))
+RETRIEVAL_JOBS = int(os.environ.get('RETRIEVAL_JOBS', '1'))
+RETRIEVAL_MIN_SCORE = float(os.environ.get('RETRIEVAL_MIN_SCORE', '0.1'))
+
+def build_pipeline():
+    """
+    Build an untrained model pipeline for the configured backend and training mode
+    
+    Returns:
+        Pipeline: Vectorizer + MultinomialNB pipeline, or a RetrievalModel
+    """
+    if MODEL_BACKEND == 'retrieval':
+        return RetrievalModel(
+            block_size=RETRIEVAL_BLOCK_SIZE,
+            n_jobs=RETRIEVAL_JOBS,
+            min_score=RETRIEVAL_MIN_SCORE
+        )
+    if TRAINING_MODE == 'incremental':
+        # alternate_sign=False keeps features non-negative for MultinomialNB
+        return Pipeline([
+            ('hashing', HashingVectorizer(n_features=HASHING_N_FEATURES, alternate_sign=False)),
+            ('clf', MultinomialNB())
+        ])
+    return Pipeline([
+        ('tfidf', TfidfVectorizer(max_features=5000)),
+        ('clf', MultinomialNB())
+    ])
+
+# Versioned model artifacts (see model_artifact.py); arrays are memory-mapped
+# so all worker processes share one copy of the weights
+MODEL_ARTIFACT_DIR = os.environ.get(
+    'MODEL_ARTIFACT_DIR',
+    os.path.join(os.path.dirname(__file__), 'model_artifacts')
+)
+# Hashing every file reads the whole artifact at startup and defeats the lazy
+# memory-mapped load, so it is opt-in (e.g. after copying artifacts between hosts)
+MODEL_VERIFY_CHECKSUM = os.environ.get('MODEL_VERIFY_CHECKSUM', 'false').lower() == 'true'
+MODEL_KEEP_VERSIONS = int(os.environ.get('MODEL_KEEP_VERSIONS', '3'))
+
+# Seconds between checks for a newer artifact published by another process
+MODEL_RELOAD_INTERVAL = float(os.environ.get('MODEL_RELOAD_INTERVAL', '5'))
 
 # Initialize the model pipeline
-model_pipeline = Pipeline([
-    ('tfidf', TfidfVectorizer(max_features=5000)),
-    ('clf', MultinomialNB())
-])
-
-# Check if a pre-trained model exists and load it
-model_path = os.path.join(os.path.dirname(__file__), 'chatbot_model.pkl')
-try:
-    if os.path.exists(model_path):
-        with open(model_path, 'rb') as f:
-            model_pipeline = pickle.load(f)
-            logging.info("Loaded pre-trained model from disk")
-except Exception as e:
-    logging.error(f"Error loading pre-trained model: {e}")
+model_pipeline = build_pipeline()
 
 # Flag to track if model needs training
-model_trained = os.path.exists(model_path)
+model_trained = False
 
-def get_training_data_from_db():
+# Bumped on every model swap in this process so cached responses from an
+# older model are never served
+model_version = 0
+
+# Version and directory of the artifact the current model was loaded from
+artifact_version = 0
+artifact_path = None
+
+# Incremental training state, stored in the artifact manifest: the highest
+# training_data id already learned (None when trained on default data)
+# and when the last full rebuild happened
+training_watermark = None
+last_full_rebuild = 0.0
+
+_last_reload_check = 0.0
+
+# Questions/answers the current model was trained on, when known in memory
+# (otherwise they are read from the artifact), and the fallback index built
+# from them for one model version
+model_training_data = None
+fallback_index = None
+fallback_index_version = None
+_fallback_index_lock = threading.Lock()
+
+def install_model(pipeline, path, manifest, training_data=None):
     """
-    Fetch training data from the database (MySQL or PostgreSQL)
+    Swap in a new model and invalidate cached responses
+    
+    model_pipeline is replaced before model_version is bumped: readers load
+    model_version before model_pipeline, so they can never cache an answer
+    from the old pipeline under the new version.
+    
+    Args:
+        pipeline: sklearn Pipeline or ArtifactModel to serve
+        path (str): Artifact directory the model came from, if any
+        manifest (dict): Artifact manifest with version and training state
+        training_data (tuple, optional): (questions, answers) the model was trained on
+    """
+    global model_pipeline, model_trained, model_version, model_training_data
+    global artifact_version, artifact_path, training_watermark, last_full_rebuild
+    
+    model_pipeline = pipeline
+    model_training_data = training_data
+    artifact_path = path
+    artifact_version = manifest.get('model_version', 0)
+    training_watermark = manifest.get('watermark')
+    last_full_rebuild = manifest.get('last_full_rebuild', 0.0)
+    
+    model_trained = True
+    model_version += 1
+    # Old entries can no longer be hit, free them right away
+    response_cache.clear()
+
+def load_model():
+    """
+    Load the currently published model artifact
     
     Returns:
-        tuple: (questions, answers) lists
+        bool: True if an artifact was loaded
+    """
+    try:
+        model = load_artifact(MODEL_ARTIFACT_DIR, verify=MODEL_VERIFY_CHECKSUM)
+        if model is not None:
+            install_model(model, model.path, model.manifest)
+            logging.info(f"Loaded model artifact version {model.model_version} from disk")
+            return True
+    except Exception as e:
+        logging.error(f"Error loading model artifact: {e}")
+    return False
+
+# Check if a published model exists and load it
+load_model()
+
+# Background retraining: one worker thread at a time, triggers that arrive
+# while it runs are coalesced into a single follow-up run
+_training_lock = threading.Lock()
+_status_lock = threading.Lock()
+_retrain_idle = threading.Event()
+_retrain_idle.set()
+training_status = {
+    'state': 'idle',
+    'stage': None,
+    'pending': False,
+    'pending_full_rebuild': False,
+    'started_at': None,
+    'finished_at': None,
+    'last_duration': None,
+    'last_message': None,
+    'last_error': None,
+    'runs': 0,
+    'coalesced': 0
+}
+
+class TrainingDataError(Exception):
     """
-    questions = []
-    answers = []
+    Raised when the training data stream fails after some rows were read
+    """
+
+def training_query(since_id=None):
+    """
+    Query for active training data, optionally only the rows added since
+    the last incremental update
     
-    if USE_MYSQL:
-        # MySQL implementation
-        try:
-            # Get database connection details from environment variables
-            db_config = {
-                'host': os.environ.get('DB_HOST', 'localhost'),
-                'database': os.environ.get('DB_NAME', 'chatbot'),
-                'user': os.environ.get('DB_USER', 'root'),
-                'password': os.environ.get('DB_PASSWORD', ''),
-                'port': os.environ.get('DB_PORT', '3306')
-            }
-            
-            # Connect to the MySQL database
-            conn = mysql.connector.connect(**db_config)
-            
-            if conn.is_connected():
-                cursor = conn.cursor()
-                
-                # Query to get active training data
-                query = "SELECT question, answer FROM training_data WHERE is_active = TRUE"
-                cursor.execute(query)
-                
-                # Process the results
-                for row in cursor.fetchall():
-                    questions.append(row[0])  # First column is question
-                    answers.append(row[1])    # Second column is answer
-                
-                cursor.close()
-                conn.close()
-                
-                logging.info(f"Successfully retrieved {len(questions)} training data from MySQL")
+    Returns:
+        tuple: (query, params)
+    """
+    query = "SELECT id, question, answer FROM training_data WHERE is_active = TRUE"
+    params = ()
+    if since_id is not None:
+        query += " AND id > %s"
+        params = (since_id,)
+    query += " ORDER BY id"
+    return query, params
+
+def iter_training_chunks(since_id=None):
+    """
+    Stream active training data from the database in column chunks
+    
+    Rows are read through a pooled connection with a server-side cursor,
+    so only one chunk of the table is in memory at a time.
+    
+    Args:
+        since_id (int, optional): Only return rows with an id above this watermark
+        
+    Yields:
+        tuple: (ids, questions, answers) lists for each chunk, ordered by id
         
-        except MySQLError as e:
-            logging.error(f"Error connecting to MySQL: {e}")
+    Raises:
+        TrainingDataError: If the read fails after the first chunk, so a
+            truncated table is never taken for the whole one. A failure
+            before any row was read ends the stream empty, like an
+            unreachable database.
+    """
+    query, params = training_query(since_id)
+    backend = BACKEND_NAME
+    try:
+        load_db_driver()
+    except ImportError as e:
+        logging.error(f"Database driver not available: {e}")
+        return
     
-    else:
-        # PostgreSQL implementation
-        try:
-            # Get database connection details from environment variables
-            database_url = os.environ.get('DATABASE_URL')
-            
-            if not database_url:
-                logging.error("DATABASE_URL not found in environment variables")
-                return questions, answers
-                
-            # Connect to the PostgreSQL database
-            conn = psycopg2.connect(database_url)
-            
-            # Create a cursor
-            cursor = conn.cursor()
-            
-            # Query to get active training data
-            query = "SELECT question, answer FROM training_data WHERE is_active = TRUE"
-            cursor.execute(query)
-            
-            # Process the results
-            for row in cursor.fetchall():
-                questions.append(row[0])  # First column is question
-                answers.append(row[1])    # Second column is answer
-            
-            cursor.close()
-            conn.close()
+    total = 0
+    try:
+        for ids, questions, answers in iter_column_chunks(query, params):
+            total += len(ids)
+            yield ids, questions, answers
+    except GeneratorExit:
+        raise
+    except Exception as e:
+        logging.error(f"Error reading training data from {backend} after {total} rows: {e}")
+        if total:
+            raise TrainingDataError(f"Training data read failed after {total} rows: {e}") from e
+        return
+    logging.info(f"Successfully retrieved {total} training data from {backend}")
+
+def fetch_training_columns(since_id=None):
+    """
+    Fetch active training data from the database (MySQL or PostgreSQL)
+    
+    Args:
+        since_id (int, optional): Only return rows with an id above this watermark
+    
+    Returns:
+        tuple: (ids, questions, answers) lists ordered by id; empty if the
+            database cannot be read
             
-            logging.info(f"Successfully retrieved {len(questions)} training data from PostgreSQL")
-        
-        except Error as e:
-            logging.error(f"Error connecting to PostgreSQL: {e}")
+    Raises:
+        TrainingDataError: If the read fails partway through
+    """
+    ids, questions, answers = [], [], []
+    for chunk_ids, chunk_questions, chunk_answers in iter_training_chunks(since_id):
+        ids.extend(chunk_ids)
+        questions.extend(chunk_questions)
+        answers.extend(chunk_answers)
+    return ids, questions, answers
+
+def fetch_training_rows(since_id=None):
+    """
+    Fetch active training rows from the database (MySQL or PostgreSQL)
     
+    Args:
+        since_id (int, optional): Only return rows with an id above this watermark
+    
+    Returns:
+        list: (id, question, answer) tuples ordered by id
+    """
+    return list(zip(*fetch_training_columns(since_id)))
+
+def get_training_data_from_db():
+    """
+    Fetch training data from the database (MySQL or PostgreSQL)
+    
+    Returns:
+        tuple: (questions, answers) lists
+    """
+    _, questions, answers = fetch_training_columns()
     return questions, answers
 
 def load_default_training_data():
@@ -232,14 +442,110 @@ def load_default_training_data():
     
     return questions, answers
 
+def publish_model(pipeline, watermark, full_rebuild_time, training_data):
+    """
+    Export a trained pipeline as a new artifact version
+    
+    Args:
+        pipeline: Fitted sklearn Pipeline
+        watermark (int): Highest training_data id learned, None for default data
+        full_rebuild_time (float): Time of the last full rebuild
+        training_data (tuple): (questions, answers) the pipeline was trained on
+        
+    Returns:
+        tuple: (model, path, manifest, training_data) ready for install_model(). If the
+            export fails the in-memory pipeline is returned so serving
+            still picks up the new model, with the currently published
+            path so only a newer artifact replaces it.
+    """
+    # Keep versions increasing across processes sharing the artifact dir
+    published = current_version_path(MODEL_ARTIFACT_DIR)
+    latest = read_manifest(published).get('model_version', 0) if published else 0
+    version = max(artifact_version, latest) + 1
+    
+    metadata = {
+        'training_mode': TRAINING_MODE,
+        'watermark': watermark,
+        'last_full_rebuild': full_rebuild_time
+    }
+    
+    try:
+        export_artifact(
+            pipeline, MODEL_ARTIFACT_DIR, version, metadata, MODEL_KEEP_VERSIONS,
+            training_data=training_data
+        )
+        
+        # Serve from the memory-mapped copy so this process shares pages
+        # with the other workers
+        model = load_artifact(MODEL_ARTIFACT_DIR, verify=False)
+        return model, model.path, model.manifest, training_data
+    except Exception as e:
+        logging.error(f"Error saving model artifact: {e}")
+        # Recorded as the artifact we are on, so the reload check does not
+        # replace the model just trained with this older published one
+        return pipeline, published, dict(metadata, model_version=version), training_data
+
+def _reload_worker():
+    """
+    Load a newer artifact published by another process
+    """
+    try:
+        if current_version_path(MODEL_ARTIFACT_DIR) != artifact_path:
+            load_model()
+    finally:
+        _training_lock.release()
+
+def maybe_reload_model():
+    """
+    Pick up an artifact published by another worker, at most every
+    MODEL_RELOAD_INTERVAL seconds
+    
+    The check is one readlink; the load itself runs on a background thread
+    and is skipped while this process is training.
+    """
+    global _last_reload_check
+    
+    now = time.monotonic()
+    if now - _last_reload_check < MODEL_RELOAD_INTERVAL:
+        return
+    _last_reload_check = now
+    
+    path = current_version_path(MODEL_ARTIFACT_DIR)
+    if path is None or path == artifact_path:
+        return
+    
+    if _training_lock.acquire(blocking=False):
+        threading.Thread(target=_reload_worker, name="model-reload", daemon=True).start()
+
+def set_training_stage(stage):
+    """
+    Record the current step of a training run for the status API
+    
+    Args:
+        stage (str): Short name of the step, e.g. 'fetching' or 'fitting'
+    """
+    with _status_lock:
+        training_status['stage'] = stage
+
 def train_model():
     """
     Train the ML model using data from the database or fallback to default data
-    """
-    global model_trained, model_pipeline
     
+    A new pipeline is fitted off to the side and swapped in by reference, so
+    requests predicting concurrently keep using the previous model.
+    
+    Returns:
+        bool: True if a new model was trained and swapped in
+    """
     # First try to get training data from database
-    questions, answers = get_training_data_from_db()
+    set_training_stage('fetching')
+    try:
+        ids, questions, answers = fetch_training_columns()
+    except TrainingDataError as e:
+        # Never publish a model fitted on part of the table
+        logging.error(f"Keeping the current model: {e}")
+        return False
+    watermark = ids[-1] if ids else None
     
     # If no data from database, use default training data
     if not questions:
@@ -247,106 +553,600 @@ def train_model():
     
     if questions:
         try:
-            # Train the model
-            model_pipeline.fit(questions, answers)
+            # Train a fresh pipeline for the configured mode
+            set_training_stage('fitting')
+            pipeline = build_pipeline()
+            pipeline.fit(questions, answers)
             
-            # Save the trained model
-            with open(model_path, 'wb') as f:
-                pickle.dump(model_pipeline, f)
-            
-            model_trained = True
+            # Save the trained model and swap it in
+            set_training_stage('saving')
+            install_model(*publish_model(pipeline, watermark, time.time(), (questions, answers)))
             logging.info("Model trained and saved successfully")
+            return True
         except Exception as e:
             logging.error(f"Error training model: {e}")
     else:
         logging.error("No training data available")
+    
+    return False
 
-def get_response(text):
+def can_update_incrementally():
     """
-    Get a response from the ML model based on the input text
+    Check whether the current model supports an incremental update
+    
+    Returns:
+        bool: True if new rows can be partial_fit into the current model
+    """
+    return (
+        TRAINING_MODE == 'incremental'
+        and model_trained
+        and training_watermark is not None
+        and pipeline_kind(model_pipeline) == 'hashing'
+        and hashing_n_features(model_pipeline) == HASHING_N_FEATURES
+        and time.time() - last_full_rebuild < FULL_REBUILD_INTERVAL
+    )
+
+def hashing_n_features(pipeline):
+    """
+    Get the hashed feature count of a hashing pipeline or artifact, so a
+    changed HASHING_N_FEATURES forces a full rebuild
+    """
+    if isinstance(pipeline, ArtifactModel):
+        return pipeline.manifest['vectorizer'].get('n_features')
+    return pipeline.named_steps['hashing'].n_features
+
+def partial_train_model():
+    """
+    Learn only the training rows added since the stored watermark
+    
+    Rows deactivated or edited after they were learned stay in the model
+    until the next full rebuild.
+    
+    Returns:
+        int: Number of new rows learned
+    """
+    set_training_stage('fetching')
+    
+    # Update a copy so concurrent predictions never see half-updated counts
+    pipeline = None
+    questions, answers = [], []
+    watermark = None
+    chunks = iter_training_chunks(since_id=training_watermark)
+    while True:
+        try:
+            chunk_ids, chunk_questions, chunk_answers = next(chunks)
+        except StopIteration:
+            break
+        except TrainingDataError as e:
+            # Rows are learned in id order, so the chunks already learned
+            # are published with their watermark and the rest comes next time
+            logging.warning(f"Stopping incremental update at id {watermark}: {e}")
+            break
+        if pipeline is None:
+            set_training_stage('fitting')
+            if isinstance(model_pipeline, ArtifactModel):
+                pipeline = model_pipeline.to_pipeline()
+            else:
+                pipeline = copy.deepcopy(model_pipeline)
+            vectorizer = pipeline.named_steps['hashing']
+            clf = pipeline.named_steps['clf']
+        
+        # MultinomialNB.partial_fit only accepts classes it already knows, so
+        # new answers get zero-count rows before the counts are updated
+        known = set(clf.classes_.tolist())
+        new_classes = [answer for answer in dict.fromkeys(chunk_answers) if answer not in known]
+        if new_classes:
+            n_features = clf.feature_count_.shape[1]
+            clf.classes_ = np.concatenate([clf.classes_, np.array(new_classes, dtype=object)])
+            clf.class_count_ = np.concatenate([clf.class_count_, np.zeros(len(new_classes))])
+            clf.feature_count_ = np.vstack([clf.feature_count_, np.zeros((len(new_classes), n_features))])
+        
+        # Each chunk is vectorized and learned as it streams in
+        clf.partial_fit(vectorizer.transform(chunk_questions), chunk_answers)
+        questions.extend(chunk_questions)
+        answers.extend(chunk_answers)
+        watermark = chunk_ids[-1]
+    
+    if pipeline is None:
+        logging.info("No new training data since last update")
+        return 0
+    
+    set_training_stage('saving')
+    old_questions, old_answers = current_training_data()
+    training_data = (old_questions + questions, old_answers + answers)
+    install_model(*publish_model(pipeline, watermark, last_full_rebuild, training_data))
+    logging.info(f"Model incrementally updated with {len(questions)} new rows")
+    return len(questions)
+
+# Replies used when neither the model nor the fallback matcher has an answer
+UNKNOWN_RESPONSES = [
+    "I'm not sure I understand that. Could you rephrase?",
+    "That's an interesting question. I'll need to learn more about that.",
+    "I don't have specific information on that topic yet.",
+    "I'm still learning about many topics. Could you ask me something else?",
+    "I'm not familiar with that specific query. Could you try a different question?"
+]
+
+def current_training_data():
+    """
+    Get the questions and answers the current model was trained on
+    
+    Returns:
+        tuple: (questions, answers) lists, the default training data if the
+            model is untrained or its training data is not known
+    """
+    if model_training_data is not None:
+        return model_training_data
+    if model_trained and isinstance(model_pipeline, ArtifactModel):
+        training_data = model_pipeline.training_data()
+        if training_data is not None:
+            return training_data
+    return load_default_training_data()
+
+def get_fallback_index():
+    """
+    Get the fallback index for the current model, building it once per model version
+    
+    Returns:
+        FallbackIndex: Inverted index over the current training questions
+    """
+    global fallback_index, fallback_index_version
+    
+    version = model_version
+    if fallback_index is not None and fallback_index_version == version:
+        return fallback_index
+    
+    with _fallback_index_lock:
+        if fallback_index is None or fallback_index_version != version:
+            questions, answers = current_training_data()
+            fallback_index = FallbackIndex(questions, answers)
+            fallback_index_version = version
+        return fallback_index
+
+def search_fallback_batch(texts):
+    """
+    Match texts against the training questions when prediction fails
     
     Args:
-        text (str): Preprocessed user input
+        texts (list): Preprocessed user inputs
         
     Returns:
-        str: Bot response from the ML model or None if prediction fails
+        list: (answer, score, match_type) for each text, or None where nothing matched
+    """
+    index = get_fallback_index()
+    
+    results = []
+    for text in texts:
+        match = index.search(text)
+        if match is not None:
+            answer, score, match_type = match
+            if match_type == 'direct':
+                logging.debug(f"Direct match found for query: {text}")
+            else:
+                logging.debug(f"Word match found for query: {text} (score: {score})")
+        results.append(match)
+    
+    return results
+
+def match_fallback_batch(texts):
+    """
+    Match texts against the training questions when prediction fails
+    
+    Args:
+        texts (list): Preprocessed user inputs
+        
+    Returns:
+        list: Matched answer for each text, or None where nothing matched
+    """
+    return [match[0] if match else None for match in search_fallback_batch(texts)]
+
+def predict_with_confidence(pipeline, texts):
+    """
+    Predict answers together with a confidence score
+    
+    The score is the top class probability for the NB backend (0 when the
+    text has no known features) and the cosine similarity of the nearest
+    question for the retrieval backend.
+    
+    Args:
+        pipeline: Fitted pipeline, RetrievalModel or ArtifactModel
+        texts (list): Preprocessed user inputs
+        
+    Returns:
+        list: (answer, confidence) per text, answer None where the retrieval
+            backend found nothing similar enough
+    """
+    if pipeline_kind(pipeline) == 'retrieval':
+        min_score = pipeline.min_score
+        results = []
+        for rows, scores in pipeline.kneighbors(texts, k=1):
+            if len(rows) and scores[0] > min_score:
+                question_answers = pipeline.index.question_answers
+                results.append((pipeline.classes_[question_answers[rows[0]]], float(scores[0])))
+            else:
+                results.append((None, float(scores[0]) if len(scores) else 0.0))
+        return results
+    
+    if isinstance(pipeline, ArtifactModel):
+        X = pipeline.transform(texts)
+        proba = pipeline.proba_from_features(X)
+    else:
+        X = pipeline[:-1].transform(texts)
+        proba = pipeline[-1].predict_proba(X)
+    
+    # Texts without a single known feature only get the class prior back,
+    # so their prediction carries no confidence at all
+    has_features = np.diff(X.tocsr().indptr) > 0
+    best = np.argmax(proba, axis=1)
+    return [
+        (pipeline.classes_[j], float(proba[i, j]) if has_features[i] else 0.0)
+        for i, j in enumerate(best)
+    ]
+
+def vectorize_texts(texts):
+    """
+    Map preprocessed texts into the current model's feature space
+    
+    Args:
+        texts (list): Preprocessed texts
+        
+    Returns:
+        tuple: (L2-normalized sparse matrix, model_version), or None if the
+            model is not trained
     """
-    global model_trained
+    # Read the version first so the matrix is never newer than the version
+    version = model_version
+    pipeline = model_pipeline
+    if not model_trained:
+        return None
     
-    # If model is not trained, train it first
+    if pipeline_kind(pipeline) == 'retrieval' or isinstance(pipeline, ArtifactModel):
+        X = pipeline.transform(texts)
+    else:
+        X = pipeline[:-1].transform(texts)
+    return normalize(X.tocsr()), version
+
+def _score_texts(texts):
+    # Never train inline: kick off a background run and answer from the
+    # fallback matcher until the model is ready
     if not model_trained:
-        train_model()
+        # The run already in progress will produce the model; queueing a
+        # follow-up would make every fresh deploy train twice
+        request_retrain(if_idle=True)
+    else:
+        maybe_reload_model()
+    
+    results = [None] * len(texts)
     
     try:
-        # Get prediction from model
-        if text and model_trained:
-            # Convert input to proper format for prediction
-            text_input = [text]
-            
+        # Read the version before the pipeline (see install_model)
+        version = model_version
+        pipeline = model_pipeline
+        
+        # Group uncached texts so duplicates in a burst are predicted once
+        pending = {}
+        for i, text in enumerate(texts):
+            if not text:
+                continue
+            cached = response_cache.get((version, text))
+            if cached is not None:
+                results[i] = cached
+            else:
+                pending.setdefault(text, []).append(i)
+        
+        if not pending:
+            return results
+        
+        pending_texts = list(pending)
+        
+        if model_trained:
             try:
-                # Make prediction
-                prediction = model_pipeline.predict(text_input)
+                # Make one prediction over the whole sparse matrix
+                with metrics.stage_timer('predict'):
+                    predictions = predict_with_confidence(pipeline, pending_texts)
                 
-                # Return the predicted response
-                if prediction and len(prediction) > 0:
-                    return prediction[0]
+                if len(predictions) == len(pending_texts):
+                    # The retrieval backend predicts None when no training
+                    # question is similar enough, those go to the fallback
+                    unanswered = []
+                    for text, (prediction, confidence) in zip(pending_texts, predictions):
+                        if prediction is None:
+                            unanswered.append(text)
+                            continue
+                        result = (prediction, confidence, 'model')
+                        response_cache.set((version, text), result)
+                        for i in pending[text]:
+                            results[i] = result
+                    if not unanswered:
+                        return results
+                    pending_texts = unanswered
                 else:
                     logging.error("Prediction was empty")
             except Exception as prediction_error:
                 logging.error(f"Error making prediction: {prediction_error}")
-                
-            # If prediction fails or is empty, use default data more intelligently
-            questions, answers = load_default_training_data()
-            
-            # First try direct matching
-            for i, question in enumerate(questions):
-                if text.lower() in question.lower() or question.lower() in text.lower():
-                    logging.info(f"Direct match found for query: {text}")
-                    return answers[i]
-            
-            # If no direct match, try word-level matching
-            text_words = set(text.lower().split())
-            best_match = None
-            best_score = 0
-            
-            for i, question in enumerate(questions):
-                question_words = set(question.lower().split())
-                common_words = text_words.intersection(question_words)
-                
-                # Calculate a simple overlap score
-                if len(question_words) > 0:
-                    score = len(common_words) / len(question_words)
-                    
-                    if score > best_score:
-                        best_score = score
-                        best_match = i
-            
-            # Use the best match if score is above threshold
-            if best_match is not None and best_score > 0.3:
-                logging.info(f"Word match found for query: {text} (score: {best_score})")
-                return answers[best_match]
-            
-            # If all else fails, return a randomly selected response
-            import random
-            logging.info(f"Using random response for query: {text}")
-            return random.choice([
-                "I'm not sure I understand that. Could you rephrase?",
-                "That's an interesting question. I'll need to learn more about that.",
-                "I don't have specific information on that topic yet.",
-                "I'm still learning about many topics. Could you ask me something else?",
-                "I'm not familiar with that specific query. Could you try a different question?"
-            ])
-                        
+        else:
+            logging.info("Model not trained yet, using fallback matching")
+        
+        # If prediction fails or is empty, use default data more intelligently
+        with metrics.stage_timer('fallback'):
+            matches = search_fallback_batch(pending_texts)
+        for text, match in zip(pending_texts, matches):
+            if match is not None:
+                result = (match[0], match[1], 'fallback')
+                response_cache.set((version, text), result)
+            else:
+                # If all else fails, return a randomly selected response
+                # (not cached, so a later retrain or rephrase can still match)
+                logging.debug(f"Using random response for query: {text}")
+                result = None
+            for i in pending[text]:
+                results[i] = result or (random.choice(UNKNOWN_RESPONSES), 0.0, 'unknown')
+    
     except Exception as e:
-        logging.error(f"Error getting response from model: {e}")
+        logging.error(f"Error getting responses from model: {e}")
+    
+    return results
+
+def get_scored_responses(texts):
+    """
+    Get responses with confidence and source for many preprocessed inputs
     
+    Cached texts are answered directly, duplicates are predicted once and the
+    remaining texts go through one vectorized transform/predict. If prediction
+    fails the fallback matcher runs over the whole batch.
+    
+    Args:
+        texts (list): Preprocessed user inputs
+        
+    Returns:
+        list: (response, confidence, source) for each input, where source is
+            'model', 'fallback' or 'unknown' (random filler, confidence 0),
+            or None where no response could be made
+    """
+    results = _score_texts(texts)
+    for result in results:
+        if result is not None:
+            MODEL_ANSWERS.inc(result[2])
+    return results
+
+def get_responses(texts):
+    """
+    Get responses for many preprocessed inputs with a single model call
+    
+    Args:
+        texts (list): Preprocessed user inputs
+        
+    Returns:
+        list: Bot response for each input, None where no response could be made
+    """
+    return [result[0] if result else None for result in get_scored_responses(texts)]
+
+def get_response(text):
+    """
+    Get a response from the ML model based on the input text
+    
+    Args:
+        text (str): Preprocessed user input
+        
+    Returns:
+        str: Bot response from the ML model or None if prediction fails
+    """
     # Return None if response generation fails
     # The main app will use a fallback response
-    return None
+    return get_responses([text])[0]
+
+def get_scored_response(text):
+    """
+    Get a response with its confidence and source
+    
+    Args:
+        text (str): Preprocessed user input
+        
+    Returns:
+        tuple: (response, confidence, source), or None if prediction fails
+    """
+    return get_scored_responses([text])[0]
+
+def submit_scored_response(text):
+    """
+    Queue a preprocessed input on the shared micro-batcher
+    
+    Concurrent callers are gathered for a few milliseconds and answered by
+    one get_scored_responses() call. Batching is disabled when
+    MICRO_BATCH_WAIT_MS is 0, in which case the input is scored right away.
+    
+    Args:
+        text (str): Preprocessed user input
+        
+    Returns:
+        Future: Resolves to (response, confidence, source), or None if
+            prediction fails
+    """
+    global response_batcher
+    
+    if MICRO_BATCH_WAIT_MS <= 0:
+        future = Future()
+        future.set_result(get_scored_response(text))
+        return future
+    
+    if response_batcher is None:
+        with _batcher_lock:
+            if response_batcher is None:
+                response_batcher = MicroBatcher(
+                    get_scored_responses,
+                    max_batch_size=MICRO_BATCH_MAX_SIZE,
+                    max_wait=MICRO_BATCH_WAIT_MS / 1000.0
+                )
+    
+    return response_batcher.submit_future(text)
+
+def get_scored_response_batched(text):
+    """
+    Get a scored response through the shared micro-batcher
+    
+    Args:
+        text (str): Preprocessed user input
+        
+    Returns:
+        tuple: (response, confidence, source), or None if prediction fails
+    """
+    try:
+        return submit_scored_response(text).result()
+    except Exception as e:
+        logging.error(f"Error getting batched model response: {e}")
+        return None
+
+def get_response_batched(text):
+    """
+    Get a response through the shared micro-batcher
+    
+    Args:
+        text (str): Preprocessed user input
+        
+    Returns:
+        str: Bot response from the ML model or None if prediction fails
+    """
+    result = get_scored_response_batched(text)
+    return result[0] if result else None
 
-def update_model():
+def run_model_update(full_rebuild=False):
+    """
+    Update the model with new training data in the calling thread
+    
+    In incremental mode only rows added since the last update are learned,
+    unless a full rebuild is requested or the scheduled rebuild is due.
+    
+    Args:
+        full_rebuild (bool): Force a full retrain from all training data
+        
+    Returns:
+        str: Description of the update that was made
+    """
+    with _training_lock:
+        if not full_rebuild and can_update_incrementally():
+            try:
+                count = partial_train_model()
+                return f"Model updated incrementally with {count} new rows"
+            except Exception as e:
+                logging.error(f"Error updating model incrementally, doing a full rebuild: {e}")
+        
+        if not train_model():
+            raise RuntimeError("Model training failed")
+        return "Model updated successfully"
+
+def _retrain_worker(full_rebuild):
+    """
+    Run model updates until no more retrain requests are pending
+    """
+    while True:
+        started = time.time()
+        message = None
+        error = None
+        try:
+            message = run_model_update(full_rebuild)
+        except Exception as e:
+            logging.error(f"Error in background retrain: {e}")
+            error = str(e)
+        
+        with _status_lock:
+            training_status['runs'] += 1
+            training_status['finished_at'] = time.time()
+            training_status['last_duration'] = training_status['finished_at'] - started
+            training_status['last_message'] = message
+            training_status['last_error'] = error
+            training_status['stage'] = None
+            
+            # Requests that arrived during this run are served by one more run
+            if training_status['pending']:
+                full_rebuild = training_status['pending_full_rebuild']
+                training_status['pending'] = False
+                training_status['pending_full_rebuild'] = False
+                training_status['started_at'] = time.time()
+                continue
+            
+            training_status['state'] = 'idle'
+            _retrain_idle.set()
+            return
+
+def request_retrain(full_rebuild=False, if_idle=False):
+    """
+    Schedule a model update on a background thread
+    
+    If a run is already in progress the request is coalesced into a single
+    follow-up run, so a burst of triggers costs at most two training passes.
+    
+    Args:
+        full_rebuild (bool): Force a full retrain from all training data
+        if_idle (bool): Only start a run when none is in progress, without
+            queueing a follow-up (e.g. to get a first model)
+        
+    Returns:
+        dict: Training status after scheduling
+    """
+    with _status_lock:
+        if training_status['state'] == 'running':
+            if not if_idle:
+                training_status['pending'] = True
+                training_status['pending_full_rebuild'] |= full_rebuild
+                training_status['coalesced'] += 1
+        else:
+            training_status['state'] = 'running'
+            training_status['started_at'] = time.time()
+            _retrain_idle.clear()
+            threading.Thread(
+                target=_retrain_worker,
+                args=(full_rebuild,),
+                name="model-retrain",
+                daemon=True
+            ).start()
+    
+    return get_training_status()
+
+def get_training_status():
+    """
+    Get the state of background retraining
+    
+    Returns:
+        dict: Worker state, current stage, timings and the live model version
+    """
+    with _status_lock:
+        status = dict(training_status)
+    status['model_trained'] = model_trained
+    status['model_version'] = model_version
+    status['artifact_version'] = artifact_version
+    status['artifact_path'] = artifact_path
+    status['training_mode'] = TRAINING_MODE
+    status['model_backend'] = MODEL_BACKEND
+    return status
+
+def update_model(full_rebuild=False, wait=False):
     """
     Update the model with new training data
+    
+    The update runs on the background retrain worker and the new model is
+    swapped in when it is ready.
+    
+    Args:
+        full_rebuild (bool): Force a full retrain from all training data
+        wait (bool): Block until the background run has finished
+    """
+    status = request_retrain(full_rebuild)
+    if not wait:
+        return {"success": True, "message": "Model update scheduled", "status": status}
+    
+    _retrain_idle.wait()
+    status = get_training_status()
+    if status['last_error']:
+        return {"success": False, "message": status['last_error'], "status": status}
+    return {"success": True, "message": status['last_message'], "status": status}
+
+def get_cache_stats():
+    """
+    Get response cache statistics
+    
+    Returns:
+        dict: Cache counters plus the current model version
     """
-    train_model()
-    return {"success": True, "message": "Model updated successfully"}
+    stats = response_cache.stats()
+    stats["model_version"] = model_version
+    return stats
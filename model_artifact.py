@@ -0,0 +1,509 @@
+"""
+Versioned, memory-mappable model artifacts
+
+A trained TF-IDF (or hashing) + MultinomialNB pipeline is exported as raw
+numpy arrays plus a JSON manifest:
+
+    model_artifacts/
+        current -> versions/v000003-1760000000
+        versions/v000003-1760000000/
+            manifest.json
+            vocabulary_bytes.npy  vocabulary_offsets.npy  idf.npy  (TF-IDF models only)
+            classes_bytes.npy  classes_offsets.npy
+            feature_log_prob.npy  class_log_prior.npy  feature_count.npy  class_count.npy
+            questions_bytes.npy  questions_offsets.npy  question_answers.npy
+                (training data, optional)
+            question_data.npy  question_indices.npy  question_indptr.npy
+                (CSR question matrix, retrieval models only)
+
+Arrays are loaded with ``mmap_mode='r'`` so every worker process shares the
+same page-cache copy of the weights, and loading does no deserialization.
+Strings are stored as concatenated UTF-8 bytes plus an offsets array, so
+one long answer does not widen every row the way a fixed-width numpy
+string array would.
+
+A version is published by renaming its finished directory into place and
+then atomically replacing the ``current`` symlink.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+from sklearn.naive_bayes import MultinomialNB
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import normalize
+from retrieval import RetrievalIndex
+
+ARTIFACT_FORMAT = 2
+# Format 1 stored strings as fixed-width numpy arrays; still readable
+SUPPORTED_FORMATS = (1, 2)
+MANIFEST_NAME = 'manifest.json'
+CURRENT_LINK = 'current'
+VERSIONS_DIR = 'versions'
+
+# Vectorizer parameters that control tokenization, stored in the manifest
+TOKENIZER_PARAMS = ('lowercase', 'token_pattern', 'ngram_range', 'strip_accents', 'analyzer', 'binary')
+
+
+def pack_strings(values):
+    """
+    Encode strings as one UTF-8 byte array plus offsets
+
+    Args:
+        values (iterable): Strings
+
+    Returns:
+        tuple: (uint8 bytes array, int64 offsets array of len(values) + 1)
+    """
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+    return data, offsets
+
+
+class PackedStrings:
+    """
+    Read-only string sequence over (memory-mapped) pack_strings() arrays
+
+    Strings are decoded on access; indexing with an integer array returns
+    an object array, like indexing a numpy string array.
+    """
+
+    def __init__(self, data, offsets):
+        self._data = data
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def _decode(self, i):
+        return bytes(self._data[self._offsets[i]:self._offsets[i + 1]]).decode('utf-8')
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError(index)
+            return self._decode(index)
+        indices = np.arange(len(self))[index]
+        result = np.empty(len(indices), dtype=object)
+        result[:] = [self._decode(i) for i in indices]
+        return result
+
+    def __iter__(self):
+        return (self._decode(i) for i in range(len(self)))
+
+    def tolist(self):
+        # One copy of the buffer instead of one per string
+        data = bytes(self._data)
+        offsets = self._offsets.tolist()
+        return [data[start:end].decode('utf-8') for start, end in zip(offsets, offsets[1:])]
+
+
+def _string_arrays(arrays, name):
+    # PackedStrings for format 2, the fixed-width array for format 1
+    if f'{name}_bytes' in arrays:
+        return PackedStrings(arrays[f'{name}_bytes'], arrays[f'{name}_offsets'])
+    return arrays.get(name)
+
+
+def pipeline_kind(pipeline):
+    """
+    Get the vectorizer kind of a pipeline or loaded artifact
+
+    Args:
+        pipeline: sklearn Pipeline or ArtifactModel
+
+    Returns:
+        str: 'tfidf', 'hashing' or 'retrieval'
+    """
+    kind = getattr(pipeline, 'kind', None)
+    if kind:
+        return kind
+    return 'hashing' if 'hashing' in pipeline.named_steps else 'tfidf'
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _vectorizer_params(vectorizer):
+    params = vectorizer.get_params()
+    result = {name: params[name] for name in TOKENIZER_PARAMS}
+    result['ngram_range'] = list(result['ngram_range'])
+    return result
+
+
+def current_version_path(root_dir):
+    """
+    Resolve the directory the ``current`` link points to
+
+    Args:
+        root_dir (str): Artifact root directory
+
+    Returns:
+        str: Real path of the current version, or None if nothing is published
+    """
+    link = os.path.join(root_dir, CURRENT_LINK)
+    if not os.path.exists(link):
+        return None
+    return os.path.realpath(link)
+
+
+def read_manifest(version_path):
+    """
+    Read the manifest of a published version
+
+    Args:
+        version_path (str): Version directory
+
+    Returns:
+        dict: Manifest contents
+    """
+    with open(os.path.join(version_path, MANIFEST_NAME)) as f:
+        return json.load(f)
+
+
+def export_artifact(pipeline, root_dir, model_version, metadata=None, keep_versions=3, training_data=None):
+    """
+    Export a fitted pipeline as a new artifact version and publish it
+
+    Args:
+        pipeline: Fitted sklearn Pipeline with a 'tfidf' or 'hashing' step and a 'clf' step,
+            or a fitted RetrievalModel
+        root_dir (str): Artifact root directory
+        model_version (int): Version number recorded in the manifest
+        metadata (dict, optional): Extra manifest fields (e.g. training watermark)
+        keep_versions (int): Number of published versions to keep on disk
+        training_data (tuple, optional): (questions, answers) the model was trained on
+
+    Returns:
+        str: Path of the published version directory
+    """
+    kind = pipeline_kind(pipeline)
+    extra_config = {}
+
+    if kind == 'retrieval':
+        index = pipeline.index
+        question_matrix = index.question_matrix
+        classes = [str(answer) for answer in index.classes_]
+        arrays = {
+            'question_answers': np.asarray(index.question_answers, dtype=np.int32),
+            'question_data': question_matrix.data,
+            'question_indices': question_matrix.indices,
+            'question_indptr': question_matrix.indptr,
+        }
+        extra_config['retrieval'] = {
+            'shape': list(question_matrix.shape),
+            'block_size': pipeline.block_size,
+            'n_jobs': pipeline.n_jobs,
+            'min_score': pipeline.min_score
+        }
+        vectorizer = pipeline.vectorizer
+    else:
+        clf = pipeline.named_steps['clf']
+        classes = [str(answer) for answer in clf.classes_]
+        arrays = {
+            'feature_log_prob': np.ascontiguousarray(clf.feature_log_prob_),
+            'class_log_prior': np.ascontiguousarray(clf.class_log_prior_),
+            'feature_count': np.ascontiguousarray(clf.feature_count_),
+            'class_count': np.ascontiguousarray(clf.class_count_),
+        }
+        vectorizer = pipeline.named_steps['tfidf' if kind == 'tfidf' else 'hashing']
+
+    arrays['classes_bytes'], arrays['classes_offsets'] = pack_strings(classes)
+
+    if training_data is not None:
+        # Answers are stored as indices into classes to avoid a second copy
+        questions, answers = training_data
+        class_index = {answer: i for i, answer in enumerate(classes)}
+        arrays['questions_bytes'], arrays['questions_offsets'] = pack_strings(questions)
+        if 'question_answers' not in arrays:
+            arrays['question_answers'] = np.asarray([class_index[answer] for answer in answers], dtype=np.int32)
+
+    if kind in ('tfidf', 'retrieval'):
+        vocabulary = vectorizer.vocabulary_
+        arrays['vocabulary_bytes'], arrays['vocabulary_offsets'] = pack_strings(sorted(vocabulary, key=vocabulary.get))
+        arrays['idf'] = np.ascontiguousarray(vectorizer.idf_)
+        vectorizer_config = _vectorizer_params(vectorizer)
+        vectorizer_config.update(norm=vectorizer.norm, sublinear_tf=vectorizer.sublinear_tf)
+    else:
+        vectorizer_config = _vectorizer_params(vectorizer)
+        vectorizer_config.update(
+            n_features=vectorizer.n_features,
+            alternate_sign=vectorizer.alternate_sign,
+            norm=vectorizer.norm
+        )
+
+    versions_dir = os.path.join(root_dir, VERSIONS_DIR)
+    os.makedirs(versions_dir, exist_ok=True)
+
+    # Write everything into a private directory first so readers never see
+    # a partially written version
+    tmp_path = os.path.join(versions_dir, f'.tmp-{uuid.uuid4().hex}')
+    os.makedirs(tmp_path)
+    try:
+        files = {}
+        for name, array in arrays.items():
+            file_name = f'{name}.npy'
+            file_path = os.path.join(tmp_path, file_name)
+            np.save(file_path, array, allow_pickle=False)
+            files[name] = {
+                'file': file_name,
+                'sha256': _sha256(file_path),
+                'shape': list(array.shape),
+                'dtype': str(array.dtype)
+            }
+
+        manifest = {
+            'format': ARTIFACT_FORMAT,
+            'model_version': model_version,
+            'kind': kind,
+            'created_at': time.time(),
+            'vectorizer': vectorizer_config,
+            'files': files
+        }
+        manifest.update(extra_config)
+        manifest.update(metadata or {})
+        with open(os.path.join(tmp_path, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        version_name = f'v{model_version:06d}-{int(manifest["created_at"])}-{uuid.uuid4().hex[:6]}'
+        version_path = os.path.join(versions_dir, version_name)
+        os.rename(tmp_path, version_path)
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    # Atomically repoint the current link
+    tmp_link = os.path.join(root_dir, f'.{CURRENT_LINK}-{uuid.uuid4().hex}')
+    os.symlink(os.path.join(VERSIONS_DIR, version_name), tmp_link)
+    os.replace(tmp_link, os.path.join(root_dir, CURRENT_LINK))
+
+    _prune_versions(versions_dir, version_path, keep_versions)
+    logging.info(f"Published model artifact version {model_version} at {version_path}")
+    return version_path
+
+
+def _prune_versions(versions_dir, current_path, keep_versions):
+    """
+    Remove old versions, keeping the newest ones and the current one
+
+    Workers that still have an old version memory-mapped keep working,
+    the pages stay valid until they are unmapped.
+    """
+    names = sorted(
+        (name for name in os.listdir(versions_dir) if not name.startswith('.')),
+        key=lambda name: os.path.getmtime(os.path.join(versions_dir, name)),
+        reverse=True
+    )
+    for name in names[keep_versions:]:
+        path = os.path.join(versions_dir, name)
+        if os.path.realpath(path) != os.path.realpath(current_path):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def load_artifact(root_dir, mmap=True, verify=True):
+    """
+    Load the currently published artifact
+
+    Args:
+        root_dir (str): Artifact root directory
+        mmap (bool): Memory-map the arrays instead of reading them into memory
+        verify (bool): Check file checksums against the manifest
+
+    Returns:
+        ArtifactModel: The loaded model, or None if nothing is published
+    """
+    version_path = current_version_path(root_dir)
+    if version_path is None:
+        return None
+
+    manifest = read_manifest(version_path)
+    if manifest.get('format') not in SUPPORTED_FORMATS:
+        raise ValueError(f"Unsupported model artifact format: {manifest.get('format')}")
+
+    arrays = {}
+    for name, info in manifest['files'].items():
+        file_path = os.path.join(version_path, info['file'])
+        if verify and _sha256(file_path) != info['sha256']:
+            raise ValueError(f"Checksum mismatch for {file_path}")
+        arrays[name] = np.load(file_path, mmap_mode='r' if mmap else None, allow_pickle=False)
+
+    return ArtifactModel(manifest, arrays, version_path)
+
+
+class ArtifactModel:
+    """
+    Prediction-only model backed by (memory-mapped) artifact arrays.
+
+    Exposes the same predict() interface as the sklearn pipeline, computing
+    the TF-IDF transform and NB joint log likelihood (or the retrieval
+    scores) directly from the arrays.
+    """
+
+    def __init__(self, manifest, arrays, path):
+        self.manifest = manifest
+        self.path = path
+        self.kind = manifest['kind']
+        self.model_version = manifest['model_version']
+        self.arrays = arrays
+        self.classes_ = _string_arrays(arrays, 'classes')
+        self.feature_log_prob_ = arrays.get('feature_log_prob')
+        self.class_log_prior_ = arrays.get('class_log_prior')
+        self.index = None
+
+        config = dict(manifest['vectorizer'])
+        tokenizer_params = {name: config[name] for name in TOKENIZER_PARAMS}
+        tokenizer_params['ngram_range'] = tuple(tokenizer_params['ngram_range'])
+
+        if self.kind == 'retrieval':
+            retrieval_config = manifest['retrieval']
+            self.min_score = retrieval_config['min_score']
+            self.index = RetrievalIndex(
+                sp.csr_matrix(
+                    (arrays['question_data'], arrays['question_indices'], arrays['question_indptr']),
+                    shape=tuple(retrieval_config['shape']),
+                    copy=False
+                ),
+                arrays['question_answers'],
+                self.classes_,
+                block_size=retrieval_config['block_size'],
+                n_jobs=retrieval_config['n_jobs']
+            )
+
+        if self.kind in ('tfidf', 'retrieval'):
+            vocabulary = {term: i for i, term in enumerate(_string_arrays(arrays, 'vocabulary').tolist())}
+            self._vectorizer = CountVectorizer(vocabulary=vocabulary, **tokenizer_params)
+            self._idf = sp.diags(np.asarray(arrays['idf']))
+            self._norm = config['norm']
+            self._sublinear_tf = config['sublinear_tf']
+        else:
+            self._vectorizer = HashingVectorizer(
+                n_features=config['n_features'],
+                alternate_sign=config['alternate_sign'],
+                norm=config['norm'],
+                **tokenizer_params
+            )
+
+    def transform(self, texts):
+        """
+        Vectorize texts the same way the exported pipeline did
+
+        Args:
+            texts (list): Preprocessed texts
+
+        Returns:
+            scipy.sparse.csr_matrix: Feature matrix
+        """
+        X = self._vectorizer.transform(texts)
+        if self.kind in ('tfidf', 'retrieval'):
+            X = X.astype(np.float64)
+            if self._sublinear_tf:
+                X.data = np.log(X.data) + 1
+            X = X @ self._idf
+            if self._norm:
+                X = normalize(X, norm=self._norm, copy=False)
+        return sp.csr_matrix(X)
+
+    def joint_log_likelihood(self, X):
+        """
+        Unnormalized class log probabilities for a feature matrix
+        """
+        return np.asarray(X @ self.feature_log_prob_.T) + self.class_log_prior_
+
+    def predict(self, texts):
+        """
+        Predict an answer for each text
+
+        Args:
+            texts (list): Preprocessed texts
+
+        Returns:
+            numpy.ndarray: Predicted answers (None entries for retrieval
+                models where no question is similar enough)
+        """
+        if self.index is not None:
+            return self.index.predict(self.transform(texts), self.min_score)
+        jll = self.joint_log_likelihood(self.transform(texts))
+        return self.classes_[np.argmax(jll, axis=1)]
+
+    def predict_proba(self, texts):
+        """
+        Class probabilities for each text, columns ordered like classes_
+        """
+        return self.proba_from_features(self.transform(texts))
+
+    def proba_from_features(self, X):
+        """
+        Class probabilities for an already vectorized feature matrix
+        """
+        jll = self.joint_log_likelihood(X)
+        jll -= jll.max(axis=1, keepdims=True)
+        proba = np.exp(jll)
+        return proba / proba.sum(axis=1, keepdims=True)
+
+    def training_data(self):
+        """
+        Get the training questions and answers stored with the artifact
+
+        Returns:
+            tuple: (questions, answers) lists, or None if not stored
+        """
+        questions = _string_arrays(self.arrays, 'questions')
+        if questions is None:
+            return None
+        classes = self.classes_.tolist()
+        questions = questions.tolist()
+        answers = [classes[i] for i in self.arrays['question_answers'].tolist()]
+        return questions, answers
+
+    def kneighbors(self, texts, k=5):
+        """
+        Top-k (question indices, scores) per text, retrieval models only
+        """
+        return self.index.kneighbors(self.transform(texts), k)
+
+    def search(self, texts, k=5):
+        """
+        Top-k (answer, score, question index) per text, retrieval models only
+        """
+        return self.index.search(self.transform(texts), k)
+
+    def to_pipeline(self):
+        """
+        Rebuild a trainable sklearn pipeline from a hashing artifact
+
+        The arrays are copied, so the returned pipeline can be updated with
+        partial_fit without touching the shared memory-mapped weights.
+
+        Returns:
+            Pipeline: Hashing vectorizer + MultinomialNB pipeline
+        """
+        if self.kind != 'hashing':
+            raise ValueError("Only hashing artifacts can be turned back into a trainable pipeline")
+
+        clf = MultinomialNB()
+        clf.classes_ = np.array(self.classes_.tolist(), dtype=object)
+        clf.feature_count_ = np.array(self.arrays['feature_count'])
+        clf.class_count_ = np.array(self.arrays['class_count'])
+        clf.feature_log_prob_ = np.array(self.feature_log_prob_)
+        clf.class_log_prior_ = np.array(self.class_log_prior_)
+        clf.n_features_in_ = clf.feature_count_.shape[1]
+
+        return Pipeline([
+            ('hashing', self._vectorizer),
+            ('clf', clf)
+        ])
@@ -1,6 +1,7 @@
 from datetime import datetime
 from app import db
 from flask_login import UserMixin
+from sqlalchemy.dialects import mysql
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -18,7 +19,7 @@ class User(UserMixin, db.Model):
 
 class ChatSession(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     started_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
     
@@ -34,6 +35,15 @@ class Message(db.Model):
     sender_type = db.Column(db.String(20), nullable=False)  # 'user' or 'bot'
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     chat_session_id = db.Column(db.Integer, db.ForeignKey('chat_session.id'), nullable=False)
+    # Generated by the message writer; makes retried inserts idempotent
+    client_id = db.Column(db.String(32), unique=True)
+    
+    # Serve keyset pagination of /history, newest first by (timestamp, id)
+    # with id breaking timestamp ties: across a user's sessions, and within one
+    __table_args__ = (
+        db.Index('ix_message_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_message_session_timestamp_id', 'chat_session_id', 'timestamp', 'id'),
+    )
     
     def __repr__(self):
         return f'<Message {self.id}>'
@@ -48,3 +58,18 @@ class TrainingData(db.Model):
     
     def __repr__(self):
         return f'<TrainingData {self.id}>'
+
+class AnalyticsRollup(db.Model):
+    """
+    Incrementally maintained counters behind /analytics, one row per metric
+    """
+    __tablename__ = 'analytics_rollup'
+    
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+    # JSON payload, e.g. the common queries sketch; MySQL TEXT stops at 64 KB
+    data = db.Column(db.Text().with_variant(mysql.LONGTEXT(), 'mysql'))
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<AnalyticsRollup {self.name}={self.value}>'
@@ -1,34 +1,205 @@
+import os
 import re
 import string
-import nltk
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-from nltk.stem import WordNetLemmatizer
+from functools import lru_cache
+import threading
 import logging
+from intents import classify_text
 
-# Download required NLTK resources
-try:
-    nltk.data.find('tokenizers/punkt')
-    nltk.data.find('corpora/stopwords')
-    nltk.data.find('corpora/wordnet')
-except LookupError:
-    # Downloads with verbose output so we can see any issues
-    nltk.download('punkt')
-    nltk.download('stopwords')
-    nltk.download('wordnet')
-
-# Make sure all needed resources are downloaded
-nltk.download('punkt', quiet=True)
-nltk.download('punkt_tab', quiet=True)  # Download punkt_tab specifically since it's needed
-nltk.download('stopwords', quiet=True)  
-nltk.download('wordnet', quiet=True)
-nltk.download('omw-1.4', quiet=True)  # Open Multilingual WordNet
-
-# Initialize lemmatizer
-lemmatizer = WordNetLemmatizer()
-
-# Get stopwords
-stop_words = set(stopwords.words('english'))
+# NLTK is imported and its corpora are loaded on first use, never at import
+# time. NLTK_DATA_DIR points at vendored corpora (searched first); missing
+# resources are only downloaded when NLTK_AUTO_DOWNLOAD is enabled, so a
+# worker never blocks a request on the network. startup_report.py lists
+# what is missing.
+NLTK_DATA_DIR = os.environ.get('NLTK_DATA_DIR', os.path.join(os.path.dirname(__file__), 'nltk_data'))
+NLTK_AUTO_DOWNLOAD = os.environ.get('NLTK_AUTO_DOWNLOAD', 'false').lower() == 'true'
+
+# (resource path, download package) pairs needed by the pipeline
+NLTK_RESOURCES = {
+    'stopwords': ('corpora/stopwords', 'stopwords'),
+    'wordnet': ('corpora/wordnet', 'wordnet'),
+    'omw': ('corpora/omw-1.4', 'omw-1.4'),  # Open Multilingual WordNet
+    'punkt': ('tokenizers/punkt', 'punkt'),
+    'punkt_tab': ('tokenizers/punkt_tab', 'punkt_tab')
+}
+
+_nltk_lock = threading.RLock()
+_checked_resources = set()
+_lemmatizer = None
+_stop_words = None
+
+def get_nltk():
+    """
+    Import NLTK and register the vendored data directory
+    
+    Returns:
+        module: The nltk module
+    """
+    import nltk
+    
+    with _nltk_lock:
+        if os.path.isdir(NLTK_DATA_DIR) and NLTK_DATA_DIR not in nltk.data.path:
+            nltk.data.path.insert(0, NLTK_DATA_DIR)
+    return nltk
+
+def ensure_nltk_resource(name):
+    """
+    Make sure an NLTK resource is available, downloading it only if allowed
+    
+    Args:
+        name (str): Key in NLTK_RESOURCES
+        
+    Returns:
+        bool: True if the resource can be loaded
+    """
+    if name in _checked_resources:
+        return True
+    
+    nltk = get_nltk()
+    resource_path, package = NLTK_RESOURCES[name]
+    with _nltk_lock:
+        if name in _checked_resources:
+            return True
+        try:
+            nltk.data.find(resource_path)
+        except LookupError:
+            if not NLTK_AUTO_DOWNLOAD:
+                logging.error(f"NLTK resource '{package}' not found and NLTK_AUTO_DOWNLOAD is disabled")
+                return False
+            
+            # Download into the vendored directory so later starts are offline
+            logging.info(f"Downloading NLTK resource '{package}'")
+            os.makedirs(NLTK_DATA_DIR, exist_ok=True)
+            if not nltk.download(package, download_dir=NLTK_DATA_DIR, quiet=True):
+                logging.error(f"Could not download NLTK resource '{package}'")
+                return False
+            if NLTK_DATA_DIR not in nltk.data.path:
+                nltk.data.path.insert(0, NLTK_DATA_DIR)
+        _checked_resources.add(name)
+        return True
+
+def missing_nltk_resources():
+    """
+    Find the NLTK resources that are neither vendored nor installed
+
+    Never downloads anything.
+
+    Returns:
+        list: Download package names of the missing resources
+    """
+    nltk = get_nltk()
+    missing = []
+    for resource_path, package in NLTK_RESOURCES.values():
+        try:
+            nltk.data.find(resource_path)
+        except LookupError:
+            missing.append(package)
+    return missing
+
+def get_stop_words():
+    """
+    Get the English stopword set, loading it on first use
+    
+    Returns:
+        set: Stopwords
+    """
+    global _stop_words
+    
+    if _stop_words is None:
+        with _nltk_lock:
+            if _stop_words is None:
+                ensure_nltk_resource('stopwords')
+                from nltk.corpus import stopwords
+                _stop_words = set(stopwords.words('english'))
+    return _stop_words
+
+def get_lemmatizer():
+    """
+    Get the WordNet lemmatizer, loading WordNet on first use
+    
+    Returns:
+        WordNetLemmatizer: Shared lemmatizer
+    """
+    global _lemmatizer
+    
+    if _lemmatizer is None:
+        with _nltk_lock:
+            if _lemmatizer is None:
+                ensure_nltk_resource('wordnet')
+                ensure_nltk_resource('omw')
+                from nltk.stem import WordNetLemmatizer
+                _lemmatizer = WordNetLemmatizer()
+    return _lemmatizer
+
+def __getattr__(name):
+    # Keep the former module-level stop_words / lemmatizer working, lazily
+    if name == 'stop_words':
+        return get_stop_words()
+    if name == 'lemmatizer':
+        return get_lemmatizer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def word_tokenize(text):
+    """
+    NLTK word_tokenize with its Punkt models loaded on first use
+    """
+    ensure_nltk_resource('punkt')
+    ensure_nltk_resource('punkt_tab')
+    from nltk.tokenize import word_tokenize as nltk_word_tokenize
+    return nltk_word_tokenize(text)
+
+# Precompiled cleanup steps shared by every preprocess_text call
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+DIGITS_RE = re.compile(r'\d+')
+
+# Words the Treebank tokenizer splits (e.g. "cannot" -> "can not"); texts
+# containing them, or any non-ASCII character, go through word_tokenize so
+# the fast path produces exactly the same tokens
+TREEBANK_SPLIT_WORDS = re.compile(r'\b(?:cannot|gimme|gonna|gotta|lemme|wanna)\b')
+
+# Size of the lemma memo cache; the vocabulary is small and Zipfian
+LEMMA_CACHE_SIZE = int(os.environ.get('LEMMA_CACHE_SIZE', '50000'))
+
+# Batches smaller than this are preprocessed in-process
+PREPROCESS_POOL_MIN_BATCH = int(os.environ.get('PREPROCESS_POOL_MIN_BATCH', '5000'))
+
+@lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def lemmatize_word(word):
+    """
+    Lemmatize a single word, memoized
+    
+    Args:
+        word (str): Lowercase token
+        
+    Returns:
+        str: Lemma, or the word itself if lemmatization fails
+    """
+    try:
+        return get_lemmatizer().lemmatize(word)
+    except Exception as lemma_error:
+        logging.error(f"Lemmatization error for word '{word}': {lemma_error}")
+        return word  # Use original word if lemmatization fails
+
+def tokenize(text):
+    """
+    Tokenize cleaned text, using a plain whitespace split when it is
+    guaranteed to give the same tokens as NLTK's word_tokenize
+    
+    Args:
+        text (str): Lowercase text without punctuation or digits
+        
+    Returns:
+        list: Tokens
+    """
+    if text.isascii() and not TREEBANK_SPLIT_WORDS.search(text):
+        return text.split()
+    
+    # Simple tokenization fallback in case NLTK tokenizer fails
+    try:
+        return word_tokenize(text)
+    except Exception as token_error:
+        logging.error(f"Tokenization error: {token_error}. Using simple split fallback.")
+        return text.split()
 
 def preprocess_text(text):
     """
@@ -50,32 +221,16 @@ def preprocess_text(text):
         return ""
         
     try:
-        # Convert to lowercase
-        text = text.lower()
-        
-        # Remove punctuation
-        text = text.translate(str.maketrans('', '', string.punctuation))
-        
-        # Remove numbers
-        text = re.sub(r'\d+', '', text)
+        # Convert to lowercase, remove punctuation and numbers
+        text = DIGITS_RE.sub('', text.lower().translate(PUNCTUATION_TABLE))
         
-        # Simple tokenization fallback in case NLTK tokenizer fails
-        try:
-            tokens = word_tokenize(text)
-        except Exception as token_error:
-            logging.error(f"Tokenization error: {token_error}. Using simple split fallback.")
-            tokens = text.split()
-        
-        # Remove stopwords and lemmatize with safeguards
-        filtered_tokens = []
-        for word in tokens:
-            if word and word not in stop_words:
-                try:
-                    lemmatized = lemmatizer.lemmatize(word)
-                    filtered_tokens.append(lemmatized)
-                except Exception as lemma_error:
-                    logging.error(f"Lemmatization error for word '{word}': {lemma_error}")
-                    filtered_tokens.append(word)  # Use original word if lemmatization fails
+        # Tokenize, remove stopwords and lemmatize
+        stop_words = get_stop_words()
+        filtered_tokens = [
+            lemmatize_word(word)
+            for word in tokenize(text)
+            if word and word not in stop_words
+        ]
         
         # Join the tokens back into a string
         preprocessed_text = ' '.join(filtered_tokens)
@@ -89,6 +244,29 @@ def preprocess_text(text):
         logging.error(f"Error preprocessing text: {e}")
         return text  # Return original text if preprocessing fails
 
+def preprocess_batch(texts, processes=None, chunksize=1000):
+    """
+    Preprocess many texts, using a process pool for corpus-sized batches
+    
+    Args:
+        texts (list): Input texts
+        processes (int, optional): Worker processes, defaults to the CPU count
+        chunksize (int): Texts sent to a worker at a time
+        
+    Returns:
+        list: Preprocessed text for each input
+    """
+    if len(texts) < PREPROCESS_POOL_MIN_BATCH or processes == 1:
+        return [preprocess_text(text) for text in texts]
+    
+    try:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            return list(pool.map(preprocess_text, texts, chunksize=chunksize))
+    except Exception as e:
+        logging.error(f"Error preprocessing in process pool, running in-process: {e}")
+        return [preprocess_text(text) for text in texts]
+
 def extract_entities(text):
     """
     Extract entities from the text that might be useful for the chatbot
@@ -101,19 +279,10 @@ def extract_entities(text):
     """
     entities = {}
     
-    # Extract greeting patterns
-    greeting_patterns = ['hello', 'hi', 'hey', 'greetings', 'good morning', 'good afternoon', 'good evening']
-    if any(greeting in text.lower() for greeting in greeting_patterns):
-        entities['is_greeting'] = True
-    
-    # Extract question patterns
-    question_patterns = ['what', 'who', 'where', 'when', 'why', 'how', '?']
-    if any(question in text.lower() for question in question_patterns):
-        entities['is_question'] = True
-    
-    # Extract farewell patterns
-    farewell_patterns = ['bye', 'goodbye', 'see you', 'talk later', 'have a good day']
-    if any(farewell in text.lower() for farewell in farewell_patterns):
-        entities['is_farewell'] = True
+    # Greeting, question and farewell patterns are matched in one pass
+    intents = classify_text(text)
+    for intent in ('greeting', 'question', 'farewell'):
+        if intent in intents:
+            entities[f'is_{intent}'] = True
     
     return entities
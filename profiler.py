@@ -0,0 +1,331 @@
+"""
+On-demand sampled profiling of chat requests
+
+An admin switches capture on for a while; a share of /chat requests then
+run under cProfile and their stats are merged into one pstats profile.
+tracemalloc can be switched on alongside to find where memory grows. While
+capture is off, a wrapped call costs a single flag check.
+
+Only one request is profiled at a time: cProfile cannot profile several
+threads at once on newer Pythons, and it keeps the overhead bounded.
+
+Output:
+    pstats_bytes()      marshalled pstats, for pstats/snakeviz/flameprof
+    folded_stacks()     collapsed stacks for flamegraph.pl / speedscope
+    top_functions()     aggregated top functions
+    allocation_sites()  top allocation growth since capture started
+"""
+import os
+import io
+import time
+import random
+import logging
+import marshal
+import pstats
+import cProfile
+import threading
+import tracemalloc
+
+# Upper bounds for an admin request, so a forgotten switch turns itself off
+PROFILING_MAX_SECONDS = float(os.environ.get('PROFILING_MAX_SECONDS', '900'))
+PROFILING_TRACEMALLOC_FRAMES = int(os.environ.get('PROFILING_TRACEMALLOC_FRAMES', '10'))
+
+_lock = threading.Lock()
+_busy = threading.Lock()
+
+# Read without the lock on the request path
+_enabled = False
+_sample_rate = 0.0
+_expires_at = 0.0
+
+_stats = None
+_profiled = 0
+_skipped_busy = 0
+_started_at = None
+_tracing = False
+_baseline = None
+_allocation_report = []
+
+
+def enable(sample_rate=0.01, duration_seconds=300, trace_allocations=False):
+    """
+    Start sampled capture, replacing any earlier results
+
+    Args:
+        sample_rate (float): Share of requests profiled, 0 to 1
+        duration_seconds (float): Capture switches off after this, capped at PROFILING_MAX_SECONDS
+        trace_allocations (bool): Also trace allocations with tracemalloc (process-wide)
+
+    Returns:
+        dict: Status after enabling
+    """
+    global _enabled, _sample_rate, _expires_at, _stats, _profiled, _skipped_busy
+    global _started_at, _tracing, _baseline, _allocation_report
+
+    with _lock:
+        _stop_tracing()
+        _stats = None
+        _profiled = 0
+        _skipped_busy = 0
+        _allocation_report = []
+        _started_at = time.time()
+        if trace_allocations:
+            tracemalloc.start(PROFILING_TRACEMALLOC_FRAMES)
+            _tracing = True
+            _baseline = tracemalloc.take_snapshot()
+        _sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+        _expires_at = time.monotonic() + min(float(duration_seconds), PROFILING_MAX_SECONDS)
+        _enabled = True
+    logging.warning(
+        f"Request profiling enabled: sample rate {_sample_rate}, "
+        f"allocations {'on' if trace_allocations else 'off'}"
+    )
+    return status()
+
+
+def disable():
+    """
+    Stop capture; collected results stay available for download
+
+    Returns:
+        dict: Status after disabling
+    """
+    global _enabled
+
+    with _lock:
+        was_enabled = _enabled
+        _enabled = False
+        _stop_tracing()
+    if was_enabled:
+        logging.warning(f"Request profiling disabled after {_profiled} profiled requests")
+    return status()
+
+
+def _stop_tracing():
+    # Called with _lock held: keep the final allocation report, then stop
+    global _tracing, _baseline, _allocation_report
+
+    if _tracing:
+        _allocation_report = _allocation_growth()
+        tracemalloc.stop()
+        _tracing = False
+        _baseline = None
+
+
+def _allocation_growth(limit=50):
+    # Leave out the profiler's own bookkeeping
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, pstats.__file__),
+        tracemalloc.Filter(False, cProfile.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ))
+    return [
+        {
+            'site': str(diff.traceback[0]) if diff.traceback else '?',
+            'size_diff_bytes': diff.size_diff,
+            'size_bytes': diff.size,
+            'count_diff': diff.count_diff,
+            'count': diff.count
+        }
+        for diff in snapshot.compare_to(_baseline, 'lineno')[:limit]
+    ]
+
+
+def call(fn, *args, **kwargs):
+    """
+    Run fn, under the profiler for the sampled share of calls while enabled
+
+    Returns:
+        Whatever fn returns
+    """
+    if not _enabled:
+        return fn(*args, **kwargs)
+    if time.monotonic() > _expires_at:
+        disable()
+        return fn(*args, **kwargs)
+    if random.random() >= _sample_rate:
+        return fn(*args, **kwargs)
+    if not _busy.acquire(blocking=False):
+        _count_busy()
+        return fn(*args, **kwargs)
+
+    try:
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Another profiler (e.g. a debugger) is active in this process
+            logging.warning(f"Could not start request profiler: {e}")
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profile.disable()
+            _add(profile)
+    finally:
+        _busy.release()
+
+
+def _count_busy():
+    global _skipped_busy
+    with _lock:
+        _skipped_busy += 1
+
+
+def _add(profile):
+    global _stats, _profiled
+    try:
+        with _lock:
+            if _stats is None:
+                _stats = pstats.Stats(profile, stream=io.StringIO())
+            else:
+                _stats.add(profile)
+            _profiled += 1
+    except Exception as e:
+        logging.error(f"Error aggregating request profile: {e}")
+
+
+def status():
+    """
+    Get the capture settings and counters
+
+    Returns:
+        dict: Enabled flag, sample rate, seconds left, profiled/skipped
+            requests and whether allocations are traced
+    """
+    with _lock:
+        return {
+            'enabled': _enabled,
+            'sample_rate': _sample_rate,
+            'seconds_left': max(_expires_at - time.monotonic(), 0.0) if _enabled else 0.0,
+            'started_at': _started_at,
+            'profiled_requests': _profiled,
+            'skipped_busy': _skipped_busy,
+            'tracing_allocations': _tracing
+        }
+
+
+def top_functions(limit=30, sort='cumulative'):
+    """
+    Get the most expensive functions over all profiled requests
+
+    Args:
+        limit (int): Number of functions
+        sort (str): 'cumulative', 'tottime' or 'calls'
+
+    Returns:
+        list: Dicts with function, calls, total_s (own time) and cumulative_s
+    """
+    key = {'cumulative': 3, 'tottime': 2, 'calls': 1}.get(sort, 3)
+    with _lock:
+        if _stats is None:
+            return []
+        entries = list(_stats.stats.items())
+    entries.sort(key=lambda entry: entry[1][key], reverse=True)
+    return [
+        {
+            'function': pstats.func_std_string(func),
+            'calls': calls,
+            'total_s': round(total, 6),
+            'cumulative_s': round(cumulative, 6)
+        }
+        for func, (_, calls, total, cumulative, _) in entries[:limit]
+    ]
+
+
+def pstats_bytes():
+    """
+    Get the aggregated profile in the pstats file format
+
+    Returns:
+        bytes: Loadable with pstats.Stats(path) after saving, or None if
+            nothing was profiled yet
+    """
+    with _lock:
+        if _stats is None:
+            return None
+        # Same format as Stats.dump_stats()
+        return marshal.dumps(_stats.stats)
+
+
+def folded_stacks(max_depth=64):
+    """
+    Get the aggregated profile as collapsed stacks ("a;b;c microseconds")
+
+    cProfile keeps caller/callee pairs rather than whole stacks, so stacks
+    are rebuilt from the roots down and each function's own time is split
+    across its callers in proportion to their share of its cumulative time.
+
+    Args:
+        max_depth (int): Deepest stack emitted
+
+    Returns:
+        str: One stack per line, for flamegraph.pl or speedscope
+    """
+    with _lock:
+        if _stats is None:
+            return ''
+        stats = dict(_stats.stats)
+
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    def name(func):
+        filename, line, function = func
+        return f"{function} ({os.path.basename(filename)}:{line})" if line else function
+
+    lines = {}
+
+    def walk(func, path, weight, on_path):
+        _, _, total, cumulative, _ = stats[func]
+        stack = path + [name(func)]
+        own_us = int(total * weight * 1e6)
+        if own_us > 0:
+            key = ';'.join(stack)
+            lines[key] = lines.get(key, 0) + own_us
+        if len(stack) >= max_depth:
+            return
+        for callee, edge_cumulative in callees.get(func, ()):
+            if callee in on_path or callee not in stats:
+                continue
+            callee_cumulative = stats[callee][3]
+            share = edge_cumulative / callee_cumulative if callee_cumulative else 0.0
+            # Paths worth less than a microsecond are dropped, which also
+            # keeps the walk small on wide call graphs
+            if callee_cumulative * share * weight < 1e-6:
+                continue
+            on_path.add(callee)
+            walk(callee, stack, weight * share, on_path)
+            on_path.discard(callee)
+
+    roots = [func for func, (_, _, _, _, callers) in stats.items() if not callers]
+    for root in roots:
+        walk(root, [], 1.0, {root})
+
+    return ''.join(f"{stack} {us}\n" for stack, us in sorted(lines.items()))
+
+
+def allocation_sites(limit=30):
+    """
+    Get the source lines whose allocations grew most since capture started
+
+    Returns:
+        list: Dicts with site, size_diff_bytes, size_bytes, count_diff and
+            count; the live comparison while tracing, else the last report
+    """
+    with _lock:
+        tracing = _tracing
+        report = _allocation_report
+    if tracing:
+        try:
+            return _allocation_growth(limit)
+        except Exception as e:
+            # Tracing was stopped in the meantime
+            logging.warning(f"Could not compare allocations: {e}")
+            with _lock:
+                report = _allocation_report
+    return report[:limit]
@@ -0,0 +1,99 @@
+"""
+Bounded in-memory response cache for the chatbot
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU cache with a per-entry time-to-live.
+
+    Keys are expected to include the model version so that entries created
+    by an older model are never served after a retrain.
+    """
+
+    def __init__(self, max_size=1024, ttl=300):
+        """
+        Args:
+            max_size (int): Maximum number of entries kept before evicting
+            ttl (float): Seconds an entry stays valid, 0 disables expiry
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Look up a cached value
+
+        Args:
+            key (hashable): Cache key
+
+        Returns:
+            The cached value or None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if expires_at and expires_at < time.monotonic():
+                # Expired entries count as misses and are dropped eagerly
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """
+        Store a value, evicting the least recently used entry if full
+
+        Args:
+            key (hashable): Cache key
+            value: Value to cache
+        """
+        if self.max_size <= 0:
+            return
+
+        expires_at = time.monotonic() + self.ttl if self.ttl else 0
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Remove all entries while keeping the counters
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Get cache counters
+
+        Returns:
+            dict: Size, capacity and hit/miss/eviction counters
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
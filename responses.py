@@ -1,5 +1,6 @@
 import random
 import logging
+from intents import classify_text
 
 # Default fallback responses when the ML model cannot generate a good response
 FALLBACK_RESPONSES = [
@@ -87,8 +88,7 @@ def is_greeting(text):
     Returns:
         bool: True if the text is a greeting, False otherwise
     """
-    greetings = ['hello', 'hi', 'hey', 'greetings', 'good morning', 'good afternoon', 'good evening']
-    return any(greeting in text.lower() for greeting in greetings)
+    return 'greeting' in classify_text(text)
 
 def is_farewell(text):
     """
@@ -100,8 +100,7 @@ def is_farewell(text):
     Returns:
         bool: True if the text is a farewell, False otherwise
     """
-    farewells = ['bye', 'goodbye', 'see you', 'talk later', 'have a good day']
-    return any(farewell in text.lower() for farewell in farewells)
+    return 'farewell' in classify_text(text)
 
 def is_thankful(text):
     """
@@ -113,8 +112,7 @@ def is_thankful(text):
     Returns:
         bool: True if the text expresses gratitude, False otherwise
     """
-    gratitude = ['thank you', 'thanks', 'appreciate it', 'grateful']
-    return any(phrase in text.lower() for phrase in gratitude)
+    return 'thankful' in classify_text(text)
 
 def get_response_based_on_type(text):
     """
@@ -127,12 +125,13 @@ def get_response_based_on_type(text):
         str: A response based on the type of input
     """
     try:
-        # Check the type of input
-        if is_greeting(text):
+        # Classify all intents in one pass, then check them in priority order
+        intents = classify_text(text)
+        if 'greeting' in intents:
             return get_greeting_response()
-        elif is_farewell(text):
+        elif 'farewell' in intents:
             return get_farewell_response()
-        elif is_thankful(text):
+        elif 'thankful' in intents:
             return get_thankful_response()
         else:
             # Return None to indicate no specific response type was detected
@@ -0,0 +1,236 @@
+"""
+Top-k cosine retrieval over the TF-IDF matrix of training questions
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+# Block-scoring pools shared by every index and query, one per thread count;
+# starting threads per query would cost more than scoring small blocks
+_block_pools = {}
+_block_pools_lock = threading.Lock()
+
+
+def get_block_pool(n_jobs):
+    """
+    Get the shared pool that scores blocks with n_jobs threads
+
+    Args:
+        n_jobs (int): Threads in the pool
+
+    Returns:
+        ThreadPoolExecutor: Pool created on first use and kept for the process
+    """
+    with _block_pools_lock:
+        pool = _block_pools.get(n_jobs)
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=n_jobs, thread_name_prefix='retrieval')
+            _block_pools[n_jobs] = pool
+    return pool
+
+
+class RetrievalIndex:
+    """
+    Nearest-question lookup over an L2-normalized question matrix.
+
+    Scores are cosine similarities computed with one sparse product of the
+    question matrix and the (transposed) query matrix. For large corpora the
+    question rows can be split into blocks that are scored separately, which
+    bounds the size of the intermediate score matrix and lets the blocks run
+    on a thread pool.
+    """
+
+    def __init__(self, question_matrix, question_answers, classes, block_size=0, n_jobs=1):
+        """
+        Args:
+            question_matrix (scipy.sparse.csr_matrix): L2-normalized questions x features
+            question_answers (numpy.ndarray): Index into classes for each question
+            classes (numpy.ndarray): Distinct answers
+            block_size (int): Questions per block, 0 scores all questions at once
+            n_jobs (int): Threads used to score blocks
+        """
+        self.question_matrix = question_matrix
+        self.question_answers = question_answers
+        self.classes_ = classes
+        self.block_size = block_size
+        self.n_jobs = n_jobs
+
+    def __len__(self):
+        return self.question_matrix.shape[0]
+
+    def _blocks(self):
+        """
+        Row blocks of the question matrix, sliced without copying data
+        """
+        n_questions = self.question_matrix.shape[0]
+        if not self.block_size or self.block_size >= n_questions:
+            return [(0, self.question_matrix)]
+
+        Q = self.question_matrix
+        blocks = []
+        for start in range(0, n_questions, self.block_size):
+            end = min(start + self.block_size, n_questions)
+            a, b = Q.indptr[start], Q.indptr[end]
+            block = sp.csr_matrix(
+                (Q.data[a:b], Q.indices[a:b], Q.indptr[start:end + 1] - a),
+                shape=(end - start, Q.shape[1])
+            )
+            blocks.append((start, block))
+        return blocks
+
+    @staticmethod
+    def _top_k(block, XT, offset, k):
+        """
+        Score one block and keep the k best questions per query
+        """
+        # (questions x queries), one column per query
+        scores = (block @ XT).tocsc()
+        results = []
+        for j in range(scores.shape[1]):
+            a, b = scores.indptr[j], scores.indptr[j + 1]
+            rows = scores.indices[a:b]
+            values = scores.data[a:b]
+            if len(values) > k:
+                keep = np.argpartition(-values, k)[:k]
+                rows, values = rows[keep], values[keep]
+            order = np.argsort(-values, kind='stable')
+            results.append((rows[order] + offset, values[order]))
+        return results
+
+    def kneighbors(self, X, k=5):
+        """
+        Find the k most similar questions for each query row
+
+        Args:
+            X (scipy.sparse matrix): L2-normalized query vectors
+            k (int): Number of neighbors
+
+        Returns:
+            list: (question indices, cosine scores) per query, best first.
+                Questions sharing no features with the query are left out.
+        """
+        XT = sp.csr_matrix(X).T.tocsr()
+        blocks = self._blocks()
+
+        if len(blocks) == 1:
+            return self._top_k(blocks[0][1], XT, 0, k)
+
+        if self.n_jobs > 1:
+            pool = get_block_pool(self.n_jobs)
+            block_results = list(pool.map(lambda item: self._top_k(item[1], XT, item[0], k), blocks))
+        else:
+            block_results = [self._top_k(block, XT, offset, k) for offset, block in blocks]
+
+        # Merge the per-block candidates of each query
+        merged = []
+        for j in range(XT.shape[1]):
+            rows = np.concatenate([result[j][0] for result in block_results])
+            values = np.concatenate([result[j][1] for result in block_results])
+            order = np.argsort(-values, kind='stable')[:k]
+            merged.append((rows[order], values[order]))
+        return merged
+
+    def search(self, X, k=5):
+        """
+        Top-k answers with scores for each query row
+
+        Args:
+            X (scipy.sparse matrix): L2-normalized query vectors
+            k (int): Number of neighbors
+
+        Returns:
+            list: For each query a list of (answer, score, question index)
+        """
+        return [
+            [(self.classes_[self.question_answers[i]], float(score), int(i)) for i, score in zip(rows, values)]
+            for rows, values in self.kneighbors(X, k)
+        ]
+
+    def predict(self, X, min_score=0.0):
+        """
+        Answer of the nearest question for each query row
+
+        Args:
+            X (scipy.sparse matrix): L2-normalized query vectors
+            min_score (float): Similarity the nearest question must exceed
+
+        Returns:
+            list: Answer per query, None where no question is similar enough
+        """
+        predictions = []
+        for rows, values in self.kneighbors(X, k=1):
+            if len(rows) and values[0] > min_score:
+                predictions.append(self.classes_[self.question_answers[rows[0]]])
+            else:
+                predictions.append(None)
+        return predictions
+
+
+class RetrievalModel:
+    """
+    Trainable retrieval backend with the same fit/predict interface as the
+    TF-IDF + MultinomialNB pipeline.
+    """
+
+    kind = 'retrieval'
+
+    def __init__(self, block_size=0, n_jobs=1, min_score=0.0):
+        """
+        Args:
+            block_size (int): Questions per scoring block, 0 disables blocking
+            n_jobs (int): Threads used to score blocks
+            min_score (float): Similarity a prediction must exceed
+        """
+        self.vectorizer = TfidfVectorizer()
+        self.block_size = block_size
+        self.n_jobs = n_jobs
+        self.min_score = min_score
+        self.index = None
+        self.classes_ = None
+
+    def fit(self, questions, answers):
+        """
+        Index the training questions
+
+        Args:
+            questions (list): Training questions
+            answers (list): Answer for each question
+
+        Returns:
+            RetrievalModel: self
+        """
+        # TfidfVectorizer L2-normalizes rows, so dot products are cosines
+        question_matrix = self.vectorizer.fit_transform(questions).tocsr()
+        classes, question_answers = np.unique(np.asarray(answers, dtype=str), return_inverse=True)
+        self.classes_ = classes
+        self.index = RetrievalIndex(
+            question_matrix,
+            question_answers.astype(np.int32),
+            classes,
+            block_size=self.block_size,
+            n_jobs=self.n_jobs
+        )
+        return self
+
+    def transform(self, texts):
+        return self.vectorizer.transform(texts)
+
+    def kneighbors(self, texts, k=5):
+        return self.index.kneighbors(self.transform(texts), k)
+
+    def search(self, texts, k=5):
+        return self.index.search(self.transform(texts), k)
+
+    def predict(self, texts):
+        """
+        Predict the answer of the nearest training question
+
+        Args:
+            texts (list): Preprocessed texts
+
+        Returns:
+            list: Answer per text, None where nothing is similar enough
+        """
+        return self.index.predict(self.transform(texts), self.min_score)
@@ -0,0 +1,198 @@
+"""
+Per-session conversation context for Gemini prompts
+
+Recent turns of each ChatSession are kept in an in-memory ring buffer, so
+multi-turn prompts need no Message query per turn. Idle sessions are evicted
+least recently used first; a session that is not in memory is loaded once
+from the caller's loader (e.g. the last Message rows) and then kept current
+with record_turn.
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+
+# Turns kept per session, sessions kept in memory and idle time before eviction
+SESSION_CONTEXT_TURNS = int(os.environ.get('SESSION_CONTEXT_TURNS', '20'))
+SESSION_CONTEXT_MAX_SESSIONS = int(os.environ.get('SESSION_CONTEXT_MAX_SESSIONS', '10000'))
+SESSION_CONTEXT_IDLE_TTL = float(os.environ.get('SESSION_CONTEXT_IDLE_TTL', '1800'))
+
+# Token budget for the history part of a Gemini prompt
+GEMINI_CONTEXT_TOKENS = int(os.environ.get('GEMINI_CONTEXT_TOKENS', '1000'))
+
+# Rough characters per token for English text, used to stay within budget
+# without a token-counting API call
+CHARS_PER_TOKEN = 4
+
+ROLE_LABELS = {'user': 'User', 'bot': 'Assistant'}
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of model tokens in a text
+
+    Args:
+        text (str): Any text
+
+    Returns:
+        int: Estimated token count
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def normalize_turn(turn):
+    """
+    Convert a history entry to a (sender_type, content) pair
+
+    Accepts (sender_type, content) tuples, dicts shaped like the /history
+    JSON ({'sender_type', 'content'}) and Message rows.
+    """
+    if isinstance(turn, (tuple, list)):
+        return turn[0], turn[1]
+    if isinstance(turn, dict):
+        return turn.get('sender_type', 'user'), turn.get('content', '')
+    return turn.sender_type, turn.content
+
+
+def build_context(chat_history, token_budget=GEMINI_CONTEXT_TOKENS):
+    """
+    Build the conversation transcript for a prompt within a token budget
+
+    The newest turns are kept first; a turn that does not fit ends the
+    transcript, except the newest one, which is cut to the budget.
+
+    Args:
+        chat_history (list): Turns, oldest first
+        token_budget (int): Maximum estimated tokens for the transcript
+
+    Returns:
+        str: "User: ...\\nAssistant: ..." lines, oldest first, or '' if empty
+    """
+    lines = []
+    remaining = token_budget
+    for turn in reversed(chat_history or []):
+        sender_type, content = normalize_turn(turn)
+        line = f"{ROLE_LABELS.get(sender_type, 'User')}: {' '.join(str(content).split())}"
+        cost = estimate_tokens(line) + 1
+        if cost > remaining:
+            if not lines and remaining > 1:
+                lines.append(line[:(remaining - 1) * CHARS_PER_TOKEN])
+            break
+        lines.append(line)
+        remaining -= cost
+    return '\n'.join(reversed(lines))
+
+
+class SessionContextStore:
+    """
+    LRU map of session id -> ring buffer of recent (sender_type, content) turns
+    """
+
+    def __init__(self, max_turns=SESSION_CONTEXT_TURNS, max_sessions=SESSION_CONTEXT_MAX_SESSIONS,
+                 idle_ttl=SESSION_CONTEXT_IDLE_TTL):
+        """
+        Args:
+            max_turns (int): Turns kept per session
+            max_sessions (int): Sessions kept before the least recently used is evicted
+            idle_ttl (float): Seconds without activity before a session is evicted
+        """
+        self.max_turns = max_turns
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict()  # session_id -> (turns deque, last used)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'loads': 0, 'evictions': 0}
+
+    def _evict(self, now):
+        # Called with the lock held; the oldest entries are at the front
+        while self._sessions:
+            session_id, (_, last_used) = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - last_used <= self.idle_ttl:
+                break
+            del self._sessions[session_id]
+            self._stats['evictions'] += 1
+
+    def get_history(self, session_id, loader=None):
+        """
+        Get the recent turns of a session
+
+        Args:
+            session_id: ChatSession id
+            loader (callable, optional): Returns the session's recent turns,
+                oldest first; called only when the session is not in memory
+
+        Returns:
+            list: (sender_type, content) turns, oldest first
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                self._sessions[session_id] = (entry[0], now)
+                self._sessions.move_to_end(session_id)
+                self._stats['hits'] += 1
+                return list(entry[0])
+
+        if loader is None:
+            return []
+
+        # Load outside the lock so a slow query does not block other sessions
+        try:
+            turns = [normalize_turn(turn) for turn in loader()]
+        except Exception as e:
+            logging.error(f"Error loading chat history for session {session_id}: {e}")
+            return []
+
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = (deque(turns, maxlen=self.max_turns), now)
+                self._stats['loads'] += 1
+            self._sessions[session_id] = (entry[0], now)
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+            return list(entry[0])
+
+    def record_turn(self, session_id, sender_type, content):
+        """
+        Append a turn to a session's ring buffer
+
+        Args:
+            session_id: ChatSession id
+            sender_type (str): 'user' or 'bot'
+            content (str): Message text
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            turns = entry[0] if entry is not None else deque(maxlen=self.max_turns)
+            turns.append((sender_type, content))
+            self._sessions[session_id] = (turns, now)
+            self._sessions.move_to_end(session_id)
+            self._evict(now)
+
+    def drop(self, session_id):
+        """
+        Forget a session, e.g. when it is closed
+        """
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self):
+        """
+        Get store counters
+
+        Returns:
+            dict: Sessions in memory, hits, loads from the loader and evictions
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['sessions'] = len(self._sessions)
+        stats['max_sessions'] = self.max_sessions
+        stats['max_turns'] = self.max_turns
+        return stats
+
+
+# Process-wide store used by the chat routes
+session_store = SessionContextStore()
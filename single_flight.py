@@ -0,0 +1,229 @@
+"""
+Single-flight coalescing: concurrent calls with the same key share one execution
+"""
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+
+class _StreamFlight:
+    """
+    Chunks of an in-flight stream, kept for the followers replaying it
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks = []
+        self.followers = 0
+        self.done = False
+        self.result = None
+        self.error = None
+
+    def publish(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+
+class SingleFlight:
+    """
+    Runs a function once per key at a time
+
+    The first caller for a key runs the function; callers that arrive while
+    it is in flight wait for the same result instead of starting their own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._streams = {}
+        self._stats = {'leaders': 0, 'followers': 0}
+
+    def do(self, key, fn, *args, timeout=None, **kwargs):
+        """
+        Run fn(*args, **kwargs) unless a call for the same key is in flight
+
+        Args:
+            key: Hashable key identifying identical calls
+            fn (callable): Function to run
+            timeout (float, optional): Seconds a follower waits for the leader
+
+        Returns:
+            tuple: (result, shared) where shared is True if the result came
+                from another caller's execution
+
+        Raises:
+            concurrent.futures.TimeoutError: If a follower's wait exceeds the timeout
+            Exception: Whatever fn raised, for the leader and its followers
+        """
+        with self._lock:
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._flights[key] = future
+                self._stats['leaders'] += 1
+            else:
+                self._stats['followers'] += 1
+
+        if not leader:
+            return future.result(timeout=timeout), True
+
+        try:
+            result = fn(*args, **kwargs)
+            future.set_result(result)
+            return result, False
+        except Exception as e:
+            logging.error(f"Single-flight call for {key!r} failed: {e}")
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+
+    def stream(self, key, fn, *args, timeout=None, **kwargs):
+        """
+        Stream fn(*args, **kwargs) unless a stream for the same key is in flight
+
+        The leader iterates the generator fn returns; followers get every
+        chunk it has produced so far and then each new one as it arrives.
+        If the leader's reader stops early while followers are still
+        reading, a background thread finishes the upstream for them.
+
+        Args:
+            key: Hashable key identifying identical calls
+            fn (callable): Function returning a generator
+            timeout (float, optional): Seconds a follower waits for each chunk
+
+        Yields:
+            Chunks produced by the leader's generator
+
+        Returns:
+            tuple: (result, shared) where result is the generator's return value,
+                None if the upstream was closed before it finished, and shared
+                is True for followers
+
+        Raises:
+            concurrent.futures.TimeoutError: If a follower's wait exceeds the timeout
+            Exception: Whatever the generator raised, for the leader and its followers
+        """
+        with self._lock:
+            flight = self._streams.get(key)
+            leader = flight is None
+            if leader:
+                flight = _StreamFlight()
+                self._streams[key] = flight
+                self._stats['leaders'] += 1
+            else:
+                flight.followers += 1
+                self._stats['followers'] += 1
+
+        if not leader:
+            result = yield from self._follow(flight, timeout)
+            return result, True
+
+        stream = None
+        handed_off = False
+        try:
+            stream = fn(*args, **kwargs)
+            while True:
+                try:
+                    chunk = next(stream)
+                except StopIteration as stop:
+                    flight.result = stop.value
+                    break
+                flight.publish(chunk)
+                yield chunk
+            return flight.result, False
+        except GeneratorExit:
+            handed_off = self._hand_off(key, flight, stream)
+            raise
+        except Exception as e:
+            logging.error(f"Single-flight stream for {key!r} failed: {e}")
+            flight.error = e
+            raise
+        finally:
+            if not handed_off:
+                self._end(key, flight, stream)
+
+    def _hand_off(self, key, flight, stream):
+        """
+        Keep an abandoned leader's upstream running while followers read it
+
+        Returns:
+            bool: True if a drain thread took over the upstream
+        """
+        with self._lock:
+            if stream is None or not flight.followers:
+                # Late arrivals start their own stream instead of joining a dead one
+                if self._streams.get(key) is flight:
+                    del self._streams[key]
+                return False
+        threading.Thread(
+            target=self._drain, args=(key, flight, stream),
+            name='single-flight-drain', daemon=True
+        ).start()
+        return True
+
+    def _drain(self, key, flight, stream):
+        try:
+            while True:
+                with self._lock:
+                    if not flight.followers:
+                        break
+                try:
+                    chunk = next(stream)
+                except StopIteration as stop:
+                    flight.result = stop.value
+                    break
+                flight.publish(chunk)
+        except Exception as e:
+            logging.error(f"Single-flight stream for {key!r} failed: {e}")
+            flight.error = e
+        finally:
+            self._end(key, flight, stream)
+
+    def _end(self, key, flight, stream):
+        # Closing an unfinished upstream frees its resources; result stays None
+        if stream is not None:
+            stream.close()
+        with self._lock:
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+        with flight.cond:
+            flight.done = True
+            flight.cond.notify_all()
+
+    def _follow(self, flight, timeout):
+        index = 0
+        try:
+            while True:
+                with flight.cond:
+                    ready = flight.cond.wait_for(lambda: len(flight.chunks) > index or flight.done, timeout)
+                    if not ready:
+                        raise FutureTimeoutError(f"No stream chunk within {timeout}s")
+                    chunks = flight.chunks[index:]
+                    done = flight.done
+                # Yielded outside the lock so a slow reader never holds up the leader
+                for chunk in chunks:
+                    yield chunk
+                index += len(chunks)
+                if done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return flight.result
+        finally:
+            with self._lock:
+                flight.followers -= 1
+
+    def stats(self):
+        """
+        Get counts of executions and coalesced calls
+
+        Returns:
+            dict: Leaders (executions), followers (coalesced calls) and keys in flight
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._flights) + len(self._streams)
+        return stats
@@ -0,0 +1,127 @@
+"""
+Startup-time report: import cost per module
+
+Runs a fresh interpreter with ``-X importtime`` for the given modules and
+prints the slowest imports, with this project's own modules listed first.
+Also lists the NLTK resources missing from NLTK_DATA_DIR, which are not
+downloaded at runtime unless NLTK_AUTO_DOWNLOAD is enabled.
+
+    python startup_report.py                     # app modules
+    python startup_report.py ml_model nlp --top 30
+    python startup_report.py --budget-ms 500     # exit 1 if over budget
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+# Modules imported by a chat worker, in import order
+DEFAULT_MODULES = ['nlp', 'responses', 'ml_model', 'gemini_client', 'cascade']
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def measure_imports(modules):
+    """
+    Import modules in a fresh interpreter and collect per-module import times
+
+    Args:
+        modules (list): Module names to import
+
+    Returns:
+        tuple: (list of (module, self_us, cumulative_us), total wall time in ms)
+    """
+    code = (
+        "import time; _start = time.perf_counter()\n"
+        + "".join(f"import {module}\n" for module in modules)
+        + "print((time.perf_counter() - _start) * 1000)"
+    )
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=PROJECT_DIR,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Import failed:\n{result.stderr[-2000:]}")
+
+    timings = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        parts = line[len('import time:'):].split('|')
+        self_us, cumulative_us, name = int(parts[0]), int(parts[1]), parts[2].strip()
+        timings.append((name, self_us, cumulative_us))
+
+    total_ms = float(result.stdout.strip().splitlines()[-1])
+    return timings, total_ms
+
+
+def is_project_module(name):
+    """
+    Check whether a module is one of this project's top-level files
+    """
+    return os.path.exists(os.path.join(PROJECT_DIR, f'{name}.py'))
+
+
+def report_nltk_resources():
+    """
+    Print the NLTK resources preprocessing needs but cannot find
+
+    Returns:
+        list: Missing download package names
+    """
+    import nlp
+
+    try:
+        missing = nlp.missing_nltk_resources()
+    except ImportError as e:
+        print(f"\nNLTK is not installed: {e}")
+        return list(package for _, package in nlp.NLTK_RESOURCES.values())
+
+    if not missing:
+        print(f"\nNLTK resources: all found ({nlp.NLTK_DATA_DIR} searched first)")
+        return missing
+    print(f"\nMissing NLTK resources: {', '.join(missing)}")
+    if nlp.NLTK_AUTO_DOWNLOAD:
+        print("  NLTK_AUTO_DOWNLOAD is enabled: they are downloaded on first use")
+    else:
+        print(f"  Vendor them with: python -m nltk.downloader -d {nlp.NLTK_DATA_DIR} {' '.join(missing)}")
+    return missing
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES, help='Modules to import')
+    parser.add_argument('--top', type=int, default=20, help='Number of slowest other imports to show')
+    parser.add_argument('--budget-ms', type=float, default=float(os.environ.get('STARTUP_BUDGET_MS', '0')),
+                        help='Fail if the total import time exceeds this many milliseconds')
+    args = parser.parse_args(argv)
+
+    timings, total_ms = measure_imports(args.modules)
+
+    print(f"Total import time for {', '.join(args.modules)}: {total_ms:.1f} ms\n")
+
+    print("Project modules (cumulative ms, self ms):")
+    for name, self_us, cumulative_us in timings:
+        if is_project_module(name):
+            print(f"  {cumulative_us / 1000:9.1f} {self_us / 1000:9.1f}  {name}")
+
+    print("\nSlowest other top-level imports (cumulative ms):")
+    top_level = [
+        (name, cumulative_us) for name, _, cumulative_us in timings
+        if '.' not in name and not is_project_module(name)
+    ]
+    for name, cumulative_us in sorted(top_level, key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:9.1f}  {name}")
+
+    report_nltk_resources()
+
+    if args.budget_ms and total_ms > args.budget_ms:
+        print(f"\nStartup budget exceeded: {total_ms:.1f} ms > {args.budget_ms:.1f} ms")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Tests for circuit breaker state transitions
+"""
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, 'monotonic', clock)
+    return clock
+
+
+def make_breaker(**kwargs):
+    options = dict(window_size=10, min_calls=4, failure_rate=0.5, slow_call_ms=100,
+                   slow_call_rate=0.8, open_seconds=10, max_open_seconds=30, half_open_calls=2)
+    options.update(kwargs)
+    return CircuitBreaker('test', **options)
+
+
+def trip(breaker):
+    for _ in range(breaker.min_calls):
+        breaker.record_failure()
+
+
+def test_stays_closed_below_min_calls(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record_failure()
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+
+
+def test_trips_on_failure_rate_and_rejects(clock):
+    breaker = make_breaker()
+    breaker.record_success(10)
+    breaker.record_success(10)
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+    stats = breaker.stats()
+    assert (stats['trips'], stats['rejected'], stats['state_value']) == (1, 1, 2)
+
+
+def test_trips_on_slow_call_rate(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_success(500)
+    assert breaker.state == OPEN
+
+
+def test_half_open_probes_close_the_breaker(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 10
+    assert breaker.state == HALF_OPEN
+
+    # Only half_open_calls probes are let through at once
+    assert breaker.allow_request()
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+    breaker.record_success(10)
+    assert breaker.state == HALF_OPEN
+    breaker.record_success(10)
+    assert breaker.state == CLOSED
+    assert breaker.stats()['window_calls'] == 0
+
+
+def test_failed_probe_reopens_with_doubled_period(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 10
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.stats()['open_period_seconds'] == 20
+
+    clock.now += 19
+    assert not breaker.allow_request()
+    clock.now += 1
+    assert breaker.allow_request()
+    breaker.record_success(500)  # A slow probe counts as failed
+    assert breaker.stats()['open_period_seconds'] == 30  # capped at max_open_seconds
+
+
+def test_abandoned_probe_frees_its_slot(clock):
+    breaker = make_breaker(half_open_calls=1)
+    trip(breaker)
+    clock.now += 10
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    breaker.record_abandoned()
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request()
+
+
+def test_close_resets_open_period(clock):
+    breaker = make_breaker(half_open_calls=1)
+    trip(breaker)
+    clock.now += 10
+    breaker.allow_request()
+    breaker.record_failure()
+    clock.now += 20
+    breaker.allow_request()
+    breaker.record_success(10)
+    assert breaker.state == CLOSED
+    assert breaker.stats()['open_period_seconds'] == 10
@@ -0,0 +1,96 @@
+"""
+Tests for keyset pagination of /history
+"""
+import json
+import base64
+from datetime import datetime, timedelta
+
+import pytest
+
+import db_pool
+from history import encode_cursor, decode_cursor, get_history_page, get_user_history_page
+
+START = datetime(2024, 1, 1, 12, 0, 0)
+
+
+@pytest.fixture
+def sessions(sqlite_db):
+    """
+    Two sessions of user 1 and one of user 2, with interleaved messages
+
+    Messages 5 and 6 share a timestamp, so pages must break ties on id.
+    """
+    rows = [
+        (1, 'user', 0), (2, 'bot', 1), (1, 'bot', 2), (2, 'user', 3), (1, 'user', 4), (2, 'bot', 4),
+        (3, 'user', 5),
+    ]
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.executemany('INSERT INTO chat_session (id, user_id) VALUES (%s, %s)', [(1, 1), (2, 1), (3, 2)])
+        cursor.executemany(
+            'INSERT INTO message (content, sender_type, timestamp, chat_session_id, client_id) VALUES (%s, %s, %s, %s, %s)',
+            [(f"message {i}", sender, START + timedelta(seconds=offset), session_id, f"c{i}")
+             for i, (session_id, sender, offset) in enumerate(rows, 1)]
+        )
+    return sqlite_db
+
+
+def read_all(get_page, *args, limit):
+    pages = []
+    cursor = None
+    while True:
+        page = get_page(*args, cursor=cursor, limit=limit)
+        pages.append([m['content'] for m in page['history']])
+        if not page['has_more']:
+            assert page['next_cursor'] is None
+            return pages
+        cursor = page['next_cursor']
+
+
+def test_cursor_round_trip():
+    message = {'id': 42, 'timestamp': START.isoformat()}
+    assert decode_cursor(encode_cursor(message)) == (START, 42)
+
+
+def test_cursor_from_before_timestamp_paging():
+    # Older cursors also carried the session id in front
+    legacy = base64.urlsafe_b64encode(json.dumps([3, START.isoformat(), 42]).encode('utf-8')).decode('ascii')
+    assert decode_cursor(legacy) == (START, 42)
+
+
+def test_invalid_cursor(sessions):
+    assert decode_cursor('not a cursor') is None
+    with pytest.raises(ValueError):
+        get_user_history_page(1, cursor='not a cursor')
+
+
+def test_user_history_pages_across_sessions(sessions):
+    pages = read_all(get_user_history_page, 1, limit=2)
+
+    # Newest page first, each page oldest first; user 2's message never shows
+    assert pages == [
+        ['message 5', 'message 6'],
+        ['message 3', 'message 4'],
+        ['message 1', 'message 2'],
+    ]
+
+
+def test_session_history_pages(sessions):
+    pages = read_all(get_history_page, [1], limit=2)
+    assert pages == [['message 3', 'message 5'], ['message 1']]
+
+
+def test_page_entries(sessions):
+    page = get_user_history_page(1, limit=1)
+    assert page['history'] == [{
+        'id': 6,
+        'client_id': 'c6',
+        'content': 'message 6',
+        'sender_type': 'bot',
+        'timestamp': (START + timedelta(seconds=4)).isoformat()
+    }]
+    assert decode_cursor(page['next_cursor']) == (START + timedelta(seconds=4), 6)
+
+
+def test_no_sessions():
+    assert get_history_page([]) == {'history': [], 'next_cursor': None, 'has_more': False}
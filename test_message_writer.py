@@ -0,0 +1,123 @@
+"""
+Tests for the write-behind message queue
+"""
+import threading
+from datetime import datetime, timedelta
+
+import db_pool
+from message_writer import MessageWriter, PendingMessage, insert_messages, merge_pending
+
+
+def stored_messages():
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT content, client_id FROM message ORDER BY id')
+        return cursor.fetchall()
+
+
+def test_failed_batch_is_retried_and_stays_pending():
+    written = []
+    pending_during_attempts = []
+
+    def flaky(records):
+        # Messages stay readable from memory until they are committed
+        pending_during_attempts.append([r.content for r in writer.pending_messages(1)])
+        if len(pending_during_attempts) < 3:
+            raise RuntimeError("connection reset")
+        written.extend(records)
+
+    writer = MessageWriter(flush_fn=flaky, retries=3, retry_backoff=0.001, flush_interval=0.01)
+    writer.enqueue(1, 'user', 'hello')
+    writer.close()
+
+    assert [r.content for r in written] == ['hello']
+    assert pending_during_attempts == [['hello']] * 3
+    assert writer.pending_messages(1) == []
+    stats = writer.stats()
+    assert (stats['written'], stats['retried'], stats['failed']) == (1, 2, 0)
+
+
+def test_batch_dropped_after_last_retry():
+    def failing(records):
+        raise RuntimeError("database down")
+
+    writer = MessageWriter(flush_fn=failing, retries=1, retry_backoff=0.001, flush_interval=0.01)
+    writer.enqueue(1, 'user', 'lost')
+    writer.close()
+
+    assert writer.pending_messages(1) == []
+    assert writer.stats()['failed'] == 1
+
+
+def test_retried_insert_is_idempotent(sqlite_db):
+    with db_pool.connection() as conn:
+        conn.cursor().execute('INSERT INTO chat_session (id, user_id) VALUES (1, 1)')
+    records = [PendingMessage(1, 'user', 'hi'), PendingMessage(1, 'bot', 'hello')]
+
+    # A commit whose outcome was lost is retried with the same client_ids
+    insert_messages(records)
+    insert_messages(records)
+
+    assert stored_messages() == [('hi', records[0].client_id), ('hello', records[1].client_id)]
+
+
+def test_enqueue_after_close_writes_inline():
+    written = []
+    writer = MessageWriter(flush_fn=written.extend)
+    writer.close()
+    writer.enqueue(1, 'user', 'late')
+
+    assert [r.content for r in written] == ['late']
+    assert writer.stats()['inline_writes'] == 1
+
+
+def test_close_writes_messages_put_after_final_drain():
+    written = []
+    writer = MessageWriter(flush_fn=written.extend, flush_interval=0.01)
+    put = writer._queue.put
+    release = threading.Event()
+
+    def slow_put(record, timeout=None):
+        # enqueue() is past the stop check but has not queued the message yet
+        release.wait(5)
+        put(record, timeout=timeout)
+
+    writer._queue.put = slow_put
+    enqueuing = threading.Thread(target=writer.enqueue, args=(1, 'user', 'racing'))
+    enqueuing.start()
+    while not writer.pending_messages(1):
+        pass
+    closing = threading.Thread(target=writer.close)
+    closing.start()
+    # The worker's final drain finishes before the message reaches the queue
+    writer._worker.join(5)
+    release.set()
+    closing.join(5)
+    enqueuing.join(5)
+
+    assert [r.content for r in written] == ['racing']
+    assert writer.pending_messages(1) == []
+
+
+def test_merge_pending_skips_committed_copies():
+    start = datetime(2024, 1, 1, 12, 0, 0)
+    committed = PendingMessage(1, 'user', 'first', start)
+    queued = PendingMessage(1, 'bot', 'second', start + timedelta(seconds=1))
+    history = [dict(committed.to_dict(), id=7)]
+
+    merged = merge_pending([committed, queued], history)
+
+    assert [(m['id'], m['content']) for m in merged] == [(7, 'first'), (None, 'second')]
+
+
+def test_merge_pending_orders_by_timestamp():
+    start = datetime(2024, 1, 1, 12, 0, 0)
+    queued = PendingMessage(1, 'user', 'middle', start + timedelta(seconds=1))
+    history = [
+        {'id': 1, 'client_id': 'a', 'content': 'old', 'sender_type': 'user', 'timestamp': start.isoformat()},
+        {'id': 2, 'client_id': 'b', 'content': 'new', 'sender_type': 'bot',
+         'timestamp': (start + timedelta(seconds=2)).isoformat()},
+    ]
+
+    assert [m['content'] for m in merge_pending([queued], history)] == ['old', 'middle', 'new']
+    assert merge_pending([], history) is history
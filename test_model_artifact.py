@@ -0,0 +1,44 @@
+"""
+Tests for exported model artifacts loaded back from disk
+"""
+import os
+
+import ml_model
+from model_artifact import export_artifact, load_artifact
+
+QUESTIONS = ["hello", "what is your name", "what can you do", "goodbye"]
+ANSWERS = ["Hi there!", "I am a chatbot.", "I can answer questions.", "Bye!"]
+
+
+def test_loaded_artifact_feeds_fallback_index(tmp_path, monkeypatch):
+    pipeline = ml_model.build_pipeline()
+    pipeline.fit(QUESTIONS, ANSWERS)
+    export_artifact(pipeline, str(tmp_path), 1, training_data=(QUESTIONS, ANSWERS))
+
+    model = load_artifact(str(tmp_path))
+    assert model.training_data() == (QUESTIONS, ANSWERS)
+
+    # A worker loading from disk has no in-memory training data
+    monkeypatch.setattr(ml_model, 'MODEL_ARTIFACT_DIR', str(tmp_path))
+    assert ml_model.load_model()
+    assert ml_model.model_training_data is None
+
+    index = ml_model.get_fallback_index()
+    assert len(index) == len(QUESTIONS)
+    answer, _, match_type = index.search("what is your name")
+    assert (answer, match_type) == ("I am a chatbot.", 'direct')
+
+
+def test_strings_round_trip_without_fixed_width(tmp_path):
+    long_answer = "é" * 10000
+    questions = QUESTIONS + ["où est la gare"]
+    answers = ANSWERS + [long_answer]
+    pipeline = ml_model.build_pipeline()
+    pipeline.fit(questions, answers)
+    version_path = export_artifact(pipeline, str(tmp_path), 1, training_data=(questions, answers))
+
+    model = load_artifact(str(tmp_path))
+    assert model.training_data() == (questions, answers)
+    assert model.predict(["où est la gare"])[0] == long_answer
+    # One long answer must not widen the short ones
+    assert os.path.getsize(os.path.join(version_path, 'classes_bytes.npy')) < 2 * len(long_answer.encode('utf-8'))
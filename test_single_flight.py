@@ -0,0 +1,186 @@
+"""
+Tests for single-flight coalescing of identical calls and streams
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def drain(gen):
+    """
+    Consume a stream() generator and return (chunks, return value)
+    """
+    chunks = []
+    while True:
+        try:
+            chunks.append(next(gen))
+        except StopIteration as stop:
+            return chunks, stop.value
+
+
+def test_do_shares_one_execution():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow(value):
+        calls.append(value)
+        started.set()
+        release.wait(5)
+        return value * 2
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        leader = pool.submit(flights.do, 'k', slow, 21)
+        assert started.wait(5)
+        followers = [pool.submit(flights.do, 'k', slow, 21) for _ in range(3)]
+        # Followers register before the leader is released
+        while flights.stats()['followers'] < 3:
+            pass
+        release.set()
+        assert leader.result(5) == (42, False)
+        assert [f.result(5) for f in followers] == [(42, True)] * 3
+
+    assert calls == [21]
+    assert flights.stats() == {'leaders': 1, 'followers': 3, 'in_flight': 0}
+
+
+def test_do_raises_leader_error_for_followers():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("upstream down")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(flights.do, 'k', failing)
+        assert started.wait(5)
+        follower = pool.submit(flights.do, 'k', failing)
+        while flights.stats()['followers'] < 1:
+            pass
+        release.set()
+        with pytest.raises(RuntimeError, match="upstream down"):
+            leader.result(5)
+        with pytest.raises(RuntimeError, match="upstream down"):
+            follower.result(5)
+
+    # A failed flight is not cached; the next call runs again
+    assert flights.do('k', lambda: 'ok') == ('ok', False)
+
+
+def test_do_follower_timeout():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return 'late'
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        leader = pool.submit(flights.do, 'k', slow)
+        assert started.wait(5)
+        with pytest.raises(FutureTimeoutError):
+            flights.do('k', slow, timeout=0.05)
+        release.set()
+        assert leader.result(5) == ('late', False)
+
+
+def gated_stream(gate, chunks, result='done', error=None):
+    for chunk in chunks:
+        gate.wait(5)
+        yield chunk
+    if error is not None:
+        raise error
+    return result
+
+
+def test_stream_followers_replay_and_follow():
+    flights = SingleFlight()
+    gate = threading.Event()
+    gate.set()
+    leader = flights.stream('k', gated_stream, gate, ['a', 'b', 'c'])
+    assert next(leader) == 'a'
+
+    # A follower joining mid-stream still gets the chunks already produced
+    follower = flights.stream('k', gated_stream, gate, ['x'])
+    assert next(follower) == 'a'
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        followed = pool.submit(drain, follower)
+        assert drain(leader) == (['b', 'c'], ('done', False))
+        assert followed.result(5) == (['b', 'c'], ('done', True))
+    assert flights.stats()['in_flight'] == 0
+
+
+def test_stream_follower_gets_leader_error():
+    flights = SingleFlight()
+    gate = threading.Event()
+    gate.set()
+    leader = flights.stream('k', gated_stream, gate, ['a'], error=RuntimeError("cut off"))
+    assert next(leader) == 'a'
+    follower = flights.stream('k', gated_stream, gate, [])
+    assert next(follower) == 'a'
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        followed = pool.submit(drain, follower)
+        with pytest.raises(RuntimeError, match="cut off"):
+            next(leader)
+        with pytest.raises(RuntimeError, match="cut off"):
+            followed.result(5)
+
+
+def test_stream_follower_timeout():
+    flights = SingleFlight()
+    gate = threading.Event()
+    leader = flights.stream('k', gated_stream, gate, ['a', 'b'])
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        # The leader blocks on the gate before its first chunk
+        first = pool.submit(next, leader)
+        while flights.stats()['in_flight'] < 1:
+            pass
+        follower = flights.stream('k', gated_stream, gate, [], timeout=0.05)
+        with pytest.raises(FutureTimeoutError):
+            next(follower)
+        gate.set()
+        assert first.result(5) == 'a'
+    leader.close()
+
+
+def test_stream_abandoned_leader_hands_off_to_followers():
+    flights = SingleFlight()
+    gate = threading.Event()
+    gate.set()
+    leader = flights.stream('k', gated_stream, gate, ['a', 'b', 'c'])
+    assert next(leader) == 'a'
+    follower = flights.stream('k', gated_stream, gate, [])
+    assert next(follower) == 'a'
+
+    # The leader's client goes away; the follower still gets the full answer
+    leader.close()
+    assert drain(follower) == (['b', 'c'], ('done', True))
+
+
+def test_stream_abandoned_without_followers_is_closed():
+    flights = SingleFlight()
+    closed = []
+
+    def tracked():
+        try:
+            yield 'a'
+            yield 'b'
+        finally:
+            closed.append(True)
+
+    leader = flights.stream('k', tracked)
+    assert next(leader) == 'a'
+    leader.close()
+    assert closed == [True]
+    assert flights.stats()['in_flight'] == 0